@@ -1,134 +1,3866 @@
-import tkinter as tk
-from tkinter import messagebox, simpledialog
 import sys
+import os
+import time
+import mmap
+import struct
+import threading
+import queue
+import contextlib
+import random
+import collections
+import functools
+import json
+import csv
+import zlib
+import bisect
+import itertools
+import importlib
+from array import array
+from collections.abc import MutableMapping, Sequence
+
+class _LazyModule:
+    #Stand-in for a module that is imported on first use, to keep startup fast
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self._name)
+        globals()[self._name] = module
+        return getattr(module, attr)
+
+# Only the server, the top-up queue and the sharded ledger need these
+asyncio = _LazyModule("asyncio")
+multiprocessing = _LazyModule("multiprocessing")
+
+# NumPy is optional and slow to import; post_batch loads it on first use
+_NOT_LOADED = object()
+np = _NOT_LOADED
+
+def _load_numpy():
+    #Import NumPy once; None if it is not installed (post_batch then uses a plain loop)
+    global np
+    if np is _NOT_LOADED:
+        try:
+            import numpy
+            np = numpy
+        except ImportError:
+            np = None
+    return np
+
+# Tk is only needed by the GUI; _load_tk() imports it when the GUI starts
+tk = messagebox = simpledialog = filedialog = None
+
+def _load_tk():
+    #Import tkinter and its dialogs into the module globals; returns the tkinter module
+    global tk, messagebox, simpledialog, filedialog
+    if tk is None:
+        import tkinter
+        from tkinter import messagebox, simpledialog, filedialog
+        tk = tkinter
+    return tk
 
 class BankingError(Exception):
     #Base exception class for banking application errors
     pass
 
-class InsufficientFundsError(BankingError):
-    #Exception raised when account has insufficient funds
-    pass
+class InsufficientFundsError(BankingError):
+    #Exception raised when account has insufficient funds
+    pass
+
+class InvalidAmountError(BankingError):
+    #Exception raised when an invalid amount is entered
+    pass
+
+class AccountNotFoundError(BankingError):
+    #Exception raised when an account is not found
+    pass
+
+class DuplicateAccountError(BankingError):
+    #Exception raised when an account holder name is already taken
+    pass
+
+class NoAccountSelectedError(BankingError):
+    #Exception raised when an operation needs a selected account
+    pass
+
+class InvalidTransferError(BankingError):
+    #Exception raised when a transfer is not allowed between the given accounts
+    pass
+
+class InvalidRecordError(BankingError):
+    #Exception raised when an imported record is malformed
+    pass
+
+class TransactionLimitError(BankingError):
+    #Exception raised when a transaction would break a sliding-window limit
+    pass
+
+class TopupDeliveryError(BankingError):
+    #Exception raised when a mobile top-up cannot be delivered to the carrier
+
+    def __init__(self, message, permanent=False):
+        super().__init__(message)
+        self.permanent = permanent  # False: worth retrying later
+
+# Transaction kinds stored in the compact history buffer
+DEPOSIT = 1
+WITHDRAWAL = 2
+TRANSFER_OUT = 3
+TRANSFER_IN = 4
+TOPUP = 5
+REFUND = 6
+
+# Flag bit set on the stored kind when the amount was given as an int,
+# so the rendered history keeps showing "200" rather than "200.0"
+_INT_AMOUNT = 0x80
+
+# Packed party index meaning "no counterparty"
+_NO_PARTY = array("i", [-1]).tobytes()
+
+_TRANSACTION_FORMATS = {
+    DEPOSIT: "Deposited: {0}",
+    WITHDRAWAL: "Withdrew: {0}",
+    TRANSFER_OUT: "Transferred: {0} to {1}",
+    TRANSFER_IN: "Received: {0} from {1}",
+    TOPUP: "Mobile top-up: {0} to {1}",
+    REFUND: "Refunded: {0} for top-up to {1}",
+}
+
+# Transaction kinds that add to the balance; the others take from it
+_CREDIT_KINDS = frozenset((DEPOSIT, TRANSFER_IN, REFUND))
+
+# Transactions between two running-balance checkpoints
+_CHECKPOINT_EVERY = 64
+
+class BalanceCheckpoints:
+    #Running net flow of a TransactionLog, saved every _CHECKPOINT_EVERY entries
+    __slots__ = ("prefix", "total", "ordered", "last_time")
+
+    def __init__(self):
+        self.prefix = array("d", [0.0])  # prefix[j]: net flow of the first j * _CHECKPOINT_EVERY entries
+        self.total = 0.0
+        self.ordered = True  # timestamps never decrease, so they can be bisected
+        self.last_time = float("-inf")
+
+    def add(self, position, kind, amount, timestamp):
+        #Account for the entry at `position` (entries must be added in order)
+        self.total += amount if kind in _CREDIT_KINDS else -amount
+        if timestamp < self.last_time:
+            self.ordered = False
+        else:
+            self.last_time = timestamp
+        if (position + 1) % _CHECKPOINT_EVERY == 0:
+            self.prefix.append(self.total)
+
+class Transaction:
+    #A single structured transaction record
+    __slots__ = ("kind", "amount", "counterparty", "timestamp")
+
+    def __init__(self, kind, amount, counterparty=None, timestamp=None):
+        """
+        Initialize a transaction record
+        
+        Args:
+            kind (int): One of DEPOSIT, WITHDRAWAL, TRANSFER_OUT, TRANSFER_IN, TOPUP, REFUND
+            amount (float): Amount moved by the transaction
+            counterparty (str): Other account name or phone number, if any
+            timestamp (float): Unix time the transaction was posted
+        """
+        self.kind = kind
+        self.amount = amount
+        self.counterparty = counterparty
+        self.timestamp = timestamp
+
+    def __str__(self):
+        """Render the transaction the way the history has always shown it"""
+        return _TRANSACTION_FORMATS[self.kind].format(self.amount, self.counterparty)
+
+    def __repr__(self):
+        return (f"Transaction(kind={self.kind}, amount={self.amount}, "
+                f"counterparty={self.counterparty!r}, timestamp={self.timestamp})")
+
+    def __eq__(self, other):
+        if not isinstance(other, Transaction):
+            return NotImplemented
+        return (self.kind, self.amount, self.counterparty, self.timestamp) == \
+            (other.kind, other.amount, other.counterparty, other.timestamp)
+
+# Width of the precomputed aggregate buckets, in seconds
+_DAY = 86400
+
+class TransactionIndex:
+    #Secondary indexes and running aggregates over one TransactionLog
+    __slots__ = ("by_kind", "by_party", "daily_totals", "party_totals", "time_sorted", "_last_time")
+
+    def __init__(self):
+        self.by_kind = {}        # kind -> positions
+        self.by_party = {}       # party index -> positions
+        self.daily_totals = {}   # (kind, day number) -> total amount
+        self.party_totals = {}   # (kind, party index) -> total amount
+        self.time_sorted = True  # False once a timestamp goes backwards
+        self._last_time = float("-inf")
+
+    def add(self, position, kind, amount, party, timestamp):
+        #Index one appended transaction (kind without the int flag)
+        positions = self.by_kind.get(kind)
+        if positions is None:
+            positions = self.by_kind[kind] = array("I")
+        positions.append(position)
+        key = (kind, int(timestamp // _DAY))
+        self.daily_totals[key] = self.daily_totals.get(key, 0) + amount
+        if party >= 0:
+            positions = self.by_party.get(party)
+            if positions is None:
+                positions = self.by_party[party] = array("I")
+            positions.append(position)
+            key = (kind, party)
+            self.party_totals[key] = self.party_totals.get(key, 0) + amount
+        if timestamp < self._last_time:
+            self.time_sorted = False
+        self._last_time = timestamp
+
+class TransactionPage:
+    #One page of query results plus the cursor for the next page
+
+    def __init__(self, records, next_cursor):
+        """
+        Initialize a result page
+        
+        Args:
+            records (list): Matching Transaction records, oldest first
+            next_cursor (int): Cursor to pass for the next page, or None at the end
+        """
+        self.records = records
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __len__(self):
+        return len(self.records)
+
+# Transactions per compressed history segment (the unit read back from disk)
+SEGMENT_ENTRIES = 4096
+
+# Decoded segments kept in memory across all logs, most recently used last
+_SEGMENT_CACHE_SIZE = 32
+_segment_cache = collections.OrderedDict()
+_segment_cache_lock = threading.Lock()
+
+class HistoryArchive:
+    #Append-only files of zlib-compressed, immutable history segments, read through mmap
+
+    def __init__(self, directory, file_size=64 << 20):
+        """
+        Initialize an archive
+        
+        Segments are appended to the current file until it reaches file_size;
+        a sealed file is never written again. The archive is a memory tier
+        for the running process: its files are removed by close(), and a
+        Ledger snapshot always holds the full history.
+        
+        Args:
+            directory (str): Where to keep the segment files
+            file_size (int): Bytes per file before a new one is started
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.file_size = file_size
+        self._number = 0
+        self._file = None
+        self._maps = {}  # file number -> mmap of it
+        self._lock = threading.Lock()
+
+    def _path(self, number):
+        return os.path.join(self.directory, f"history-{os.getpid()}-{number:06d}.seg")
+
+    def write(self, payload):
+        #Store a compressed segment; returns its (file number, offset, length)
+        with self._lock:
+            if self._file is None or self._file.tell() + len(payload) > self.file_size:
+                if self._file is not None:
+                    self._file.close()
+                self._number += 1
+                self._file = open(self._path(self._number), "wb")
+            offset = self._file.tell()
+            self._file.write(payload)
+            self._file.flush()
+            return self._number, offset, len(payload)
+
+    def read(self, number, offset, length):
+        #Return the compressed bytes of a segment
+        with self._lock:
+            mm = self._maps.get(number)
+            if mm is None or offset + length > len(mm):
+                if mm is not None:
+                    mm.close()
+                with open(self._path(number), "rb") as f:
+                    mm = self._maps[number] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return mm[offset:offset + length]
+
+    def close(self):
+        #Unmap and delete every segment file
+        with self._lock:
+            for mm in self._maps.values():
+                mm.close()
+            self._maps.clear()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            for number in range(1, self._number + 1):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(self._path(number))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class _SpilledHistory:
+    #Small in-memory index of the segments holding the oldest part of one log
+    __slots__ = ("archive", "starts", "segments", "count")
+
+    def __init__(self, archive):
+        self.archive = archive
+        self.starts = array("q")  # first position of each segment
+        self.segments = []        # (entries, file number, offset, length) per segment
+        self.count = 0            # entries spilled
+
+    def add(self, kinds, amounts, parties, times):
+        #Compress and store the next segment of columns
+        payload = zlib.compress(kinds.tobytes() + amounts.tobytes() + parties.tobytes() + times.tobytes())
+        self.starts.append(self.count)
+        self.segments.append((len(kinds),) + self.archive.write(payload))
+        self.count += len(kinds)
+
+    def columns(self, s):
+        #Decoded (kinds, amounts, parties, times) of segment s, through the shared cache
+        entries, number, offset, length = self.segments[s]
+        key = (id(self.archive), number, offset)
+        with _segment_cache_lock:
+            columns = _segment_cache.get(key)
+            if columns is not None:
+                _segment_cache.move_to_end(key)
+                return columns
+        raw = zlib.decompress(self.archive.read(number, offset, length))
+        columns = []
+        position = 0
+        for typecode in "Bdid":
+            column = array(typecode)
+            size = entries * column.itemsize
+            column.frombytes(raw[position:position + size])
+            position += size
+            columns.append(column)
+        with _segment_cache_lock:
+            _segment_cache[key] = columns
+            while len(_segment_cache) > _SEGMENT_CACHE_SIZE:
+                _segment_cache.popitem(last=False)
+        return columns
+
+class _TieredColumn:
+    #One history column read across the spilled segments and the in-memory tail
+    __slots__ = ("_spilled", "_column", "_tail")
+
+    def __init__(self, spilled, column, tail):
+        self._spilled = spilled
+        self._column = column
+        self._tail = tail
+
+    def __len__(self):
+        return self._spilled.count + len(self._tail)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        spilled = self._spilled
+        if i >= spilled.count:
+            return self._tail[i - spilled.count]
+        if i < 0:
+            raise IndexError("transaction index out of range")
+        s = bisect.bisect_right(spilled.starts, i) - 1
+        return spilled.columns(s)[self._column][i - spilled.starts[s]]
+
+    def tobytes(self):
+        spilled = self._spilled
+        return b"".join([spilled.columns(s)[self._column].tobytes() for s in range(len(spilled.segments))]
+                        + [self._tail.tobytes()])
+
+class TransactionLog:
+    #Columnar, array-backed transaction history for one account
+    __slots__ = ("_kinds", "_amounts", "_parties", "_times", "_party_names", "_party_ids", "_index",
+                 "_checkpoints", "_base", "_spilled")
+
+    def __init__(self):
+        self._kinds = array("B")
+        self._amounts = array("d")
+        self._parties = array("i")  # index into _party_names, -1 for none
+        self._times = array("d")
+        self._party_names = []
+        self._party_ids = {}
+        self._index = None  # TransactionIndex, built on the first query
+        self._checkpoints = None  # BalanceCheckpoints, built on the first point-in-time lookup
+        self._base = 0  # entries moved to disk; the columns above hold the ones after them
+        self._spilled = None  # _SpilledHistory once old entries are spilled
+
+    def append(self, kind, amount, counterparty=None, timestamp=None):
+        """
+        Append a transaction to the history
+        
+        Args:
+            kind (int): Transaction kind constant
+            amount (float): Amount of the transaction
+            counterparty (str): Other account name or phone number, if any
+            timestamp (float): Posting time (defaults to now)
+            
+        Returns:
+            int: Position of the new transaction in the history
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        party = -1 if counterparty is None else self._party_index(counterparty)
+        position = self._base + len(self._kinds)
+        # _kinds goes last: its length is the log's length, so a reader on
+        # another thread (the GUI) never sees a half-appended entry
+        self._amounts.append(amount)
+        self._parties.append(party)
+        self._times.append(timestamp)
+        self._kinds.append(kind | _INT_AMOUNT if type(amount) is int else kind)
+        if self._index is not None:
+            self._index.add(position, kind, amount, party, timestamp)
+        if self._checkpoints is not None:
+            self._checkpoints.add(position, kind, amount, timestamp)
+        return position
+
+    def extend_packed(self, kinds, amounts, counterparties=None, timestamp=None):
+        """
+        Append many transactions at once from packed column data
+        
+        Args:
+            kinds (bytes): One unsigned byte per entry (kind, with the int flag)
+            amounts (bytes): One native double per entry
+            counterparties (list): Counterparty per entry, or None if no entry has one
+            timestamp (float): Posting time for all entries (defaults to now)
+        """
+        count = len(kinds)
+        first = len(self)
+        self._amounts.frombytes(amounts)
+        if counterparties is None:
+            self._parties.frombytes(_NO_PARTY * count)
+        else:
+            self._parties.extend([-1 if cp is None else self._party_index(cp) for cp in counterparties])
+        self._times.frombytes(array("d", [time.time() if timestamp is None else timestamp]).tobytes() * count)
+        self._kinds.frombytes(kinds)
+        self._catch_up(first)
+
+    def extend(self, entries):
+        """
+        Append many transactions
+        
+        Args:
+            entries (list): (kind, amount, counterparty, timestamp) tuples
+        """
+        if not entries:
+            return
+        first = len(self)
+        kinds, amounts, counterparties, timestamps = zip(*entries)
+        self._amounts.extend(amounts)
+        self._parties.extend([-1 if cp is None else self._party_index(cp) for cp in counterparties])
+        self._times.extend(timestamps)
+        self._kinds.extend([kind | _INT_AMOUNT if type(amount) is int else kind
+                            for kind, amount in zip(kinds, amounts)])
+        self._catch_up(first)
+
+    def _catch_up(self, first):
+        #Feed entries appended in bulk from position `first` into the built indexes
+        if self._index is not None:
+            self._index_range(self._index, first, len(self))
+        if self._checkpoints is not None:
+            self._checkpoint_range(self._checkpoints, first, len(self))
+
+    def _columns(self):
+        #(kinds, amounts, parties, times) over the whole history, including spilled entries
+        if self._spilled is None:
+            return self._kinds, self._amounts, self._parties, self._times
+        spilled = self._spilled
+        return (_TieredColumn(spilled, 0, self._kinds), _TieredColumn(spilled, 1, self._amounts),
+                _TieredColumn(spilled, 2, self._parties), _TieredColumn(spilled, 3, self._times))
+
+    def _scan_columns(self, start):
+        #(offset, columns) for a sequential pass from start: position i is at columns[...][i - offset].
+        #Spilled entries are decoded once for the pass
+        if start >= self._base:
+            return self._base, (self._kinds, self._amounts, self._parties, self._times)
+        return 0, tuple(array(typecode, column.tobytes()) for typecode, column in zip("Bdid", self._columns()))
+
+    def spill(self, archive, keep=1000):
+        """
+        Move old transactions out of memory into compressed archive segments
+        
+        Whole segments of SEGMENT_ENTRIES are written, leaving at least the
+        newest `keep` transactions in memory. Spilled entries stay readable
+        (history pages, queries, point-in-time balances) and are decompressed
+        one segment at a time when needed. The query index is dropped and
+        rebuilt on the next query.
+        
+        Args:
+            archive (HistoryArchive): Where to write the segments
+            keep (int): Newest transactions to leave in memory
+            
+        Returns:
+            int: Number of transactions spilled
+        """
+        count = (len(self._kinds) - keep) // SEGMENT_ENTRIES * SEGMENT_ENTRIES
+        if count <= 0:
+            return 0
+        if self._spilled is None:
+            self._spilled = _SpilledHistory(archive)
+        elif self._spilled.archive is not archive:
+            raise ValueError("History is already spilled to another archive")
+        columns = (self._kinds, self._amounts, self._parties, self._times)
+        for start in range(0, count, SEGMENT_ENTRIES):
+            self._spilled.add(*(column[start:start + SEGMENT_ENTRIES] for column in columns))
+        self._kinds, self._amounts, self._parties, self._times = (column[count:] for column in columns)
+        self._base += count
+        self._index = None
+        return count
+
+    def _index_range(self, index, start, stop):
+        #Feed positions start..stop into an index
+        offset, (kinds, amounts, parties, times) = self._scan_columns(start)
+        for i in range(start, stop):
+            j = i - offset
+            index.add(i, kinds[j] & ~_INT_AMOUNT, amounts[j], parties[j], times[j])
+
+    def _checkpoint_range(self, checkpoints, start, stop):
+        #Feed positions start..stop into the running-balance checkpoints
+        offset, (kinds, amounts, _, times) = self._scan_columns(start)
+        for i in range(start, stop):
+            j = i - offset
+            checkpoints.add(i, kinds[j] & ~_INT_AMOUNT, amounts[j], times[j])
+
+    def checkpoints(self):
+        #Return the running-balance checkpoints, building them on first use
+        if self._checkpoints is None:
+            checkpoints = BalanceCheckpoints()
+            self._checkpoint_range(checkpoints, 0, len(self))
+            self._checkpoints = checkpoints
+        return self._checkpoints
+
+    def net_until(self, timestamp):
+        """
+        Net flow (credits minus debits) of the transactions posted at or before a time
+        
+        With time-ordered history this is a binary search for the position
+        plus a replay of at most _CHECKPOINT_EVERY entries from the nearest
+        checkpoint. Histories whose timestamps go backwards (e.g. imported
+        out of order) fall back to a full scan.
+        
+        Args:
+            timestamp (float): Point in time (seconds since the epoch)
+            
+        Returns:
+            float: Net amount added to the balance by then
+        """
+        checkpoints = self.checkpoints()
+        kinds, amounts, _, times = self._columns()
+        if not checkpoints.ordered:
+            return sum(amounts[i] if kinds[i] & ~_INT_AMOUNT in _CREDIT_KINDS else -amounts[i]
+                       for i in range(len(kinds)) if times[i] <= timestamp)
+        position = bisect.bisect_right(times, timestamp)
+        block = position // _CHECKPOINT_EVERY
+        net = checkpoints.prefix[block]
+        for i in range(block * _CHECKPOINT_EVERY, position):
+            net += amounts[i] if kinds[i] & ~_INT_AMOUNT in _CREDIT_KINDS else -amounts[i]
+        return net
+
+    def index(self):
+        #Return the secondary index, building it on first use
+        if self._index is None:
+            index = TransactionIndex()
+            self._index_range(index, 0, len(self))
+            self._index = index
+        return self._index
+
+    def query(self, kind=None, counterparty=None, phone=None, min_amount=None, max_amount=None,
+              start_time=None, end_time=None, limit=100, cursor=None):
+        """
+        Find transactions matching all given filters, oldest first
+        
+        The kind and counterparty indexes pick the candidate positions and the
+        time range is found by binary search, so only candidates are examined.
+        
+        Args:
+            kind (int): Transaction kind constant
+            counterparty (str): Other account name or phone number
+            phone (str): Phone number of a mobile top-up (implies kind=TOPUP)
+            min_amount (float): Smallest amount to include
+            max_amount (float): Largest amount to include
+            start_time (float): Earliest timestamp to include
+            end_time (float): Timestamp to stop before
+            limit (int): Most records to return
+            cursor (int): next_cursor from the previous page
+            
+        Returns:
+            TransactionPage: Matching records and the cursor for the next page
+        """
+        index = self.index()
+        kinds, amounts, _, times = self._columns()
+        if phone is not None:
+            kind, counterparty = TOPUP, phone
+        if counterparty is not None:
+            party = self._party_ids.get(counterparty)
+            candidates = index.by_party.get(party, ()) if party is not None else ()
+        elif kind is not None:
+            candidates = index.by_kind.get(kind, ())
+        else:
+            candidates = range(len(self))
+        check_kind = kind is not None and counterparty is not None
+        check_time = not index.time_sorted
+
+        lo, hi = 0, len(candidates)
+        if not check_time:
+            if start_time is not None:
+                lo = bisect.bisect_left(candidates, bisect.bisect_left(times, start_time))
+            if end_time is not None:
+                hi = bisect.bisect_left(candidates, bisect.bisect_left(times, end_time))
+        if cursor is not None:
+            lo = max(lo, bisect.bisect_left(candidates, cursor))
+
+        records = []
+        next_cursor = None
+        for i in range(lo, hi):
+            position = candidates[i]
+            if len(records) == limit:
+                next_cursor = position
+                break
+            if check_kind and kinds[position] & ~_INT_AMOUNT != kind:
+                continue
+            amount = amounts[position]
+            if (min_amount is not None and amount < min_amount) or \
+                    (max_amount is not None and amount > max_amount):
+                continue
+            if check_time:
+                timestamp = times[position]
+                if (start_time is not None and timestamp < start_time) or \
+                        (end_time is not None and timestamp >= end_time):
+                    continue
+            records.append(self._record(position))
+        return TransactionPage(records, next_cursor)
+
+    def totals_by_period(self, kind=DEPOSIT, days=1):
+        """
+        Total amount of one kind of transaction per period
+        
+        Args:
+            kind (int): Transaction kind constant
+            days (int): Period length in whole (UTC) days
+            
+        Returns:
+            dict: Period start (Unix time) -> total amount
+        """
+        totals = {}
+        for (entry_kind, day), amount in self.index().daily_totals.items():
+            if entry_kind == kind:
+                start = (day // days) * days * _DAY
+                totals[start] = totals.get(start, 0) + amount
+        return dict(sorted(totals.items()))
+
+    def counterparties(self, kind):
+        #Distinct counterparties of one kind of transaction (no index is built)
+        if self._index is not None:
+            parties = {party for entry_kind, party in self._index.party_totals if entry_kind == kind}
+        else:
+            kinds, _, parties, _ = self._columns()
+            parties = {party for i, party in enumerate(parties)
+                       if party >= 0 and kinds[i] & ~_INT_AMOUNT == kind}
+        return [self._party_names[party] for party in parties]
+
+    def totals_by_counterparty(self, kind=TOPUP):
+        """
+        Total amount of one kind of transaction per counterparty
+        
+        Args:
+            kind (int): Transaction kind (TOPUP gives totals per phone number)
+            
+        Returns:
+            dict: Counterparty -> total amount
+        """
+        return {self._party_names[party]: amount
+                for (entry_kind, party), amount in self.index().party_totals.items()
+                if entry_kind == kind}
+
+    def positions_between(self, start, end):
+        #Positions of the transactions posted after start and at or before end
+        times = self._columns()[3]
+        if self.checkpoints().ordered:
+            return range(bisect.bisect_right(times, start), bisect.bisect_right(times, end))
+        return [i for i in range(len(times)) if start < times[i] <= end]
+
+    def __getstate__(self):
+        #Pickle as snapshot bytes; the lazy indexes are rebuilt where they are needed
+        return b"".join(self._pack())
+
+    def __setstate__(self, state):
+        log, _ = TransactionLog._unpack(state, 0)
+        for name in TransactionLog.__slots__:
+            setattr(self, name, getattr(log, name))
+
+    def _pack(self):
+        #Serialize the log columns for a ledger snapshot
+        names = b"".join(_pack_str(name) for name in self._party_names)
+        return [_LOG_HEADER.pack(len(self), len(self._party_names)), names,
+                *(column.tobytes() for column in self._columns())]
+
+    @classmethod
+    def _unpack(cls, buf, offset):
+        #Rebuild a log from snapshot bytes; returns (log, next offset)
+        count, party_count = _LOG_HEADER.unpack_from(buf, offset)
+        offset += _LOG_HEADER.size
+        log = cls()
+        for _ in range(party_count):
+            name, offset = _unpack_str(buf, offset)
+            log._party_ids[name] = len(log._party_names)
+            log._party_names.append(name)
+        for column in (log._kinds, log._amounts, log._parties, log._times):
+            size = count * column.itemsize
+            column.frombytes(buf[offset:offset + size])
+            offset += size
+        return log, offset
+
+    def _party_index(self, counterparty):
+        #Return the interned index of a counterparty, adding it if new
+        party = self._party_ids.get(counterparty)
+        if party is None:
+            party = self._party_ids[counterparty] = len(self._party_names)
+            self._party_names.append(counterparty)
+        return party
+
+    def __len__(self):
+        return self._base + len(self._kinds)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._record(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("transaction index out of range")
+        return self._record(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._record(i)
+
+    def _record(self, i):
+        #Build a Transaction object for position i
+        if i < self._base:
+            kinds, amounts, parties, times = self._columns()
+        else:
+            kinds, amounts, parties, times = self._kinds, self._amounts, self._parties, self._times
+            i -= self._base
+        kind = kinds[i]
+        amount = amounts[i]
+        if kind & _INT_AMOUNT:
+            kind &= ~_INT_AMOUNT
+            amount = int(amount)
+        party = parties[i]
+        counterparty = self._party_names[party] if party >= 0 else None
+        return Transaction(kind, amount, counterparty, times[i])
+
+    def render(self, start=0, stop=None):
+        """
+        Render a range of the history as display strings
+        
+        Args:
+            start (int): First position to render
+            stop (int): Position to stop before (default: end of history)
+            
+        Returns:
+            list: Rendered transaction strings
+        """
+        start, stop, _ = slice(start, stop).indices(len(self))
+        return [str(self._record(i)) for i in range(start, stop)]
+
+class TransactionView(Sequence):
+    #Read-only view rendering a TransactionLog as the familiar strings
+
+    def __init__(self, log):
+        self._log = log
+
+    def __len__(self):
+        return len(self._log)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [str(txn) for txn in self._log[index]]
+        return str(self._log[index])
+
+    def __iter__(self):
+        for txn in self._log:
+            yield str(txn)
+
+    def __eq__(self, other):
+        if isinstance(other, Sequence) and not isinstance(other, str):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return f"TransactionView({list(self)!r})"
+
+class _NoLocks:
+    #Stand-in used while concurrency mode is off: holding accounts costs nothing
+    _held = contextlib.nullcontext()
+
+    def hold(self, account, other=None):
+        return self._held
+
+    def hold_many(self, accounts):
+        return self._held
+
+class _LockSet:
+    #Context manager acquiring a set of stripe locks in ascending stripe order
+
+    def __init__(self, locks):
+        self._locks = locks
+
+    def __enter__(self):
+        for lock in self._locks:
+            lock.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        for lock in reversed(self._locks):
+            lock.release()
+
+class LockStripes:
+    #Fixed pool of locks shared by accounts, picked by account identity
+
+    def __init__(self, count=64):
+        """
+        Initialize the lock pool
+        
+        Args:
+            count (int): Number of stripes (more stripes, fewer false conflicts)
+        """
+        self._locks = [threading.Lock() for _ in range(count)]
+
+    def stripe(self, account):
+        #Stripe index guarding an account
+        return account.account_id % len(self._locks)
+
+    def hold(self, account, other=None):
+        """
+        Lock one account, or two accounts without risk of deadlock
+        
+        Stripes are always taken in ascending order, so transfers running in
+        opposite directions between the same accounts cannot deadlock.
+        """
+        first = self.stripe(account)
+        if other is None:
+            return self._locks[first]
+        second = self.stripe(other)
+        if first == second:
+            return self._locks[first]
+        if first > second:
+            first, second = second, first
+        return _LockSet((self._locks[first], self._locks[second]))
+
+    def hold_many(self, accounts):
+        #Lock every stripe used by the given accounts, in ascending order
+        stripes = sorted({self.stripe(account) for account in accounts})
+        return _LockSet([self._locks[i] for i in stripes])
+
+def enable_concurrency(stripes=64):
+    """
+    Make BankAccount operations safe to call from many threads
+    
+    Args:
+        stripes (int): Number of lock stripes shared by all accounts
+    """
+    BankAccount._locks = LockStripes(stripes)
+
+def disable_concurrency():
+    #Return to unsynchronized single-threaded operation
+    BankAccount._locks = _NoLocks()
+
+class LimitPolicy:
+    #A sliding-window limit on one transaction kind
+
+    def __init__(self, kind, window, max_amount=None, max_count=None, buckets=60):
+        """
+        Initialize a policy
+        
+        Args:
+            kind (int): Transaction kind limited (e.g. TOPUP, WITHDRAWAL)
+            window (float): Window length in seconds (3600 = hourly, 86400 = daily)
+            max_amount (float): Most total amount allowed per window, or None
+            max_count (int): Most transactions allowed per window, or None
+            buckets (int): Slices the window is counted in; the window slides
+                one slice (window / buckets seconds) at a time
+        """
+        self.kind = kind
+        self.window = window
+        self.max_amount = max_amount
+        self.max_count = max_count
+        self.buckets = buckets
+
+    def __repr__(self):
+        return (f"LimitPolicy(kind={self.kind}, window={self.window}, "
+                f"max_amount={self.max_amount}, max_count={self.max_count})")
+
+# Example policies: at most 10 top-ups an hour and 50k withdrawn a day
+DEFAULT_LIMITS = (
+    LimitPolicy(TOPUP, 3600, max_count=10),
+    LimitPolicy(WITHDRAWAL, 86400, max_amount=50_000),
+)
+
+class SlidingWindow:
+    #Bucketed count and amount of one account's transactions over one policy window
+    __slots__ = ("width", "counts", "amounts", "head", "count", "amount")
+
+    def __init__(self, window, buckets):
+        self.width = window / buckets
+        self.counts = [0] * buckets
+        self.amounts = [0.0] * buckets
+        self.head = None  # number of the newest bucket
+        self.count = 0
+        self.amount = 0.0
+
+    def advance(self, now):
+        #Drop the buckets that slid out of the window by `now` (each bucket expires once)
+        bucket = int(now // self.width)
+        head = self.head
+        if head is not None and bucket <= head:
+            return
+        size = len(self.counts)
+        if head is None or bucket - head >= size:
+            self.counts = [0] * size
+            self.amounts = [0.0] * size
+            self.count = 0
+            self.amount = 0.0
+        else:
+            counts, amounts = self.counts, self.amounts
+            for b in range(head + 1, bucket + 1):
+                slot = b % size
+                self.count -= counts[slot]
+                self.amount -= amounts[slot]
+                counts[slot] = 0
+                amounts[slot] = 0.0
+        self.head = bucket
+
+    def add(self, amount, now):
+        self.advance(now)
+        slot = self.head % len(self.counts)
+        self.counts[slot] += 1
+        self.amounts[slot] += amount
+        self.count += 1
+        self.amount += amount
+
+class LimitEngine:
+    #Checks transactions against LimitPolicies using per-account sliding windows
+
+    def __init__(self, policies=DEFAULT_LIMITS):
+        """
+        Initialize the engine
+        
+        Each check and each record touches only the account's windows for
+        that kind, so its cost does not depend on how long the history is.
+        
+        Args:
+            policies: LimitPolicy objects to enforce
+        """
+        self.policies = list(policies)
+        self._by_kind = {}
+        for position, policy in enumerate(self.policies):
+            self._by_kind.setdefault(policy.kind, []).append(position)
+        self._windows = {}  # account id -> SlidingWindow per policy (created on first use)
+
+    def _account_windows(self, account):
+        windows = self._windows.get(account.account_id)
+        if windows is None:
+            windows = self._windows[account.account_id] = [
+                SlidingWindow(policy.window, policy.buckets) for policy in self.policies]
+        return windows
+
+    def check(self, account, kind, amount, now=None, pending_count=0, pending_amount=0):
+        """
+        Raise if one more transaction would break a policy
+        
+        Args:
+            account (BankAccount): Account the transaction is posted to
+            kind (int): Transaction kind
+            amount (float): Transaction amount
+            now (float): Time of the transaction (defaults to now)
+            pending_count (int): Transactions of this kind accepted but not yet recorded
+            pending_amount (float): Their total amount
+            
+        Raises:
+            TransactionLimitError: If a policy would be exceeded
+        """
+        positions = self._by_kind.get(kind)
+        if not positions:
+            return
+        if now is None:
+            now = time.time()
+        windows = self._account_windows(account)
+        for position in positions:
+            policy = self.policies[position]
+            window = windows[position]
+            window.advance(now)
+            if policy.max_count is not None and window.count + pending_count + 1 > policy.max_count:
+                raise TransactionLimitError(
+                    f"Limit of {policy.max_count} {KIND_NAMES[kind]} transactions per {policy.window:g}s reached")
+            if policy.max_amount is not None and window.amount + pending_amount + amount > policy.max_amount:
+                raise TransactionLimitError(
+                    f"Limit of {policy.max_amount} {KIND_NAMES[kind]} per {policy.window:g}s would be exceeded")
+
+    def record(self, account, kind, amount, now):
+        #Count a posted transaction in the account's windows
+        positions = self._by_kind.get(kind)
+        if positions:
+            windows = self._account_windows(account)
+            for position in positions:
+                windows[position].add(amount, now)
+
+def enable_limits(policies=DEFAULT_LIMITS):
+    """
+    Enforce transaction limits on every BankAccount operation and post_batch
+    
+    Args:
+        policies: LimitPolicy objects to enforce
+        
+    Returns:
+        LimitEngine: The active engine
+    """
+    BankAccount._limits = LimitEngine(policies)
+    return BankAccount._limits
+
+def disable_limits():
+    #Stop enforcing transaction limits
+    BankAccount._limits = None
+
+# Source of stable account ids
+_account_ids = itertools.count(1)
+_account_ids_lock = threading.Lock()
+
+# Source of account versions. Drawn from one global sequence so that a
+# (account id, version) pair never names two different states, even when an
+# account is deleted and restored.
+_versions = itertools.count(1)
+
+def _reserve_account_id(account_id):
+    #Make sure newly created accounts never reuse an id already in use
+    global _account_ids
+    with _account_ids_lock:
+        upcoming = next(_account_ids)
+        _account_ids = itertools.count(max(upcoming, account_id + 1))
+
+class BankAccount:
+    #Class representing a bank account with basic operations
+    
+    _locks = _NoLocks()  # replaced by LockStripes in concurrency mode
+    _limits = None  # LimitEngine while limits are enforced
+    
+    def __init__(self, name, initial_balance=0, account_id=None):
+        """
+        Initialize a bank account
+        
+        Args:
+            name (str): Account holder name
+            initial_balance (float): Starting balance (default 0)
+            account_id (int): Stable account id (default: next free id)
+        """
+        if account_id is None:
+            account_id = next(_account_ids)
+        else:
+            _reserve_account_id(account_id)
+        self.account_id = account_id
+        self.name = name
+        self.balance = initial_balance
+        self.transactions = TransactionLog()
+        self.version = next(_versions)  # changes whenever the balance or history does
+        self._store = None  # AccountStore holding this account, if any
+    
+    def __getstate__(self):
+        #Pickle without the owning store; balance and history are read together under the account lock
+        with self._locks.hold(self):
+            state = self.__dict__.copy()
+            state["transactions"] = b"".join(self.transactions._pack())
+        state["_store"] = None
+        return state
+    
+    def __setstate__(self, state):
+        state["transactions"], _ = TransactionLog._unpack(state["transactions"], 0)
+        self.__dict__.update(state)
+    
+    def deposit(self, amount):
+        """
+        Deposit money into the account
+        
+        Args:
+            amount (float): Amount to deposit
+            
+        Raises:
+            InvalidAmountError: If amount is not positive
+            TransactionLimitError: If a limit policy would be exceeded
+        """
+        if amount <= 0:
+            raise InvalidAmountError("Deposit amount must be positive")
+        with self._locks.hold(self):
+            if self._limits is not None:
+                self._limits.check(self, DEPOSIT, amount)
+            self.balance += amount
+            self._record(DEPOSIT, amount)
+            self._publish()
+    
+    def withdraw(self, amount):
+        """
+        Withdraw money from the account
+        
+        Args:
+            amount (float): Amount to withdraw
+            
+        Raises:
+            InvalidAmountError: If amount is not positive
+            InsufficientFundsError: If account has insufficient funds
+            TransactionLimitError: If a limit policy would be exceeded
+        """
+        if amount <= 0:
+            raise InvalidAmountError("Withdrawal amount must be positive")
+        with self._locks.hold(self):
+            if amount > self.balance:
+                raise InsufficientFundsError("Insufficient funds for withdrawal")
+            if self._limits is not None:
+                self._limits.check(self, WITHDRAWAL, amount)
+            self.balance -= amount
+            self._record(WITHDRAWAL, amount)
+            self._publish()
+    
+    def transfer(self, amount, target_account):
+        """
+        Transfer money to another account
+        
+        Args:
+            amount (float): Amount to transfer
+            target_account (BankAccount): Account to transfer to
+            
+        Raises:
+            InvalidAmountError: If amount is not positive
+            InsufficientFundsError: If account has insufficient funds
+            TransactionLimitError: If a limit policy would be exceeded
+        """
+        if amount <= 0:
+            raise InvalidAmountError("Transfer amount must be positive")
+        with self._locks.hold(self, target_account):
+            if amount > self.balance:
+                raise InsufficientFundsError("Insufficient funds for transfer")
+            if self._limits is not None:
+                self._limits.check(self, TRANSFER_OUT, amount)
+            self.balance -= amount
+            target_account.balance += amount
+            self._record(TRANSFER_OUT, amount, target_account.name)
+            target_account._record(TRANSFER_IN, amount, self.name)
+            self._publish(target_account)
+    
+    def mobile_topup(self, amount, phone_number):
+        """
+        Top up mobile phone balance
+        
+        Args:
+            amount (float): Amount to top up
+            phone_number (str): Phone number to top up
+            
+        Raises:
+            InvalidAmountError: If amount is not positive
+            InsufficientFundsError: If account has insufficient funds
+            TransactionLimitError: If a limit policy would be exceeded
+        """
+        if amount <= 0:
+            raise InvalidAmountError("Top-up amount must be positive")
+        with self._locks.hold(self):
+            if amount > self.balance:
+                raise InsufficientFundsError("Insufficient funds for top-up")
+            if self._limits is not None:
+                self._limits.check(self, TOPUP, amount)
+            self.balance -= amount
+            self._record(TOPUP, amount, phone_number)
+            self._publish()
+    
+    def refund_topup(self, amount, phone_number):
+        #Credit back a top-up the carrier could not deliver
+        with self._locks.hold(self):
+            self.balance += amount
+            self._record(REFUND, amount, phone_number)
+            self._publish()
+    
+    def _record(self, kind, amount, counterparty=None):
+        #Append a transaction to the history and report it to the owning store
+        timestamp = time.time()
+        self.transactions.append(kind, amount, counterparty, timestamp)
+        self.version = next(_versions)
+        if self._limits is not None:
+            self._limits.record(self, kind, amount, timestamp)
+        if self._store is not None:
+            self._store._posted(self, kind, amount, counterparty, timestamp)
+    
+    def _publish(self, other=None):
+        #Make new balances visible to store snapshots (with `other`'s, in the same commit)
+        store = self._store
+        if store is not None and store._versions is not None:
+            if other is not None and other._store is store:
+                store._versions.publish((self, other))
+                return
+            store._versions.publish((self,))
+        if other is not None:
+            other._publish()
+    
+    def query_transactions(self, **filters):
+        #Search the history through its indexes; see TransactionLog.query
+        return self.transactions.query(**filters)
+    
+    def balance_at(self, timestamp):
+        """
+        Balance of the account at a point in time
+        
+        Worked back from the current balance, so it is right whatever the
+        opening balance was (including accounts restored from a snapshot or
+        an import). Times before the first transaction give the opening balance.
+        
+        Args:
+            timestamp (float): Point in time (seconds since the epoch)
+            
+        Returns:
+            float: Balance just after every transaction posted at or before timestamp
+        """
+        with self._locks.hold(self):
+            return self.balance - (self.transactions.checkpoints().total - self.transactions.net_until(timestamp))
+    
+    def get_transactions(self):
+        #Return the transaction history rendered as strings (a lazy view)
+        return TransactionView(self.transactions)
+    
+    def _str_(self):
+        """String representation of account"""
+        return f"Account(name={self.name}, balance={self.balance})"
+
+def balances_at(accounts, timestamp):
+    """
+    Balances of many accounts at one point in time
+    
+    Args:
+        accounts (dict): Dictionary of bank accounts
+        timestamp (float): Point in time (seconds since the epoch)
+        
+    Returns:
+        dict: Holder name -> balance at that time
+    """
+    return {name: account.balance_at(timestamp) for name, account in accounts.items()}
+
+def spill_histories(accounts, archive, keep=1000):
+    """
+    Move the old history of every account out of memory into an archive
+    
+    Meant to run periodically (e.g. from a maintenance thread) so resident
+    memory follows the recent, active part of each history. Each account is
+    held under its lock only while its own log is compacted, so when other
+    threads use the accounts meanwhile, run in concurrency mode
+    (enable_concurrency) and read histories under the account lock.
+    
+    Args:
+        accounts (dict): Dictionary of bank accounts
+        archive (HistoryArchive): Where to write the segments
+        keep (int): Newest transactions to leave in memory per account
+    
+    Returns:
+        int: Number of transactions spilled
+    """
+    spilled = 0
+    for account in list(accounts.values()):
+        if len(account.transactions._kinds) - keep < SEGMENT_ENTRIES:
+            continue
+        with BankAccount._locks.hold(account):
+            spilled += account.transactions.spill(archive, keep)
+    return spilled
+
+def stress_test_transfers(thread_counts=(1, 2, 4, 8), accounts=1000, transfers_per_thread=20000,
+                          stripes=64, seed=0):
+    """
+    Run random transfers from several threads in concurrency mode
+    
+    Checks that the total money across all accounts never changes and
+    reports throughput for each thread count. On a GIL build pure in-memory
+    transfers stay roughly flat as threads are added; the striping pays off
+    when transfers block (e.g. waiting on a durable Ledger) or on a
+    free-threaded interpreter, where one global lock would serialize them.
+    
+    Args:
+        thread_counts (tuple): Thread counts to measure
+        accounts (int): Number of accounts transfers run between
+        transfers_per_thread (int): Transfers attempted by each thread
+        stripes (int): Number of lock stripes
+        seed (int): Random seed for the transfer pattern
+        
+    Returns:
+        list: One dict per thread count with threads, transfers, seconds,
+            transfers_per_sec, total_before and total_after
+    """
+    previous = BankAccount._locks
+    enable_concurrency(stripes)
+    results = []
+    try:
+        for threads in thread_counts:
+            book = [BankAccount(f"Holder{i}", 1000) for i in range(accounts)]
+            total_before = sum(account.balance for account in book)
+            def worker(worker_seed):
+                rng = random.Random(worker_seed)
+                for _ in range(transfers_per_thread):
+                    source, target = rng.sample(book, 2)
+                    try:
+                        source.transfer(rng.randint(1, 300), target)
+                    except InsufficientFundsError:
+                        pass
+            pool = [threading.Thread(target=worker, args=(seed * 1000 + i,)) for i in range(threads)]
+            start = time.perf_counter()
+            for thread in pool:
+                thread.start()
+            for thread in pool:
+                thread.join()
+            seconds = time.perf_counter() - start
+            total_after = sum(account.balance for account in book)
+            if total_after != total_before:
+                raise AssertionError(f"Money not conserved: {total_before} -> {total_after}")
+            transfers = threads * transfers_per_thread
+            results.append({
+                "threads": threads,
+                "transfers": transfers,
+                "seconds": seconds,
+                "transfers_per_sec": transfers / seconds,
+                "total_before": total_before,
+                "total_after": total_after,
+            })
+    finally:
+        BankAccount._locks = previous
+    return results
+
+# Operation names accepted by post_batch, mapped to transaction kinds
+BATCH_OPS = {
+    "deposit": DEPOSIT,
+    "withdraw": WITHDRAWAL,
+    "transfer": TRANSFER_OUT,
+    "topup": TOPUP,
+}
+
+# Error messages per kind: (invalid amount, insufficient funds)
+_BATCH_ERRORS = {
+    DEPOSIT: ("Deposit amount must be positive", None),
+    WITHDRAWAL: ("Withdrawal amount must be positive", "Insufficient funds for withdrawal"),
+    TRANSFER_OUT: ("Transfer amount must be positive", "Insufficient funds for transfer"),
+    TOPUP: ("Top-up amount must be positive", "Insufficient funds for top-up"),
+}
+
+class BatchResult:
+    #Outcome of a post_batch call
+
+    def __init__(self, size, failures, committed):
+        """
+        Initialize a batch result
+        
+        Args:
+            size (int): Number of rows in the batch
+            failures (dict): Row index -> BankingError for every rejected row
+            committed (bool): Whether the batch changed any balances
+        """
+        self.size = size
+        self.failures = failures
+        self.committed = committed
+
+    @property
+    def ok(self):
+        #True when every row was accepted
+        return not self.failures
+
+    @property
+    def applied(self):
+        #Number of rows whose balance changes were applied
+        return self.size - len(self.failures) if self.committed else 0
+
+    def __repr__(self):
+        return f"BatchResult(size={self.size}, failed={len(self.failures)}, committed={self.committed})"
+
+def post_batch(accounts, ops, amounts, counterparties=None, atomic=False):
+    """
+    Post many operations at once against an array-backed balance store
+    
+    Rows are validated with the same rules as the BankAccount methods and
+    keep their sequential meaning: a debit fails if the balance left by the
+    earlier rows of the batch cannot cover it. With NumPy available, balances
+    of accounts that cannot be overdrawn by the batch are updated with
+    vectorized arithmetic; only rows touching accounts that might run short
+    are walked one by one. While limits are enforced (enable_limits) every
+    row is walked and checked against them too.
+    
+    Args:
+        accounts (list): BankAccount for each row
+        ops (list): Operation name for each row (see BATCH_OPS)
+        amounts (list): Amount for each row
+        counterparties (list): Target BankAccount for transfers, phone number
+            for top-ups, None otherwise (default: no counterparties)
+        atomic (bool): If True, apply nothing unless every row succeeds
+        
+    Returns:
+        BatchResult: Per-row failures and whether the batch was committed
+        
+    Raises:
+        ValueError: If the columns differ in length or an op is unknown
+    """
+    _load_numpy()
+    n = len(accounts)
+    if len(ops) != n or len(amounts) != n or (counterparties is not None and len(counterparties) != n):
+        raise ValueError("Batch columns must all have the same length")
+    if counterparties is None:
+        counterparties = [None] * n
+    try:
+        kinds = [BATCH_OPS[op] for op in ops]
+    except KeyError as e:
+        raise ValueError(f"Unknown batch operation: {e.args[0]}") from None
+
+    # Dense balance store: one slot per distinct account touched by the batch
+    members = dict.fromkeys(accounts)
+    members.update(dict.fromkeys(cp for kind, cp in zip(kinds, counterparties)
+                                 if kind == TRANSFER_OUT and isinstance(cp, BankAccount)))
+    slots = {account: slot for slot, account in enumerate(members)}
+    members = list(members)
+    src = list(map(slots.__getitem__, accounts))
+    dst = [slots[cp] if kind == TRANSFER_OUT and isinstance(cp, BankAccount) else -1
+           for kind, cp in zip(kinds, counterparties)]
+
+    with BankAccount._locks.hold_many(members):
+        return _post_batch_locked(kinds, accounts, amounts, counterparties, atomic, members, src, dst)
+
+def _post_batch_locked(kinds, accounts, amounts, counterparties, atomic, members, src, dst):
+    #Body of post_batch, run with every involved account held
+    n = len(kinds)
+    failures = {}
+    limits = BankAccount._limits
+    vectorized = np is not None and n and limits is None
+    timestamp = time.time()
+    if vectorized:
+        balances, touched = _post_vectorized(kinds, amounts, src, dst, members, failures)
+    else:
+        balances, touched = _post_sequential(kinds, amounts, src, dst, members, failures, limits, timestamp)
+
+    if atomic and failures:
+        return BatchResult(n, failures, committed=False)
+
+    floats = _float_slots(amounts, src, dst, failures)
+    for slot in touched:
+        account = members[slot]
+        if slot in floats or type(account.balance) is not int:
+            account.balance = float(balances[slot])
+        else:
+            account.balance = int(balances[slot])  # only int amounts applied, as deposit() would keep it
+
+    if vectorized:
+        _record_batch_vectorized(kinds, amounts, src, dst, accounts, counterparties, members, failures, timestamp)
+    else:
+        for i, kind in enumerate(kinds):
+            if i in failures:
+                continue
+            if kind == TRANSFER_OUT:
+                target = counterparties[i]
+                accounts[i].transactions.append(TRANSFER_OUT, amounts[i], target.name, timestamp)
+                target.transactions.append(TRANSFER_IN, amounts[i], accounts[i].name, timestamp)
+            else:
+                accounts[i].transactions.append(kind, amounts[i], counterparties[i], timestamp)
+            if limits is not None:
+                limits.record(accounts[i], kind, amounts[i], timestamp)
+    for account in members:
+        account.version = next(_versions)
+    # Publish each store's accounts in one commit so snapshots see the batch whole
+    by_store = {}
+    for account in members:
+        store = account._store
+        if store is not None and store._versions is not None:
+            by_store.setdefault(id(store), (store._versions, []))[1].append(account)
+    for versions, changed in by_store.values():
+        versions.publish(changed)
+
+    # Applied rows still have to reach the journal of any store the accounts belong to
+    if any(account._store is not None for account in members):
+        for i, kind in enumerate(kinds):
+            store = accounts[i]._store
+            if store is None or i in failures:
+                continue
+            counterparty = counterparties[i].name if kind == TRANSFER_OUT else counterparties[i]
+            store._posted(accounts[i], kind, amounts[i], counterparty, timestamp)
+    return BatchResult(n, failures, committed=True)
+
+def _record_batch_vectorized(kinds, amounts, src, dst, accounts, counterparties, members, failures, timestamp):
+    #Append the history of applied batch rows, one packed extend per account
+    n = len(kinds)
+    ok = np.ones(n, dtype=bool)
+    ok[list(failures)] = False
+    k = np.asarray(kinds, dtype=np.uint8)
+    if isinstance(amounts, np.ndarray):
+        is_int = np.full(n, amounts.dtype.kind in "iu")
+    else:
+        is_int = np.fromiter((type(amount) is int for amount in amounts), dtype=bool, count=n)
+    int_flag = np.where(is_int, np.uint8(_INT_AMOUNT), np.uint8(0))
+    a = np.asarray(amounts, dtype=np.float64)
+    rows = np.flatnonzero(ok)
+    credit_rows = rows[k[rows] == TRANSFER_OUT]
+    entry_slot = np.concatenate((np.asarray(src)[rows], np.asarray(dst)[credit_rows]))
+    entry_row = np.concatenate((rows, credit_rows))
+    entry_side = np.concatenate((np.zeros(len(rows), np.int64), np.ones(len(credit_rows), np.int64)))
+    entry_kind = np.concatenate((k[rows], np.full(len(credit_rows), TRANSFER_IN, np.uint8)))
+    order = np.argsort(entry_slot * (2 * n) + entry_row * 2 + entry_side)
+    entry_slot, entry_row, entry_kind = entry_slot[order], entry_row[order], entry_kind[order]
+    has_party = np.isin(entry_kind, (TRANSFER_OUT, TRANSFER_IN, TOPUP))
+    kind_bytes = (entry_kind | int_flag[entry_row]).tobytes()
+    amount_bytes = a[entry_row].tobytes()
+    bounds = np.flatnonzero(np.r_[True, entry_slot[1:] != entry_slot[:-1], True])
+    group_has_party = np.add.reduceat(has_party, bounds[:-1]).tolist() if len(entry_slot) else []
+    group_slot = entry_slot[bounds[:-1]].tolist()
+    bounds = bounds.tolist()
+    for g, (lo, hi) in enumerate(zip(bounds, bounds[1:])):
+        parties = None
+        if group_has_party[g]:
+            parties = []
+            for row, kind in zip(entry_row[lo:hi].tolist(), entry_kind[lo:hi].tolist()):
+                if kind == TRANSFER_OUT:
+                    parties.append(counterparties[row].name)
+                elif kind == TRANSFER_IN:
+                    parties.append(accounts[row].name)
+                else:
+                    parties.append(counterparties[row])
+        members[group_slot[g]].transactions.extend_packed(
+            kind_bytes[lo:hi], amount_bytes[8 * lo:8 * hi], parties, timestamp)
+
+def _float_slots(amounts, src, dst, failures):
+    #Slots that an applied float amount touched, so their balance turns float
+    dtype = getattr(amounts, "dtype", None)
+    if dtype is not None and dtype.kind in "iu":
+        return set()
+    slots = set()
+    for i, amount in enumerate(amounts):
+        if type(amount) is not int and i not in failures:
+            slots.add(src[i])
+            if dst[i] >= 0:
+                slots.add(dst[i])
+    return slots
+
+def _batch_reject(i, kind, amount, dst, failures):
+    #Record a row failure found before any balance check; returns True if rejected
+    if not amount > 0:
+        failures[i] = InvalidAmountError(_BATCH_ERRORS[kind][0])
+    elif kind == TRANSFER_OUT and dst < 0:
+        failures[i] = AccountNotFoundError("Recipient account not found")
+    else:
+        return False
+    return True
+
+def _post_sequential(kinds, amounts, src, dst, members, failures, limits=None, timestamp=None):
+    #Apply batch rows one at a time over a plain array of balances (and limits, if enforced)
+    balances = array("d", [account.balance for account in members])
+    touched = set()
+    pending = {}  # (slot, kind) -> [count, amount] accepted earlier in this batch
+    for i, kind in enumerate(kinds):
+        amount = amounts[i]
+        if _batch_reject(i, kind, amount, dst[i], failures):
+            continue
+        s = src[i]
+        if kind != DEPOSIT and amount > balances[s]:
+            failures[i] = InsufficientFundsError(_BATCH_ERRORS[kind][1])
+            continue
+        if limits is not None:
+            accepted = pending.setdefault((s, kind), [0, 0])
+            try:
+                limits.check(members[s], kind, amount, timestamp, *accepted)
+            except TransactionLimitError as e:
+                failures[i] = e
+                continue
+            accepted[0] += 1
+            accepted[1] += amount
+        if kind == DEPOSIT:
+            balances[s] += amount
+        else:
+            balances[s] -= amount
+            if kind == TRANSFER_OUT:
+                balances[dst[i]] += amount
+                touched.add(dst[i])
+        touched.add(s)
+    return balances, touched
+
+def _post_vectorized(kinds, amounts, src, dst, members, failures):
+    #Apply batch rows with NumPy, walking only rows that may overdraw an account
+    k = np.asarray(kinds, dtype=np.int8)
+    a = np.asarray(amounts, dtype=np.float64)
+    s = np.asarray(src, dtype=np.int64)
+    d = np.asarray(dst, dtype=np.int64)
+    balances = np.array([account.balance for account in members], dtype=np.float64)
+
+    is_transfer = k == TRANSFER_OUT
+    valid = (a > 0) & ~(is_transfer & (d < 0))
+    for i in np.flatnonzero(~valid).tolist():
+        _batch_reject(i, kinds[i], amounts[i], dst[i], failures)
+
+    # Optimistic pass: running balance of every account assuming all valid rows apply
+    rows = np.flatnonzero(valid)
+    credit_rows = rows[is_transfer[rows]]
+    leg_account = np.concatenate((s[rows], d[credit_rows]))
+    leg_row = np.concatenate((rows, credit_rows))
+    leg_side = np.concatenate((np.zeros(len(rows), np.int64), np.ones(len(credit_rows), np.int64)))
+    leg_delta = np.concatenate((np.where(k[rows] == DEPOSIT, a[rows], -a[rows]), a[credit_rows]))
+    order = np.argsort(leg_account * (2 * len(kinds)) + leg_row * 2 + leg_side)
+    leg_account, leg_delta = leg_account[order], leg_delta[order]
+    running = np.cumsum(leg_delta)
+    # The prefix sum runs across every account, so each position carries the rounding
+    # of all earlier legs; anything within that slack of zero has to be walked exactly
+    eps = np.finfo(np.float64).eps
+    slack = np.maximum.accumulate(np.abs(running)) * (np.arange(2, len(running) + 2) * eps)
+    starts = np.flatnonzero(np.r_[True, leg_account[1:] != leg_account[:-1]]) if len(order) else np.empty(0, np.int64)
+    base = running[starts] - leg_delta[starts]
+    running -= np.repeat(base, np.diff(np.r_[starts, len(order)]))
+    running += balances[leg_account]
+
+    # Accounts that might go short, plus anyone they pay (their credit is uncertain)
+    dirty = np.zeros(len(members), dtype=bool)
+    dirty[leg_account[running < 1e-6 + slack]] = True
+    while True:
+        spread = credit_rows[dirty[s[credit_rows]] & ~dirty[d[credit_rows]]]
+        if not len(spread):
+            break
+        dirty[d[spread]] = True
+
+    clean = valid & ~dirty[s] & ~(is_transfer & dirty[np.maximum(d, 0)] & (d >= 0))
+    clean_rows = np.flatnonzero(clean)
+    np.add.at(balances, s[clean_rows], np.where(k[clean_rows] == DEPOSIT, a[clean_rows], -a[clean_rows]))
+    clean_credit = clean_rows[is_transfer[clean_rows]]
+    np.add.at(balances, d[clean_credit], a[clean_credit])
+    touched = set(np.flatnonzero(np.bincount(np.concatenate((s[clean_rows], d[clean_credit])),
+                                             minlength=len(members))).tolist())
+
+    for i in np.flatnonzero(valid & ~clean).tolist():
+        kind, amount, slot = kinds[i], amounts[i], src[i]
+        if kind == DEPOSIT:
+            balances[slot] += amount
+        elif dirty[slot] and amount > balances[slot]:
+            failures[i] = InsufficientFundsError(_BATCH_ERRORS[kind][1])
+            continue
+        else:
+            balances[slot] -= amount
+            if kind == TRANSFER_OUT:
+                balances[dst[i]] += amount
+                touched.add(dst[i])
+        touched.add(slot)
+    return balances, touched
+
+class VersionStore:
+    #Multi-version balances of an AccountStore: commits publish, snapshots read
+
+    def __init__(self):
+        self.seq = 0          # sequence number of the newest commit
+        self._chains = {}     # account id -> ((commit seq, balance or None if deleted), ...) oldest first
+        self._members = []    # (account id, name) of every account ever published; append-only
+        self._live = collections.Counter()  # commit seq -> open snapshots reading at it
+        self._live_seqs = []  # sorted keys of _live
+        self._lock = threading.Lock()
+
+    def publish(self, accounts, deleted=False):
+        """
+        Commit the current balances of some accounts as one new version
+        
+        Called with the accounts' stripe locks held, so the balances are
+        settled; a transfer publishes both sides in one commit, which is what
+        keeps snapshots from seeing it half done. The lock is only held to
+        swap in the new version tuples. Each account keeps at most one old
+        version per open snapshot, however many commits happen meanwhile.
+        
+        Args:
+            accounts: BankAccounts whose balances changed together
+            deleted (bool): Publish them as removed from the store
+        """
+        with self._lock:
+            self.seq += 1
+            seq = self.seq
+            live = self._live_seqs
+            for account in accounts:
+                chain = self._chains.get(account.account_id)
+                if chain is None:
+                    self._members.append((account.account_id, account.name))
+                    chain = ()
+                elif not live:
+                    chain = ()  # nobody reads old versions
+                else:
+                    chain = self._visible(chain, live)
+                self._chains[account.account_id] = chain + ((seq, None if deleted else account.balance),)
+
+    @staticmethod
+    def _visible(chain, live):
+        #Versions some open snapshot still reads: the newest one at or below each live seq
+        kept = []
+        for i, version in enumerate(chain):
+            reader = bisect.bisect_left(live, version[0])
+            if reader < len(live) and (i + 1 == len(chain) or live[reader] < chain[i + 1][0]):
+                kept.append(version)
+        return tuple(kept)
+
+    def open(self):
+        #Register a reader at the newest commit; returns (seq, member count)
+        with self._lock:
+            if not self._live[self.seq]:
+                bisect.insort(self._live_seqs, self.seq)
+            self._live[self.seq] += 1
+            return self.seq, len(self._members)
+
+    def close(self, seq):
+        with self._lock:
+            self._live[seq] -= 1
+            if not self._live[seq]:
+                del self._live[seq]
+                self._live_seqs.remove(seq)
+
+    def balance_at(self, account_id, seq):
+        #Balance as of commit `seq`; None if the account did not exist then
+        for version, balance in reversed(self._chains.get(account_id, ())):
+            if version <= seq:
+                return balance
+        return None
+
+class StoreSnapshot:
+    #Consistent, read-only view of every balance in an AccountStore at one commit
+
+    def __init__(self, versions):
+        self._versions = versions
+        self.seq, self._count = versions.open()
+        self._closed = False
+
+    def items(self):
+        #Yield (holder name, balance) for each account that existed at the snapshot
+        versions, seq = self._versions, self.seq
+        members = versions._members
+        for i in range(self._count):
+            account_id, name = members[i]
+            balance = versions.balance_at(account_id, seq)
+            if balance is not None:
+                yield name, balance
+
+    def __iter__(self):
+        return (name for name, _ in self.items())
+
+    def get(self, account_id):
+        #Balance of one account at the snapshot, or None
+        return self._versions.balance_at(account_id, self.seq)
+
+    def total(self):
+        return sum(balance for _, balance in self.items())
+
+    def close(self):
+        #Let writers drop the old versions this snapshot was keeping
+        if not self._closed:
+            self._closed = True
+            self._versions.close(self.seq)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+class AccountStore(MutableMapping):
+    #Dictionary of accounts keyed by holder name, with secondary indexes,
+    #that reports every change to a journal
+
+    def __init__(self, journal=None):
+        """
+        Initialize an account store
+        
+        Args:
+            journal: Object with created/deleted/posted methods (e.g. a Ledger),
+                or None to keep the store purely in memory
+        """
+        self._accounts = {}
+        self._by_id = {}
+        self._by_phone = None      # phone -> {account_id}, built on first lookup
+        self._sorted_names = None  # sorted (casefolded name, account_id), built on first search
+        self._versions = None      # VersionStore, started by the first snapshot()
+        self.journal = journal
+
+    def __getitem__(self, name):
+        return self._accounts[name]
+
+    def __contains__(self, name):
+        return name in self._accounts
+
+    def __iter__(self):
+        return iter(self._accounts)
+
+    def __len__(self):
+        return len(self._accounts)
+
+    def __setitem__(self, name, account):
+        if name in self._accounts:
+            del self[name]
+        self._attach(name, account)
+        if self.journal is not None:
+            self.journal.created(account)
+
+    def __delitem__(self, name):
+        account = self._detach(name)
+        if self.journal is not None:
+            self.journal.deleted(account)
+
+    def _attach(self, name, account):
+        #Add an account and index it, without journaling
+        self._accounts[name] = account
+        self._by_id[account.account_id] = account
+        account._store = self
+        if self._sorted_names is not None:
+            bisect.insort(self._sorted_names, (name.casefold(), account.account_id))
+        if self._by_phone is not None:
+            self._index_phones(account)
+        if self._versions is not None:
+            self._versions.publish((account,))
+
+    def _detach(self, name):
+        #Remove an account and its index entries, without journaling
+        account = self._accounts.pop(name)
+        del self._by_id[account.account_id]
+        account._store = None
+        if self._versions is not None:
+            self._versions.publish((account,), deleted=True)
+        if self._sorted_names is not None:
+            key = (name.casefold(), account.account_id)
+            i = bisect.bisect_left(self._sorted_names, key)
+            if i < len(self._sorted_names) and self._sorted_names[i] == key:
+                del self._sorted_names[i]
+        if self._by_phone is not None:
+            for phone in account.transactions.counterparties(TOPUP):
+                self._by_phone.get(phone, set()).discard(account.account_id)
+        return account
+
+    def _index_phones(self, account):
+        for phone in account.transactions.counterparties(TOPUP):
+            self._by_phone.setdefault(phone, set()).add(account.account_id)
+
+    def _posted(self, account, kind, amount, counterparty, timestamp):
+        #Called by BankAccount after every successful posting
+        if kind == TOPUP and self._by_phone is not None:
+            self._by_phone.setdefault(counterparty, set()).add(account.account_id)
+        if self.journal is not None and kind != TRANSFER_IN:
+            # The incoming leg of a transfer is replayed from its outgoing leg
+            self.journal.posted(account, kind, amount, counterparty, timestamp)
+
+    def snapshot(self):
+        """
+        Take a consistent snapshot of every balance
+        
+        Taking a snapshot costs O(1) and iterating it takes no lock, so a
+        report can read it for as long as it likes while postings continue.
+        The first call switches the store to multi-version mode, which pauses
+        all postings once while the current balances are recorded. Close the
+        snapshot (or use it as a context manager) when done.
+        
+        Returns:
+            StoreSnapshot: View of the balances as of the newest commit
+        """
+        if self._versions is None:
+            accounts = list(self._accounts.values())
+            with BankAccount._locks.hold_many(accounts):
+                if self._versions is None:
+                    versions = VersionStore()
+                    versions.publish(accounts)
+                    self._versions = versions
+        return StoreSnapshot(self._versions)
+
+    def get_by_id(self, account_id):
+        #Return the account with this id; raises AccountNotFoundError
+        try:
+            return self._by_id[account_id]
+        except KeyError:
+            raise AccountNotFoundError("Account not found") from None
+
+    def find_by_phone(self, phone_number):
+        #Return every account that has topped up this phone number
+        if self._by_phone is None:
+            self._by_phone = {}
+            for account in self._accounts.values():
+                self._index_phones(account)
+        return [self._by_id[i] for i in sorted(self._by_phone.get(phone_number, ()))]
+
+    def search_prefix(self, prefix, limit=10):
+        """
+        Case-insensitive prefix search over holder names
+        
+        Args:
+            prefix (str): Start of the holder name
+            limit (int): Most accounts to return
+            
+        Returns:
+            list: Matching accounts in name order
+        """
+        if self._sorted_names is None:
+            self._sorted_names = sorted((name.casefold(), account.account_id)
+                                        for name, account in self._accounts.items())
+        prefix = prefix.casefold()
+        i = bisect.bisect_left(self._sorted_names, (prefix,))
+        matches = []
+        while i < len(self._sorted_names) and len(matches) < limit:
+            name, account_id = self._sorted_names[i]
+            if not name.startswith(prefix):
+                break
+            matches.append(self._by_id[account_id])
+            i += 1
+        return matches
+
+def suggest_accounts(accounts, prefix, limit=10):
+    """
+    Holder names starting with a prefix, for autocomplete
+    
+    Uses the store's sorted index when accounts is an AccountStore and falls
+    back to a scan for a plain dict.
+    
+    Args:
+        accounts (dict): Dictionary of bank accounts
+        prefix (str): Start of the holder name (case-insensitive)
+        limit (int): Most names to return
+        
+    Returns:
+        list: Matching holder names
+    """
+    if not prefix:
+        return []
+    if isinstance(accounts, AccountStore):
+        return [account.name for account in accounts.search_prefix(prefix, limit)]
+    prefix = prefix.casefold()
+    return sorted(name for name in accounts if name.casefold().startswith(prefix))[:limit]
+
+# Journal record types beyond the transaction kinds
+_OP_CREATE = 16
+_OP_DELETE = 17
+
+_WAL_HEADER = struct.Struct("<II")      # payload length, crc32 of payload
+_WAL_RECORD = struct.Struct("<QBdd")    # lsn, op (with int flag), amount, timestamp
+_SNAPSHOT_MAGIC = b"BNKSNAP2"
+_SNAPSHOT_HEADER = struct.Struct("<8sQQ")  # magic, lsn, account count
+_SNAPSHOT_ACCOUNT = struct.Struct("<QdB")  # account id, balance, balance is int
+_LOG_HEADER = struct.Struct("<QI")         # transaction count, counterparty count
+_STR_LENGTH = struct.Struct("<H")
+
+def _pack_str(text):
+    #Encode a string with a two-byte length prefix
+    data = text.encode("utf-8")
+    return _STR_LENGTH.pack(len(data)) + data
+
+def _unpack_str(buf, offset):
+    #Decode a length-prefixed string; returns (text, next offset)
+    (length,) = _STR_LENGTH.unpack_from(buf, offset)
+    offset += _STR_LENGTH.size
+    return bytes(buf[offset:offset + length]).decode("utf-8"), offset + length
+
+class WriteAheadLog:
+    #Append-only, checksummed journal file with group commit
+
+    def __init__(self, directory, first_lsn=1, durable=True, flush_interval=0.05):
+        """
+        Open a new log segment for appending
+        
+        Args:
+            directory (str): Ledger directory holding the segments
+            first_lsn (int): Sequence number of the first record to append
+            durable (bool): If True, append() returns only once the record is fsynced
+            flush_interval (float): Longest time a non-durable record stays unsynced
+        """
+        self.directory = directory
+        self.durable = durable
+        self.flush_interval = flush_interval
+        self._cond = threading.Condition()
+        self._pending = []
+        self._next_lsn = first_lsn
+        self._synced_lsn = first_lsn - 1
+        self._closed = False
+        self._error = None
+        self._open_segment(first_lsn)
+        self._flusher = threading.Thread(target=self._flush_loop, name="wal-flusher", daemon=True)
+        self._flusher.start()
+
+    @property
+    def last_lsn(self):
+        #Sequence number of the last appended record
+        return self._next_lsn - 1
+
+    def _open_segment(self, first_lsn):
+        path = os.path.join(self.directory, f"wal-{first_lsn:020d}.log")
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def append(self, op, amount, timestamp, name, counterparty=None):
+        """
+        Append one record to the log
+        
+        Args:
+            op (int): Transaction kind or _OP_CREATE/_OP_DELETE
+            amount (float): Amount (initial balance for _OP_CREATE)
+            timestamp (float): Time of the operation
+            name (str): Account holder name
+            counterparty (str): Recipient name or phone number, if any
+            
+        Returns:
+            int: Log sequence number of the record
+        """
+        if type(amount) is int:
+            op |= _INT_AMOUNT
+        with self._cond:
+            if self._closed:
+                raise BankingError("Ledger is closed")
+            lsn = self._next_lsn
+            self._next_lsn += 1
+            payload = (_WAL_RECORD.pack(lsn, op, amount, timestamp) + _pack_str(name)
+                       + _pack_str("" if counterparty is None else str(counterparty)))
+            self._pending.append(_WAL_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+            if len(self._pending) == 1:
+                self._cond.notify_all()  # wake the flusher if it is idle
+            if self.durable:
+                self._wait_synced(lsn)
+        return lsn
+
+    def sync(self):
+        #Block until every appended record is on disk
+        with self._cond:
+            self._cond.notify_all()
+            self._wait_synced(self._next_lsn - 1)
+
+    def _wait_synced(self, lsn):
+        # Caller holds self._cond; every writer waiting here shares the next fsync
+        while self._synced_lsn < lsn:
+            if self._error is not None:
+                raise BankingError(f"Ledger write failed: {self._error}")
+            self._cond.wait()
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                if not self._pending and not self._closed:
+                    self._cond.wait(self.flush_interval)
+                if not self._pending:
+                    if self._closed:
+                        return
+                    continue
+                batch, self._pending = self._pending, []
+                upto = self._next_lsn - 1
+                fd = self._fd
+            try:
+                os.write(fd, b"".join(batch))
+                os.fsync(fd)
+            except OSError as e:
+                with self._cond:
+                    self._error = e
+                    self._cond.notify_all()
+                return
+            with self._cond:
+                self._synced_lsn = upto
+                self._cond.notify_all()
+
+    def rotate(self):
+        """
+        Sync and close the current segment and start a new one
+        
+        Returns:
+            int: Sequence number of the last record in the closed segment
+        """
+        with self._cond:
+            self._cond.notify_all()
+            self._wait_synced(self._next_lsn - 1)
+            os.close(self._fd)
+            self._open_segment(self._next_lsn)
+            return self._next_lsn - 1
+
+    def close(self):
+        #Sync outstanding records and stop the flusher
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._flusher.join()
+        os.close(self._fd)
+
+    @staticmethod
+    def read(path):
+        """
+        Read the records of one segment, stopping at a torn or corrupt tail
+        
+        Args:
+            path (str): Segment file path
+            
+        Yields:
+            tuple: (lsn, op, amount, timestamp, name, counterparty, end offset)
+        """
+        with open(path, "rb") as f:
+            data = f.read()
+        offset = 0
+        while offset + _WAL_HEADER.size <= len(data):
+            length, crc = _WAL_HEADER.unpack_from(data, offset)
+            start = offset + _WAL_HEADER.size
+            payload = data[start:start + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                return
+            lsn, op, amount, timestamp = _WAL_RECORD.unpack_from(payload)
+            name, pos = _unpack_str(payload, _WAL_RECORD.size)
+            counterparty, _ = _unpack_str(payload, pos)
+            if op & _INT_AMOUNT:
+                op &= ~_INT_AMOUNT
+                amount = int(amount)
+            offset = start + length
+            yield lsn, op, amount, timestamp, name, counterparty or None, offset
+
+class Ledger:
+    #Durable account book: write-ahead log plus periodic memory-mapped snapshots
+
+    def __init__(self, directory, durable=True, snapshot_every=1_000_000, flush_interval=0.05):
+        """
+        Open (or create) a ledger directory and recover its accounts
+        
+        Recovery loads the newest snapshot through mmap and replays only the
+        log records written after it.
+        
+        Args:
+            directory (str): Directory for snapshots and log segments
+            durable (bool): If True, each operation waits for its log record to be fsynced
+                (concurrent writers share fsyncs through group commit)
+            snapshot_every (int): Records after which maybe_checkpoint() takes a snapshot (0 disables)
+            flush_interval (float): Longest time a non-durable record stays unsynced
+        """
+        self.directory = directory
+        self.snapshot_every = snapshot_every
+        os.makedirs(directory, exist_ok=True)
+        self.accounts = AccountStore()
+        self._since_snapshot = 0
+        last_lsn = self._recover()
+        self._wal = WriteAheadLog(directory, last_lsn + 1, durable, flush_interval)
+        self.accounts.journal = self
+
+    def _files(self, prefix):
+        #Ledger files with the given prefix, as (lsn, path) sorted by lsn
+        found = []
+        for entry in os.listdir(self.directory):
+            if entry.startswith(prefix + "-") and not entry.endswith(".tmp"):
+                found.append((int(entry[len(prefix) + 1:].split(".")[0]), os.path.join(self.directory, entry)))
+        return sorted(found)
+
+    def _recover(self):
+        #Load the newest snapshot and replay the log tail; returns the last lsn
+        last_lsn = 0
+        snapshots = self._files("snapshot")
+        if snapshots:
+            last_lsn = self._load_snapshot(snapshots[-1][1])
+        for _, path in self._files("wal"):
+            good = 0
+            for lsn, op, amount, timestamp, name, counterparty, good in WriteAheadLog.read(path):
+                if lsn > last_lsn:
+                    self._replay(op, amount, timestamp, name, counterparty)
+                    last_lsn = lsn
+                    self._since_snapshot += 1
+            if good != os.path.getsize(path):
+                # Drop a torn tail left by a crash mid-write
+                with open(path, "r+b") as f:
+                    f.truncate(good)
+        return last_lsn
+
+    def _replay(self, op, amount, timestamp, name, counterparty):
+        #Apply one logged record to the in-memory accounts without re-logging it
+        accounts = self.accounts._accounts
+        if op == _OP_CREATE:
+            # Create records carry the account id in the counterparty field
+            self.accounts._attach(name, BankAccount(name, amount, int(counterparty)))
+            return
+        account = accounts.get(name)
+        if account is None:
+            return
+        if op == _OP_DELETE:
+            self.accounts._detach(name)
+        elif op == DEPOSIT or op == REFUND:
+            account.balance += amount
+            account.transactions.append(op, amount, counterparty, timestamp)
+        elif op == TRANSFER_OUT:
+            account.balance -= amount
+            account.transactions.append(op, amount, counterparty, timestamp)
+            target = accounts.get(counterparty)
+            if target is not None:
+                target.balance += amount
+                target.transactions.append(TRANSFER_IN, amount, name, timestamp)
+                target.version = next(_versions)
+        else:
+            account.balance -= amount
+            account.transactions.append(op, amount, counterparty, timestamp)
+        account.version = next(_versions)
+
+    def _load_snapshot(self, path):
+        #Rebuild accounts from a snapshot file through mmap; returns its lsn
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            buf = memoryview(mm)
+            try:
+                magic, lsn, count = _SNAPSHOT_HEADER.unpack_from(buf, 0)
+                if magic != _SNAPSHOT_MAGIC:
+                    raise BankingError(f"Not a ledger snapshot: {path}")
+                offset = _SNAPSHOT_HEADER.size
+                for _ in range(count):
+                    name, offset = _unpack_str(buf, offset)
+                    account_id, balance, is_int = _SNAPSHOT_ACCOUNT.unpack_from(buf, offset)
+                    offset += _SNAPSHOT_ACCOUNT.size
+                    account = BankAccount(name, int(balance) if is_int else balance, account_id)
+                    account.transactions, offset = TransactionLog._unpack(buf, offset)
+                    self.accounts._attach(name, account)
+            finally:
+                buf.release()
+        return lsn
+
+    def checkpoint(self):
+        """
+        Write a snapshot of every account and discard the log it covers
+        
+        The snapshot must match the log position it is taken at, so call it
+        between operations; in concurrency mode every account stripe is held
+        while the accounts are serialized.
+        
+        Returns:
+            str: Path of the new snapshot
+        """
+        accounts = self.accounts._accounts
+        with BankAccount._locks.hold_many(list(accounts.values())):
+            lsn = self._wal.rotate()
+            chunks = [_SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, lsn, len(accounts))]
+            for name, account in accounts.items():
+                chunks.append(_pack_str(name))
+                chunks.append(_SNAPSHOT_ACCOUNT.pack(account.account_id, account.balance,
+                                                     type(account.balance) is int))
+                chunks.extend(account.transactions._pack())
+        path = os.path.join(self.directory, f"snapshot-{lsn:020d}.bin")
+        with open(path + ".tmp", "wb") as f:
+            f.writelines(chunks)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        dir_fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+        for old_lsn, old_path in self._files("snapshot"):
+            if old_lsn < lsn:
+                os.remove(old_path)
+        segments = self._files("wal")
+        for first_lsn, old_path in segments[:-1]:
+            if first_lsn <= lsn:
+                os.remove(old_path)
+        self._since_snapshot = 0
+        return path
+
+    def maybe_checkpoint(self):
+        """
+        Take a snapshot if enough records were logged since the last one
+        
+        Meant to be called between operations (e.g. once per console command),
+        never from inside a posting.
+        
+        Returns:
+            bool: True if a snapshot was written
+        """
+        if self.snapshot_every and self._since_snapshot >= self.snapshot_every:
+            self.checkpoint()
+            return True
+        return False
+
+    def _append(self, op, amount, timestamp, name, counterparty=None):
+        self._wal.append(op, amount, timestamp, name, counterparty)
+        self._since_snapshot += 1
+
+    # Journal interface used by AccountStore
+
+    def created(self, account):
+        self._append(_OP_CREATE, account.balance, time.time(), account.name, str(account.account_id))
+
+    def deleted(self, account):
+        self._append(_OP_DELETE, 0, time.time(), account.name)
+
+    def posted(self, account, kind, amount, counterparty, timestamp):
+        self._append(kind, amount, timestamp, account.name, counterparty)
+
+    def sync(self):
+        #Block until every logged operation is on disk
+        self._wal.sync()
+
+    def close(self):
+        #Flush the log and close the ledger
+        self._wal.close()
+        self.accounts.journal = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class BankingSession:
+    #Non-interactive banking operations on an accounts dict with one selected account
+
+    def __init__(self, accounts, current_account=None):
+        """
+        Initialize a session
+        
+        Args:
+            accounts (dict): Dictionary of bank accounts by holder name
+            current_account (BankAccount): Initially selected account
+        """
+        self.accounts = accounts
+        self.current_account = current_account
+
+    def _selected(self):
+        if self.current_account is None:
+            raise NoAccountSelectedError("No account selected")
+        return self.current_account
+
+    def create(self, name, initial_balance=0):
+        #Create an account; raises DuplicateAccountError if the name is taken
+        if not name:
+            raise InvalidAmountError("Account holder name must not be empty")
+        if name in self.accounts:
+            raise DuplicateAccountError("Account with this name already exists")
+        if initial_balance < 0:
+            raise InvalidAmountError("Initial balance must not be negative")
+        account = BankAccount(name, initial_balance)
+        self.accounts[name] = account
+        return account
+
+    def select(self, name):
+        #Select an account by holder name
+        if name not in self.accounts:
+            raise AccountNotFoundError("Account not found")
+        self.current_account = self.accounts[name]
+        return self.current_account
+
+    def deposit(self, amount):
+        self._selected().deposit(amount)
+        return self.current_account.balance
+
+    def withdraw(self, amount):
+        self._selected().withdraw(amount)
+        return self.current_account.balance
+
+    def transfer(self, target_name, amount):
+        #Transfer from the selected account to another holder
+        account = self._selected()
+        if len(self.accounts) < 2:
+            raise InvalidTransferError("Need at least 2 accounts to transfer")
+        if target_name == account.name:
+            raise InvalidTransferError("Cannot transfer to same account")
+        if target_name not in self.accounts:
+            raise AccountNotFoundError("Recipient account not found")
+        account.transfer(amount, self.accounts[target_name])
+        return account.balance
+
+    def topup(self, phone_number, amount):
+        self._selected().mobile_topup(amount, phone_number)
+        return self.current_account.balance
+
+    def delete(self):
+        #Delete the selected account
+        account = self._selected()
+        del self.accounts[account.name]
+        self.current_account = None
+
+    def history(self, start=0, stop=None):
+        #Balance and rendered transactions of the selected account
+        account = self._selected()
+        return {"balance": account.balance, "transactions": account.transactions.render(start, stop)}
+
+# Server request ops -> (session method, argument names)
+def _server_text(value, field):
+    #Accept only JSON strings for names and phone numbers
+    if not isinstance(value, str):
+        raise ValueError(f"{field} must be a string")
+    return value
+
+def _server_amount(value, field):
+    #Accept only finite JSON numbers for amounts
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"{field} must be a number")
+    return _parse_amount(value, field)
+
+def _server_index(value, field):
+    #Accept only JSON integers (or null) for history bounds
+    if value is not None and (isinstance(value, bool) or not isinstance(value, int)):
+        raise ValueError(f"{field} must be an integer")
+    return value
+
+# op -> (session method, {request field: (parameter, parser, required)})
+_SERVER_OPS = {
+    "create": ("create", {"name": ("name", _server_text, True),
+                          "balance": ("initial_balance", _server_amount, False)}),
+    "select": ("select", {"name": ("name", _server_text, True)}),
+    "deposit": ("deposit", {"amount": ("amount", _server_amount, True)}),
+    "withdraw": ("withdraw", {"amount": ("amount", _server_amount, True)}),
+    "transfer": ("transfer", {"to": ("target_name", _server_text, True),
+                              "amount": ("amount", _server_amount, True)}),
+    "topup": ("topup", {"phone": ("phone_number", _server_text, True),
+                        "amount": ("amount", _server_amount, True)}),
+    "delete": ("delete", {}),
+    "history": ("history", {"start": ("start", _server_index, False),
+                            "stop": ("stop", _server_index, False)}),
+}
+
+def _server_call(session, request):
+    #Bind a decoded request to its session method, rejecting missing or unknown fields
+    method, fields = _SERVER_OPS[request["op"]]
+    unknown = set(request) - set(fields) - {"id", "op"}
+    if unknown:
+        raise ValueError(f"unknown fields: {', '.join(sorted(unknown))}")
+    kwargs = {}
+    for field, (parameter, parse, required) in fields.items():
+        if field in request:
+            kwargs[parameter] = parse(request[field], field)
+        elif required:
+            raise ValueError(f"missing field: {field}")
+    return functools.partial(getattr(session, method), **kwargs)
+
+class BankingServer:
+    #Asyncio JSON-lines server exposing the banking operations
+
+    def __init__(self, accounts=None, host="127.0.0.1", port=0, unix_path=None,
+                 max_concurrency=256, executor=None):
+        """
+        Initialize the server
+        
+        Each line a client sends is a JSON object such as
+        {"id": 1, "op": "deposit", "amount": 200}; each reply is one JSON line
+        {"id": 1, "ok": true, "result": ...} or {"id": 1, "ok": false,
+        "error": "InsufficientFundsError", "message": "..."}, in request order.
+        Clients may pipeline: requests are read ahead and replies are only
+        flushed (and reading paused) when the socket buffer is full.
+        
+        Args:
+            accounts (dict): Shared accounts (default: a new AccountStore)
+            host (str): Interface to listen on for TCP
+            port (int): TCP port (0 picks a free port)
+            unix_path (str): Listen on this Unix socket instead of TCP
+            max_concurrency (int): Most operations executing at once across all clients
+            executor: Optional concurrent.futures executor to run operations in
+                (use with a durable Ledger and enable_concurrency())
+        """
+        self.accounts = AccountStore() if accounts is None else accounts
+        self.host = host
+        self.port = port
+        self.unix_path = unix_path
+        self.max_concurrency = max_concurrency
+        self.executor = executor
+        self._server = None
+        self._limit = None
+
+    async def start(self):
+        #Start listening; returns the bound address
+        self._limit = asyncio.Semaphore(self.max_concurrency)
+        if self.unix_path:
+            self._server = await asyncio.start_unix_server(self._serve_client, self.unix_path)
+        else:
+            self._server = await asyncio.start_server(self._serve_client, self.host, self.port,
+                                                      backlog=4096)
+        return self.address
+
+    @property
+    def address(self):
+        #Bound (host, port) or Unix socket path
+        if self.unix_path:
+            return self.unix_path
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _serve_client(self, reader, writer):
+        session = BankingSession(self.accounts)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                async with self._limit:
+                    reply = await self._execute(session, line)
+                writer.write(reply)
+                await writer.drain()  # only waits when the client stops reading
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            pass  # server closing with this client still connected
+        finally:
+            writer.close()
+
+    async def _execute(self, session, line):
+        #Run one request line and return the encoded reply line
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("request must be a JSON object")
+            request_id = request.get("id")
+            call = _server_call(session, request)
+            if self.executor is None:
+                result = call()
+            else:
+                result = await asyncio.get_running_loop().run_in_executor(self.executor, call)
+            if isinstance(result, BankAccount):
+                result = {"name": result.name, "balance": result.balance}
+            reply = {"id": request_id, "ok": True, "result": result}
+        except BankingError as e:
+            reply = {"id": request_id, "ok": False, "error": type(e).__name__, "message": str(e)}
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            reply = {"id": request_id, "ok": False, "error": "BadRequest", "message": repr(e)}
+        return (json.dumps(reply) + "\n").encode()
+
+def server_main(host="127.0.0.1", port=8765, data_dir=None):
+    """
+    Run the banking server until interrupted
+    
+    Args:
+        host (str): Interface to listen on
+        port (int): TCP port
+        data_dir (str): Ledger directory to persist accounts in (default: memory only)
+    """
+    ledger = Ledger(data_dir, durable=False) if data_dir else None
+    server = BankingServer(ledger.accounts if ledger else None, host, port)
+    print(f"Serving banking requests on {host}:{port}")
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if ledger:
+            ledger.close()
+
+def _raise_fd_limit(wanted):
+    #Best-effort bump of the open-file limit so many sockets can be opened
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < wanted:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (min(wanted, hard), hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+async def run_load(address, connections=100, requests_per_connection=100, pipeline=16):
+    """
+    Drive a BankingServer with many concurrent pipelined clients
+    
+    Each client creates and selects its own account, then sends deposits,
+    keeping up to `pipeline` requests in flight.
+    
+    Args:
+        address: (host, port) tuple or Unix socket path
+        connections (int): Number of concurrent connections
+        requests_per_connection (int): Deposits sent by each connection
+        pipeline (int): Requests each connection keeps in flight
+        
+    Returns:
+        dict: requests, errors, seconds, requests_per_sec, p50_ms and p99_ms
+    """
+    _raise_fd_limit(connections + 256)
+    latencies = []
+    errors = 0
+
+    async def client(index):
+        nonlocal errors
+        if isinstance(address, str):
+            reader, writer = await asyncio.open_unix_connection(address)
+        else:
+            reader, writer = await asyncio.open_connection(*address)
+        name = f"load-{index}-{id(latencies)}"
+        writer.write((json.dumps({"op": "create", "name": name, "balance": 0}) + "\n"
+                      + json.dumps({"op": "select", "name": name}) + "\n").encode())
+        await reader.readline()
+        await reader.readline()
+        sent_at = collections.deque()
+        line = (json.dumps({"op": "deposit", "amount": 1}) + "\n").encode()
+        sent = received = 0
+        while received < requests_per_connection:
+            while sent < requests_per_connection and sent - received < pipeline:
+                writer.write(line)
+                sent_at.append(time.perf_counter())
+                sent += 1
+            await writer.drain()
+            reply = await reader.readline()
+            latencies.append(time.perf_counter() - sent_at.popleft())
+            if b'"ok": true' not in reply:
+                errors += 1
+            received += 1
+        writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(connections)))
+    seconds = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": seconds,
+        "requests_per_sec": len(latencies) / seconds,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+    }
+
+def load_test(connections=10000, requests_per_connection=20, pipeline=8, max_concurrency=256):
+    """
+    Start a local server and measure it with run_load
+    
+    Args:
+        connections (int): Number of concurrent client connections
+        requests_per_connection (int): Requests sent by each connection
+        pipeline (int): Requests each connection keeps in flight
+        max_concurrency (int): Server-side concurrency limit
+        
+    Returns:
+        dict: Result of run_load
+    """
+    _raise_fd_limit(2 * connections + 256)  # both ends of every connection live in this process
+    async def main():
+        server = BankingServer(max_concurrency=max_concurrency)
+        address = await server.start()
+        try:
+            return await run_load(address, connections, requests_per_connection, pipeline)
+        finally:
+            await server.close()
+    return asyncio.run(main())
+
+def _shard_worker(conn):
+    #Shard process: apply batches of operations to the accounts it owns
+    accounts = {}
+    holds = {}  # transfer id -> (source account id, amount) reserved by phase one
+    while True:
+        batch = conn.recv()
+        if batch is None:
+            break
+        replies = []
+        for op in batch:
+            try:
+                replies.append((True, _shard_apply(accounts, holds, op)))
+            except Exception as e:
+                # Malformed ops fail on their own instead of taking the shard down
+                replies.append((False, f"{type(e).__name__}: {e}"))
+        conn.send(replies)
+    conn.close()
+
+def _shard_apply(accounts, holds, op):
+    #Apply one operation tuple inside a shard process
+    code = op[0]
+    if code == "create":
+        _, account_id, name, balance = op
+        accounts[account_id] = BankAccount(name, balance, account_id)
+        return account_id
+    if code == "total":
+        return sum(a.balance for a in accounts.values()) + sum(amount for _, amount in holds.values())
+    account = accounts.get(op[1])
+    if account is None:
+        raise AccountNotFoundError("Account not found")
+    if code == "deposit":
+        account.deposit(op[2])
+    elif code == "withdraw":
+        account.withdraw(op[2])
+    elif code == "topup":
+        account.mobile_topup(op[2], op[3])
+    elif code == "transfer":
+        target = accounts.get(op[3])
+        if target is None:
+            raise AccountNotFoundError("Recipient account not found")
+        account.transfer(op[2], target)
+    elif code == "reserve":
+        # Phase one of a cross-shard transfer: move the money into a hold
+        _, _, amount, txid = op
+        if amount <= 0:
+            raise InvalidAmountError("Transfer amount must be positive")
+        if amount > account.balance:
+            raise InsufficientFundsError("Insufficient funds for transfer")
+        account.balance -= amount
+        holds[txid] = (op[1], amount)
+    elif code == "commit":
+        _, _, txid, target_name = op
+        account._record(TRANSFER_OUT, holds.pop(txid)[1], target_name)
+    elif code == "abort":
+        account.balance += holds.pop(op[2])[1]
+    elif code == "credit":
+        _, _, amount, source_name = op
+        account.balance += amount
+        account._record(TRANSFER_IN, amount, source_name)
+    elif code == "delete":
+        # The commit of a reserved transfer must still find its source account
+        if any(source == op[1] for source, _ in holds.values()):
+            raise InvalidTransferError("Account has a transfer in progress")
+        del accounts[op[1]]
+    elif code == "history":
+        return account.transactions.render()
+    elif code != "balance":
+        raise ValueError(f"unknown shard op {code!r}")
+    return account.balance
+
+class ShardedLedger:
+    #Accounts partitioned across worker processes by account id
+
+    def __init__(self, shards=None):
+        """
+        Start the shard processes
+        
+        Args:
+            shards (int): Number of worker processes (default: CPU count)
+        """
+        self.shard_count = shards or os.cpu_count() or 1
+        self._conns = []
+        self._procs = []
+        for _ in range(self.shard_count):
+            parent, child = multiprocessing.Pipe()
+            proc = multiprocessing.Process(target=_shard_worker, args=(child,), daemon=True)
+            proc.start()
+            child.close()
+            self._conns.append(parent)
+            self._procs.append(proc)
+        self._names = {}  # account id -> holder name
+        self._next_id = itertools.count(1)
+        self._next_txid = itertools.count(1)
+
+    def shard_of(self, account_id):
+        return hash(account_id) % self.shard_count
+
+    def _round(self, per_shard):
+        #Send one batch to every shard that has work, then gather the replies
+        for shard, ops in per_shard.items():
+            self._conns[shard].send(ops)
+        return {shard: self._conns[shard].recv() for shard in per_shard}
+
+    def execute(self, ops):
+        """
+        Run a batch of operations, one message per shard per round
+        
+        Supported ops: ("create", name, balance), ("deposit", id, amount),
+        ("withdraw", id, amount), ("topup", id, amount, phone),
+        ("transfer", source id, target id, amount), ("delete", id),
+        ("balance", id), ("history", id).
+        Transfers between shards use a two-phase protocol: the source shard
+        reserves the money, the target shard credits it, then the source
+        commits (or refunds if the credit failed), so money is never created
+        or lost. Operations on one shard run in batch order; the credit of a
+        cross-shard transfer lands after the first round of the batch.
+        
+        Args:
+            ops (list): Operation tuples
+            
+        Returns:
+            list: (ok, result or error message) per operation
+        """
+        results = [None] * len(ops)
+        first = {}
+        placed = {}      # shard -> [op index] for round one
+        transfers = []   # (op index, txid, source id, target id, amount)
+        for i, op in enumerate(ops):
+            code = op[0]
+            if code == "create":
+                account_id = next(self._next_id)
+                self._names[account_id] = op[1]
+                shard_op = ("create", account_id, op[1], op[2])
+                shard = self.shard_of(account_id)
+            elif code == "transfer":
+                _, source, target, amount = op
+                shard = self.shard_of(source)
+                if self.shard_of(target) == shard:
+                    shard_op = ("transfer", source, amount, target)
+                else:
+                    txid = next(self._next_txid)
+                    transfers.append((i, txid, source, target, amount))
+                    shard_op = ("reserve", source, amount, txid)
+            elif code == "topup":
+                shard_op = ("topup", op[1], op[2], op[3])
+                shard = self.shard_of(op[1])
+            else:
+                shard_op = op
+                shard = self.shard_of(op[1])
+            first.setdefault(shard, []).append(shard_op)
+            placed.setdefault(shard, []).append(i)
+        for shard, replies in self._round(first).items():
+            for i, reply in zip(placed[shard], replies):
+                results[i] = reply
+        # Phase two: credit targets of reserved cross-shard transfers
+        reserved = [t for t in transfers if results[t[0]][0]]
+        credits, credit_order = {}, {}
+        for t in reserved:
+            shard = self.shard_of(t[3])
+            credits.setdefault(shard, []).append(("credit", t[3], t[4], self._names.get(t[2])))
+            credit_order.setdefault(shard, []).append(t)
+        credited = {}
+        for shard, replies in self._round(credits).items():
+            for t, reply in zip(credit_order[shard], replies):
+                credited[t[1]] = reply
+        # Phase three: commit or refund on the source shards
+        finals, final_order = {}, {}
+        for t in reserved:
+            ok = credited[t[1]][0]
+            op = ("commit", t[2], t[1], self._names.get(t[3])) if ok else ("abort", t[2], t[1])
+            shard = self.shard_of(t[2])
+            finals.setdefault(shard, []).append(op)
+            final_order.setdefault(shard, []).append((t, ok))
+        for shard, replies in self._round(finals).items():
+            for (t, ok), reply in zip(final_order[shard], replies):
+                results[t[0]] = reply if ok else credited[t[1]]
+        for i, op in enumerate(ops):
+            if op[0] == "delete" and results[i][0]:
+                self._names.pop(op[1], None)
+        return results
+
+    def total(self):
+        #Money held across all shards, including reservations in flight
+        replies = self._round({shard: [("total",)] for shard in range(self.shard_count)})
+        return sum(reply[0][1] for reply in replies.values())
+
+    def close(self):
+        #Stop the shard processes
+        for conn in self._conns:
+            conn.send(None)
+            conn.close()
+        for proc in self._procs:
+            proc.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def benchmark_sharded(shard_counts=(1, 2, 4, 8), accounts=10000, ops=400000, batch_size=20000, seed=0):
+    """
+    Measure ShardedLedger throughput as shards are added
+    
+    Runs the same random mix of deposits, withdrawals and transfers at each
+    shard count and checks the total money matches the deposits made.
+    
+    Args:
+        shard_counts (tuple): Shard counts to measure
+        accounts (int): Number of accounts
+        ops (int): Operations per measurement
+        batch_size (int): Operations sent per execute() call
+        seed (int): Random seed for the operation mix
+        
+    Returns:
+        list: One dict per shard count with shards, ops, seconds and ops_per_sec
+    """
+    rng = random.Random(seed)
+    mix = []
+    for _ in range(ops):
+        roll = rng.random()
+        source = rng.randrange(1, accounts + 1)
+        if roll < 0.4:
+            mix.append(("deposit", source, 5))
+        elif roll < 0.7:
+            mix.append(("withdraw", source, 3))
+        else:
+            mix.append(("transfer", source, rng.randrange(1, accounts + 1), 4))
+    results = []
+    for shards in shard_counts:
+        with ShardedLedger(shards) as ledger:
+            created = ledger.execute([("create", f"Holder{i}", 1000) for i in range(accounts)])
+            id_map = {i + 1: reply[1] for i, reply in enumerate(created)}
+            batch = [(op[0], id_map[op[1]], id_map[op[2]], op[3]) if op[0] == "transfer"
+                     else (op[0], id_map[op[1]], op[2]) for op in mix]
+            deposited = 0
+            start = time.perf_counter()
+            for lo in range(0, ops, batch_size):
+                for op, (ok, _) in zip(batch[lo:lo + batch_size], ledger.execute(batch[lo:lo + batch_size])):
+                    if ok and op[0] != "transfer":
+                        deposited += op[2] if op[0] == "deposit" else -op[2]
+            seconds = time.perf_counter() - start
+            if ledger.total() != accounts * 1000 + deposited:
+                raise AssertionError("Sharded ledger lost or created money")
+        results.append({"shards": shards, "ops": ops, "seconds": seconds, "ops_per_sec": ops / seconds})
+    return results
+
+# Names used for transaction kinds in exported files
+KIND_NAMES = {
+    DEPOSIT: "deposit",
+    WITHDRAWAL: "withdrawal",
+    TRANSFER_OUT: "transfer_out",
+    TRANSFER_IN: "transfer_in",
+    TOPUP: "topup",
+    REFUND: "refund",
+}
+_KINDS_BY_NAME = {name: kind for kind, name in KIND_NAMES.items()}
+
+# Columns of the CSV export; JSON Lines uses the same keys
+EXPORT_FIELDS = ["record", "name", "account_id", "balance", "kind", "amount", "counterparty", "timestamp"]
+
+def iter_export_rows(accounts):
+    """
+    Yield one dict per account followed by one per transaction
+    
+    Account rows carry the current balance; transaction rows are the history
+    behind it. Nothing beyond the current row is held in memory.
+    
+    Args:
+        accounts (dict): Dictionary of bank accounts
+        
+    Yields:
+        dict: Row keyed by EXPORT_FIELDS (unused fields omitted)
+    """
+    for name, account in accounts.items():
+        yield {"record": "account", "name": name, "account_id": account.account_id,
+               "balance": account.balance}
+        for txn in account.transactions:
+            row = {"record": "transaction", "name": name, "kind": KIND_NAMES[txn.kind],
+                   "amount": txn.amount, "timestamp": txn.timestamp}
+            if txn.counterparty is not None:
+                row["counterparty"] = txn.counterparty
+            yield row
+
+def export_accounts(accounts, out, fmt="csv"):
+    """
+    Stream accounts and their histories to a text file
+    
+    Args:
+        accounts (dict): Dictionary of bank accounts
+        out: Writable text file
+        fmt (str): "csv" or "jsonl"
+        
+    Returns:
+        int: Number of rows written
+    """
+    count = 0
+    if fmt == "csv":
+        writer = csv.DictWriter(out, EXPORT_FIELDS)
+        writer.writeheader()
+        for row in iter_export_rows(accounts):
+            writer.writerow(row)
+            count += 1
+    elif fmt == "jsonl":
+        for row in iter_export_rows(accounts):
+            out.write(json.dumps(row) + "\n")
+            count += 1
+    else:
+        raise ValueError(f"Unknown export format: {fmt}")
+    return count
+
+class ImportReport:
+    #Summary of an import_accounts run
+
+    def __init__(self, max_errors):
+        self.accounts = 0
+        self.transactions = 0
+        self.failed = 0
+        self.errors = []  # (row number, BankingError), first max_errors only
+        self._max_errors = max_errors
+
+    def reject(self, row_number, error):
+        self.failed += 1
+        if len(self.errors) < self._max_errors:
+            self.errors.append((row_number, error))
+
+    def __repr__(self):
+        return (f"ImportReport(accounts={self.accounts}, transactions={self.transactions}, "
+                f"failed={self.failed})")
+
+def _parse_amount(value, what="Amount"):
+    #Parse a number from an imported field, keeping ints as ints
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        number = value
+    else:
+        text = str(value).strip()
+        try:
+            number = int(text)
+        except ValueError:
+            try:
+                number = float(text)
+            except ValueError:
+                raise InvalidAmountError(f"{what} is not a number: {value!r}") from None
+    if number != number or number in (float("inf"), float("-inf")):
+        raise InvalidAmountError(f"{what} is not a finite number")
+    return number
+
+def _iter_import_rows(source, fmt):
+    #Rows of an import file; JSON lines are parsed by the caller so one bad line does not end the stream
+    if fmt == "csv":
+        return csv.DictReader(source)
+    if fmt == "jsonl":
+        return (line for line in source if line.strip())
+    raise ValueError(f"Unknown import format: {fmt}")
+
+def import_accounts(source, accounts, fmt="csv", batch_size=10000, max_errors=1000):
+    """
+    Stream accounts and histories from a file written by export_accounts
+    
+    Rows are validated with the BankingError hierarchy; a bad row is
+    recorded in the report and the run carries on. Transactions are buffered
+    and appended to their account's log in batches. Memory stays bounded by
+    batch_size no matter how large the file is. When importing into a
+    Ledger's store, call checkpoint() afterwards so the imported history is
+    captured in a snapshot.
+    
+    Args:
+        source: Iterable of text lines (e.g. an open file)
+        accounts (dict): Dictionary to add the accounts to
+        fmt (str): "csv" or "jsonl"
+        batch_size (int): Transactions buffered before they are appended
+        max_errors (int): Most row errors kept in the report (all are counted)
+        
+    Returns:
+        ImportReport: Counts and the row errors
+    """
+    report = ImportReport(max_errors)
+    imported = {}   # holder name -> account created by this import
+    pending = {}    # account -> buffered (kind, amount, counterparty, timestamp)
+    buffered = 0
+
+    def flush():
+        nonlocal buffered
+        for account, entries in pending.items():
+            account.transactions.extend(entries)
+            account.version = next(_versions)
+            store = account._store
+            if store is not None and store._by_phone is not None:
+                # Keep an already-built phone index current (the journal is skipped on purpose)
+                for kind, _, phone, _ in entries:
+                    if kind == TOPUP:
+                        store._by_phone.setdefault(phone, set()).add(account.account_id)
+        pending.clear()
+        buffered = 0
+
+    rows = _iter_import_rows(source, fmt)
+    row_number = 0
+    while True:
+        row_number += 1
+        try:
+            row = next(rows)
+            if fmt == "jsonl":
+                row = json.loads(row)
+        except StopIteration:
+            break
+        except (ValueError, csv.Error) as e:
+            report.reject(row_number, InvalidRecordError(f"Unreadable row: {e}"))
+            continue
+        try:
+            record = row.get("record")
+            name = row.get("name")
+            if record == "account":
+                if not name:
+                    raise InvalidRecordError("Account row has no holder name")
+                if name in accounts:
+                    raise DuplicateAccountError("Account with this name already exists")
+                balance = _parse_amount(row.get("balance"), "Balance")
+                if balance < 0:
+                    raise InvalidAmountError("Balance must not be negative")
+                account_id = row.get("account_id")
+                account_id = int(account_id) if account_id not in (None, "") else None
+                if account_id is not None and isinstance(accounts, AccountStore) and account_id in accounts._by_id:
+                    account_id = None  # keep the holder, give them a fresh id
+                account = BankAccount(name, balance, account_id)
+                accounts[name] = account
+                imported[name] = account
+                report.accounts += 1
+            elif record == "transaction":
+                account = imported.get(name)
+                if account is None:
+                    raise AccountNotFoundError("Account not found")
+                kind = _KINDS_BY_NAME.get(row.get("kind"))
+                if kind is None:
+                    raise InvalidRecordError(f"Unknown transaction kind: {row.get('kind')!r}")
+                amount = _parse_amount(row.get("amount"))
+                if amount <= 0:
+                    raise InvalidAmountError("Transaction amount must be positive")
+                timestamp = float(_parse_amount(row.get("timestamp"), "Timestamp"))
+                pending.setdefault(account, []).append((kind, amount, row.get("counterparty") or None, timestamp))
+                buffered += 1
+                report.transactions += 1
+                if buffered >= batch_size:
+                    flush()
+            else:
+                raise InvalidRecordError(f"Unknown record type: {record!r}")
+        except BankingError as e:
+            report.reject(row_number, e)
+        except (ValueError, TypeError, AttributeError) as e:
+            report.reject(row_number, InvalidRecordError(f"Malformed row: {e}"))
+    flush()
+    return report
+
+# Format of the dates printed on statements
+_STATEMENT_TIME = "%Y-%m-%d %H:%M:%S"
+
+def _format_statement(account, start, end):
+    #Render one account's statement for the period (start, end] as text
+    log = account.transactions
+    opening = account.balance_at(start)
+    closing = account.balance_at(end)
+    credits = debits = 0
+    lines = [f"Statement for {account.name} (account {account.account_id})",
+             f"Period: {time.strftime(_STATEMENT_TIME, time.localtime(start))} to "
+             f"{time.strftime(_STATEMENT_TIME, time.localtime(end))}",
+             f"Opening balance: {opening:.2f}"]
+    for i in log.positions_between(start, end):
+        txn = log[i]
+        if txn.kind in _CREDIT_KINDS:
+            credits += txn.amount
+        else:
+            debits += txn.amount
+        lines.append(f"  {time.strftime(_STATEMENT_TIME, time.localtime(txn.timestamp))}  {txn}")
+    lines += [f"Total credits: {credits:.2f}",
+              f"Total debits: {debits:.2f}",
+              f"Closing balance: {closing:.2f}", "", ""]
+    return "\n".join(lines)
+
+def _write_atomically(path, text):
+    #Write a file under a temporary name and rename it, so it exists only when complete
+    with open(path + ".tmp", "w") as f:
+        f.write(text)
+    os.replace(path + ".tmp", path)
+
+def _reset_locks():
+    #Pool initializer: a forked worker may inherit stripe locks held by another thread
+    BankAccount._locks = _NoLocks()
+
+def _period_tag(start, end):
+    #Statement period for file names, e.g. "1500-3000" (times to the microsecond)
+    return "-".join(f"{t:.6f}".rstrip("0").rstrip(".") for t in (start, end))
+
+def _statement_path(directory, account, start, end):
+    return os.path.join(directory, f"statement-{account.account_id}-{_period_tag(start, end)}.txt")
+
+def _statement_worker(accounts, start, end, directory, part):
+    #Process pool task: write a chunk of statements; returns how many were written
+    if part is None:
+        for account in accounts:
+            _write_atomically(_statement_path(directory, account, start, end), _format_statement(account, start, end))
+    else:
+        _write_atomically(part, "".join(_format_statement(account, start, end) for account in accounts))
+    return len(accounts)
+
+def generate_statements(accounts, start, end, directory, combined=False, processes=None, chunk_size=1000,
+                        progress=None):
+    """
+    Write period statements for every account using a process pool
+    
+    Each statement has the opening balance, the transactions posted in
+    (start, end], credit and debit totals and the closing balance. Accounts
+    are sent to the workers in chunks, with only a few chunks in flight, so
+    memory does not grow with the number of accounts. Every file is written
+    under a temporary name and renamed once complete; a re-run skips the
+    statements (or combined-file parts) that already exist. File names
+    carry the period, e.g. statement-<account id>-<start>-<end>.txt, so
+    several periods can share a directory.
+    
+    Args:
+        accounts (dict): Dictionary of bank accounts
+        start (float): Period start (seconds since the epoch, exclusive)
+        end (float): Period end (inclusive)
+        directory (str): Where to write the statements
+        combined (bool): Write one statements-<start>-<end>.txt instead of one file per account
+            (accounts must be iterated in the same order when resuming)
+        processes (int): Worker processes (default: one per CPU)
+        chunk_size (int): Accounts per worker task
+        progress (callable): Called with (statements done, total) as chunks
+            finish; returning False stops the run before the next chunk starts.
+            A stopped run keeps what it wrote and resumes from there when re-run.
+        
+    Returns:
+        dict: {"written": statements written, "skipped": statements already done}
+    """
+    os.makedirs(directory, exist_ok=True)
+    combined_path = os.path.join(directory, f"statements-{_period_tag(start, end)}.txt")
+    if combined and os.path.exists(combined_path):
+        return {"written": 0, "skipped": len(accounts)}
+    processes = processes or os.cpu_count() or 1
+    written = skipped = 0
+    stopped = False
+    parts = []
+    import concurrent.futures
+    with concurrent.futures.ProcessPoolExecutor(processes, initializer=_reset_locks) as pool:
+        pending = set()
+        chunks = iter(accounts.values())
+        for number in itertools.count():
+            chunk = list(itertools.islice(chunks, chunk_size))
+            if not chunk:
+                break
+            if progress is not None and progress(written + skipped, len(accounts)) is False:
+                stopped = True
+                break
+            part = None
+            if combined:
+                part = f"{combined_path}.part-{number:08d}"
+                parts.append(part)
+                if os.path.exists(part):
+                    skipped += len(chunk)
+                    continue
+            else:
+                todo = [account for account in chunk
+                        if not os.path.exists(_statement_path(directory, account, start, end))]
+                skipped += len(chunk) - len(todo)
+                chunk = todo
+                if not chunk:
+                    continue
+            if len(pending) >= 2 * processes:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                written += sum(future.result() for future in done)
+            pending.add(pool.submit(_statement_worker, chunk, start, end, directory, part))
+        written += sum(future.result() for future in concurrent.futures.as_completed(pending))
+    if progress is not None:
+        progress(written + skipped, len(accounts))
+    if combined and not stopped:
+        with open(combined_path + ".tmp", "wb") as out:
+            for part in parts:
+                with open(part, "rb") as f:
+                    while block := f.read(1 << 20):
+                        out.write(block)
+        os.replace(combined_path + ".tmp", combined_path)
+        for part in parts:
+            os.remove(part)
+    return {"written": written, "skipped": skipped}
+
+# Carrier serving each mobile number prefix
+CARRIER_PREFIXES = {"17": "B-Mobile", "77": "TashiCell"}
+
+def carrier_of(phone_number):
+    #Carrier of a mobile number; raises TopupDeliveryError for unknown prefixes
+    carrier = CARRIER_PREFIXES.get(str(phone_number)[:2])
+    if carrier is None:
+        raise TopupDeliveryError(f"No carrier serves {phone_number}", permanent=True)
+    return carrier
+
+class _LocalGatewayConnection:
+    #One connection to a LocalGateway
+
+    def __init__(self, gateway):
+        self.gateway = gateway
+
+    async def send_batch(self, carrier, items):
+        #Deliver [(phone, amount), ...]; returns None or a TopupDeliveryError per item
+        gateway = self.gateway
+        await asyncio.sleep(gateway.latency)
+        gateway.batches += 1
+        if gateway.failure_rate and gateway.rng.random() < gateway.failure_rate:
+            raise TopupDeliveryError(f"{carrier} gateway timed out")
+        results = []
+        for phone, amount in items:
+            if phone in gateway.reject:
+                results.append(TopupDeliveryError(f"{carrier} rejected {phone}", permanent=True))
+            else:
+                gateway.delivered[phone] = gateway.delivered.get(phone, 0) + amount
+                results.append(None)
+        return results
+
+    async def close(self):
+        pass
+
+class LocalGateway:
+    #In-process stand-in for the carrier top-up gateway, for tests and benchmarks
+
+    def __init__(self, latency=0.001, failure_rate=0.0, reject=(), seed=None):
+        """
+        Initialize the stand-in gateway
+        
+        Args:
+            latency (float): Seconds each connect and each batch takes
+            failure_rate (float): Chance a whole batch fails transiently
+            reject: Phone numbers the carrier refuses permanently
+            seed (int): Seed for the failure draws
+        """
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.reject = set(reject)
+        self.rng = random.Random(seed)
+        self.delivered = {}  # phone -> total amount delivered
+        self.connections = 0
+        self.batches = 0
+
+    async def connect(self):
+        self.connections += 1
+        await asyncio.sleep(self.latency)
+        return _LocalGatewayConnection(self)
+
+class GatewayPool:
+    #Fixed-size pool of gateway connections, opened on first use
+
+    def __init__(self, gateway, size=4):
+        self.gateway = gateway
+        self.size = size
+        self._idle = asyncio.Queue()
+        self._opened = 0
+
+    async def acquire(self):
+        #Take an idle connection, opening a new one while below size
+        if self._idle.empty() and self._opened < self.size:
+            connection = None
+        else:
+            connection = await self._idle.get()
+        if connection is not None:
+            return connection
+        # A free slot (None is queued when a connection is discarded, to wake a waiter)
+        self._opened += 1
+        try:
+            return await self.gateway.connect()
+        except BaseException:
+            self._opened -= 1
+            self._idle.put_nowait(None)
+            raise
+
+    def release(self, connection):
+        self._idle.put_nowait(connection)
+
+    async def discard(self, connection):
+        #Drop a connection that failed; its slot goes to the next batch waiting for one
+        self._opened -= 1
+        self._idle.put_nowait(None)
+        await connection.close()
+
+    async def close(self):
+        while not self._idle.empty():
+            connection = self._idle.get_nowait()
+            if connection is not None:
+                self._opened -= 1
+                await connection.close()
+
+class TopupDispatcher:
+    #Asynchronous queue that delivers mobile top-ups to carriers in batches
+
+    def __init__(self, gateway, batch_size=100, max_delay=0.005, pool_size=4, retries=3, backoff=0.01):
+        """
+        Initialize the dispatcher
+        
+        Top-ups are debited when submitted and queued per carrier. A carrier's
+        queue is sent as one batch once it holds batch_size top-ups or its
+        oldest entry has waited max_delay seconds. Failed batches are retried
+        with exponential backoff; a top-up that fails permanently or runs out
+        of retries is refunded to its account.
+        
+        Args:
+            gateway: Object with an async connect() returning connections that
+                have async send_batch(carrier, items) and close() (e.g. LocalGateway)
+            batch_size (int): Most top-ups per gateway call
+            max_delay (float): Longest a top-up waits for its batch to fill
+            pool_size (int): Gateway connections kept open
+            retries (int): Extra attempts after a transient failure
+            backoff (float): Delay before the first retry, doubled each time
+        """
+        self.gateway = gateway
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff = backoff
+        self.delivered = 0
+        self.refunded = 0
+        self._loop = None
+        self._pool = None
+        self._pending = {}   # carrier -> [(account, amount, phone, future)]
+        self._timers = {}    # carrier -> flush timer handle
+        self._inflight = set()
+
+    async def start(self):
+        #Bind the dispatcher to the running event loop
+        self._loop = asyncio.get_running_loop()
+        self._pool = GatewayPool(self.gateway, self.pool_size)
+        return self
+
+    def submit(self, account, amount, phone_number):
+        """
+        Debit a top-up from an account and queue it for delivery
+        
+        Must be called from the dispatcher's event loop thread; other threads
+        use submit_threadsafe.
+        
+        Args:
+            account (BankAccount): Account paying for the top-up
+            amount (float): Amount to top up
+            phone_number (str): Phone number to top up
+            
+        Returns:
+            asyncio.Future: Resolves to True once delivered, False if refunded
+            
+        Raises:
+            TopupDeliveryError: If no carrier serves the number
+            InvalidAmountError: If amount is not positive
+            InsufficientFundsError: If account has insufficient funds
+        """
+        carrier = carrier_of(phone_number)
+        account.mobile_topup(amount, phone_number)
+        future = self._loop.create_future()
+        batch = self._pending.setdefault(carrier, [])
+        batch.append((account, amount, phone_number, future))
+        if len(batch) >= self.batch_size:
+            self._flush(carrier)
+        elif carrier not in self._timers:
+            self._timers[carrier] = self._loop.call_later(self.max_delay, self._flush, carrier)
+        return future
+
+    def submit_threadsafe(self, account, amount, phone_number):
+        #submit() from another thread; returns a concurrent.futures.Future
+        async def submit():
+            return await self.submit(account, amount, phone_number)
+        return asyncio.run_coroutine_threadsafe(submit(), self._loop)
 
-class InvalidAmountError(BankingError):
-    #Exception raised when an invalid amount is entered
-    pass
+    def _flush(self, carrier):
+        #Send a carrier's queued top-ups as one batch
+        timer = self._timers.pop(carrier, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(carrier, None)
+        if batch:
+            task = self._loop.create_task(self._deliver(carrier, batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
 
-class AccountNotFoundError(BankingError):
-    #Exception raised when an account is not found
-    pass
+    async def _deliver(self, carrier, batch):
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(delay)
+                delay *= 2
+            try:
+                connection = await self._pool.acquire()
+            except (OSError, TopupDeliveryError):
+                continue
+            try:
+                results = await connection.send_batch(carrier, [(phone, amount) for _, amount, phone, _ in batch])
+            except (OSError, TopupDeliveryError) as e:
+                await self._pool.discard(connection)
+                if getattr(e, "permanent", False):
+                    break
+                continue
+            self._pool.release(connection)
+            retry = []
+            for item, error in zip(batch, results):
+                if error is None:
+                    self._settle(item, True)
+                elif error.permanent:
+                    self._settle(item, False)
+                else:
+                    retry.append(item)
+            batch = retry
+            if not batch:
+                return
+        for item in batch:
+            self._settle(item, False)
 
-class BankAccount:
-    #Class representing a bank account with basic operations
+    def _settle(self, item, delivered):
+        account, amount, phone_number, future = item
+        if delivered:
+            self.delivered += 1
+        else:
+            account.refund_topup(amount, phone_number)
+            self.refunded += 1
+        if not future.done():
+            future.set_result(delivered)
+
+    async def close(self):
+        #Send everything still queued, wait for delivery and close the pool
+        for carrier in list(self._pending):
+            self._flush(carrier)
+        while self._inflight:
+            await asyncio.gather(*list(self._inflight))
+        await self._pool.close()
+
+async def _run_topups(dispatcher, accounts, count):
+    await dispatcher.start()
+    phones = ["17%06d" % i if i % 2 else "77%06d" % i for i in range(1000)]
+    futures = [dispatcher.submit(accounts[i % len(accounts)], 1, phones[i % len(phones)])
+               for i in range(count)]
+    await dispatcher.close()
+    return sum(f.result() for f in futures)
+
+def benchmark_topups(batch_sizes=(1, 10, 100), count=20000, latency=0.002, pool_size=4):
+    """
+    Measure top-up delivery throughput against a LocalGateway
     
-    def __init__(self, name, initial_balance=0):
+    Args:
+        batch_sizes (tuple): Dispatcher batch sizes to compare
+        count (int): Top-ups submitted per run
+        latency (float): Simulated gateway round trip in seconds
+        pool_size (int): Gateway connections
+        
+    Returns:
+        list: One dict per batch size with seconds, top-ups per second and gateway calls
+    """
+    results = []
+    for batch_size in batch_sizes:
+        accounts = [BankAccount(f"Holder{i}", 10**9) for i in range(100)]
+        gateway = LocalGateway(latency=latency)
+        dispatcher = TopupDispatcher(gateway, batch_size=batch_size, pool_size=pool_size)
+        start = time.perf_counter()
+        delivered = asyncio.run(_run_topups(dispatcher, accounts, count))
+        seconds = time.perf_counter() - start
+        results.append({"batch_size": batch_size, "seconds": seconds, "per_second": count / seconds,
+                        "delivered": delivered, "gateway_calls": gateway.batches})
+    return results
+
+class RenderCache:
+    #Bounded LRU cache of rendered account views, keyed by account id and version
+
+    def __init__(self, max_entries=256, max_chars=4_000_000):
         """
-        Initialize a bank account
+        Initialize the cache
         
         Args:
-            name (str): Account holder name
-            initial_balance (float): Starting balance (default 0)
+            max_entries (int): Most views kept
+            max_chars (int): Most characters kept across all views (larger
+                views are rendered but not cached)
         """
-        self.name = name
-        self.balance = initial_balance
-        self.transactions = []
-    
-    def deposit(self, amount):
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self.chars = 0
+        self.hits = 0
+        self.misses = 0
+        self._views = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, account, view, render):
         """
-        Deposit money into the account
+        Return a rendered view of an account, rendering it only if it changed
         
         Args:
-            amount (float): Amount to deposit
+            account (BankAccount): Account the view shows
+            view (tuple): What is shown, e.g. ("page", start, stop)
+            render: Callable returning the view's text
             
-        Raises:
-            InvalidAmountError: If amount is not positive
+        Returns:
+            str: The rendered text
         """
-        if amount <= 0:
-            raise InvalidAmountError("Deposit amount must be positive")
-        self.balance += amount
-        self.transactions.append(f"Deposited: {amount}")
-    
-    def withdraw(self, amount):
+        key = (account.account_id, account.version, view)
+        with self._lock:
+            text = self._views.get(key)
+            if text is not None:
+                self._views.move_to_end(key)
+                self.hits += 1
+                return text
+            self.misses += 1
+        text = render()
+        if len(text) <= self.max_chars:
+            with self._lock:
+                if key not in self._views:
+                    self._views[key] = text
+                    self.chars += len(text)
+                    while len(self._views) > self.max_entries or self.chars > self.max_chars:
+                        self.chars -= len(self._views.popitem(last=False)[1])
+        return text
+
+    def clear(self):
+        with self._lock:
+            self._views.clear()
+            self.chars = 0
+
+    def __len__(self):
+        return len(self._views)
+
+# Shared cache for the GUI history pages and the console history view
+render_cache = RenderCache()
+
+def render_history(account, start=0, stop=None):
+    #History lines "- <transaction>" for positions start..stop, through render_cache
+    return render_cache.get(account, ("history", start, stop), lambda: "".join(
+        f"- {txn}\n" for txn in account.transactions.render(start, stop)))
+
+def render_summary(account):
+    #Balance line shown above the history, through render_cache
+    return render_cache.get(account, ("summary",), lambda: f"Balance for {account.name}: ${account.balance:.2f}")
+
+# Transactions shown per page of the GUI history view
+HISTORY_PAGE_SIZE = 10
+
+class HistoryPager:
+    #Page arithmetic and incremental-update planning for the GUI history view
+
+    def __init__(self, page_size=HISTORY_PAGE_SIZE):
         """
-        Withdraw money from the account
+        Initialize the pager
         
         Args:
-            amount (float): Amount to withdraw
+            page_size (int): Transactions per page
+        """
+        self.page_size = page_size
+        self.page = None        # None follows the newest page
+        self._shown = None      # (account, start, stop) currently in the widget
+
+    def page_count(self, total):
+        return max(1, -(-total // self.page_size))
+
+    def current_page(self, total):
+        last = self.page_count(total) - 1
+        return last if self.page is None else min(self.page, last)
+
+    def go(self, page, total):
+        #Move to a page (clamped); the last page keeps following new transactions
+        last = self.page_count(total) - 1
+        page = max(0, min(page, last))
+        self.page = None if page == last else page
+
+    def reset(self):
+        #Forget what is on screen and follow the newest page again
+        self.page = None
+        self._shown = None
+
+    def plan(self, account, total):
+        """
+        Decide how to bring the widget up to date
+        
+        Args:
+            account: Account being displayed
+            total (int): Number of transactions it has
             
-        Raises:
-            InvalidAmountError: If amount is not positive
-            InsufficientFundsError: If account has insufficient funds
+        Returns:
+            tuple: ("append", start, stop) to add only transactions start..stop
+                below what is shown, or ("replace", start, stop) to redraw the page
         """
-        if amount <= 0:
-            raise InvalidAmountError("Withdrawal amount must be positive")
-        if amount > self.balance:
-            raise InsufficientFundsError("Insufficient funds for withdrawal")
-        self.balance -= amount
-        self.transactions.append(f"Withdrew: {amount}")
-    
-    def transfer(self, amount, target_account):
+        start = self.current_page(total) * self.page_size
+        stop = min(start + self.page_size, total)
+        shown = self._shown
+        self._shown = (account, start, stop)
+        if (shown is not None and shown[0] is account and shown[1] == start
+                and shown[1] < shown[2] <= stop):
+            return "append", shown[2], stop
+        return "replace", start, stop
+
+class GuiJob:
+    #Handle on work sent off the Tk thread: progress, cancellation and completion
+
+    def __init__(self, worker, on_progress=None):
+        self.done = False
+        self.progress = (0, None)  # (done, total) as last reported by the job
+        self._worker = worker
+        self._on_progress = on_progress
+        self._progress_queued = False
+        self._cancel = threading.Event()
+        self._future = None
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        #Ask the job to stop; a job that has not started yet never runs
+        self._cancel.set()
+        if self._future is not None:
+            self._future.cancel()
+
+    def report(self, done, total=None):
+        #Called by the job; on_progress sees the latest value on the Tk thread, without flooding the queue
+        self.progress = (done, total)
+        if self._on_progress is not None and not self._progress_queued:
+            self._progress_queued = True
+            self._worker._results.put((self._deliver_progress, ()))
+
+    def _deliver_progress(self):
+        self._progress_queued = False
+        self._on_progress(*self.progress)
+
+def _reraise(error):
+    #Default on_error: raise on the Tk thread, where Tk reports it like any callback error
+    raise error
+
+class GuiWorker:
+    #Runs ledger work off the Tk event thread and hands results back through a polled queue
+
+    def __init__(self, master, workers=2, poll_ms=20):
         """
-        Transfer money to another account
+        Initialize the worker
+        
+        Account operations and imports run one at a time, in the order they
+        were submitted, on a single writer thread, so they need no locks
+        between them. Read-only jobs (statement export) run on a small pool
+        next to it. Results and progress are queued and handed to their
+        callbacks by a master.after timer, so callbacks always run on the
+        Tk thread. Every timer tick records how late it fired in
+        loop_latency: the event-loop latency the user feels.
         
         Args:
-            amount (float): Amount to transfer
-            target_account (BankAccount): Account to transfer to
+            master: Tk root (anything with after/after_cancel)
+            workers (int): Threads for read-only jobs
+            poll_ms (int): How often the result queue is polled
+        """
+        self.master = master
+        self.workers = workers
+        self.poll_ms = poll_ms
+        self.loop_latency = LatencyHistogram()
+        self.worst_lag_ns = 0
+        self._results = queue.SimpleQueue()
+        self._writer = None  # executors are created on first use
+        self._pool = None
+        self._jobs = set()  # long jobs still running, cancelled by close()
+        self._previous_locks = None
+        self._closed = False
+        self._schedule()
+
+    def _schedule(self):
+        self._due = time.perf_counter_ns() + self.poll_ms * 1_000_000
+        self._timer = self.master.after(self.poll_ms, self._poll)
+
+    def _poll(self):
+        #Timer tick on the Tk thread: record its lateness, then run finished work's callbacks
+        lag = max(0, time.perf_counter_ns() - self._due)
+        self.loop_latency.observe(lag)
+        if lag > self.worst_lag_ns:
+            self.worst_lag_ns = lag
+        try:
+            self.drain()
+        finally:
+            if not self._closed:
+                self._schedule()
+
+    def drain(self):
+        #Run queued callbacks on the calling (Tk) thread; returns how many ran
+        ran = 0
+        while True:
+            try:
+                callback, args = self._results.get_nowait()
+            except queue.Empty:
+                return ran
+            callback(*args)
+            ran += 1
+
+    def call(self, func, *args, on_done=None, on_error=None):
+        """
+        Run func(*args) on the writer thread
+        
+        Args:
+            func (callable): Work to run, e.g. account.deposit
+            on_done (callable): Called on the Tk thread with the result
+            on_error (callable): Called on the Tk thread with the exception
+                (default: raise it there)
             
-        Raises:
-            InvalidAmountError: If amount is not positive
-            InsufficientFundsError: If account has insufficient funds
+        Returns:
+            GuiJob: Handle on the work
         """
-        if amount <= 0:
-            raise InvalidAmountError("Transfer amount must be positive")
-        if amount > self.balance:
-            raise InsufficientFundsError("Insufficient funds for transfer")
-        self.balance -= amount
-        target_account.balance += amount
-        self.transactions.append(f"Transferred: {amount} to {target_account.name}")
-        target_account.transactions.append(f"Received: {amount} from {self.name}")
-    
-    def mobile_topup(self, amount, phone_number):
+        return self._submit(self._executor(True), func, args, False, on_done, on_error, None)
+
+    def start(self, func, *args, on_done=None, on_error=None, on_progress=None, writes=False):
         """
-        Top up mobile phone balance
+        Start a long job func(job, *args) that can report progress and be cancelled
+        
+        The job should call job.report(done, total) now and then and stop
+        early once job.cancelled is set.
         
         Args:
-            amount (float): Amount to top up
-            phone_number (str): Phone number to top up
+            func (callable): Job taking the GuiJob as its first argument
+            on_done (callable): Called on the Tk thread with the result
+            on_error (callable): Called on the Tk thread with the exception
+            on_progress (callable): Called on the Tk thread with (done, total)
+            writes (bool): The job changes accounts (e.g. an import), so it
+                runs on the writer thread in order with account operations
             
-        Raises:
-            InvalidAmountError: If amount is not positive
-            InsufficientFundsError: If account has insufficient funds
+        Returns:
+            GuiJob: Handle used to cancel the job
         """
-        if amount <= 0:
-            raise InvalidAmountError("Top-up amount must be positive")
-        if amount > self.balance:
-            raise InsufficientFundsError("Insufficient funds for top-up")
-        self.balance -= amount
-        self.transactions.append(f"Mobile top-up: {amount} to {phone_number}")
-    
-    def get_transactions(self):
-        #Return list of transactions
-        return self.transactions
-    
-    def _str_(self):
-        """String representation of account"""
-        return f"Account(name={self.name}, balance={self.balance})"
+        return self._submit(self._executor(writes), func, args, True, on_done, on_error, on_progress)
+
+    def _executor(self, writes):
+        #The writer thread or the job pool, created on first use
+        import concurrent.futures
+        if writes:
+            if self._writer is None:
+                self._writer = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="gui-writer")
+            return self._writer
+        if self._pool is None:
+            if isinstance(BankAccount._locks, _NoLocks):
+                # Jobs read accounts while the writer changes them
+                self._previous_locks = BankAccount._locks
+                enable_concurrency()
+            self._pool = concurrent.futures.ThreadPoolExecutor(self.workers, thread_name_prefix="gui-job")
+        return self._pool
+
+    def _submit(self, executor, func, args, pass_job, on_done, on_error, on_progress):
+        job = GuiJob(self, on_progress)
+
+        def run():
+            try:
+                result = func(job, *args) if pass_job else func(*args)
+            except Exception as e:
+                self._results.put((on_error or _reraise, (e,)))
+            else:
+                if on_done is not None:
+                    self._results.put((on_done, (result,)))
+            finally:
+                job.done = True
+                self._jobs.discard(job)
+
+        if pass_job:
+            self._jobs.add(job)
+        job._future = executor.submit(run)
+        return job
+
+    def flush(self, timeout=None):
+        #Wait for the writer thread to finish what was sent to it, then run the callbacks
+        if self._writer is not None:
+            self._writer.submit(lambda: None).result(timeout)
+        self.drain()
+
+    def close(self):
+        #Stop polling, cancel long jobs and wait for the threads (account operations already sent still complete)
+        self._closed = True
+        self.master.after_cancel(self._timer)
+        for job in list(self._jobs):
+            job.cancel()
+        for executor in (self._writer, self._pool):
+            if executor is not None:
+                executor.shutdown(wait=True)
+        if self._previous_locks is not None:
+            BankAccount._locks = self._previous_locks
+            self._previous_locks = None
+
+def _import_job(job, path, accounts):
+    #GUI job: import an export file, reporting characters read; cancelling stops at the next line
+    size = os.path.getsize(path) or 1
+    fmt = "jsonl" if path.endswith((".jsonl", ".json")) else "csv"
+    with open(path, newline="") as f:
+        def lines():
+            read = 0
+            for number, line in enumerate(f, 1):
+                if job.cancelled:
+                    return
+                read += len(line)
+                if number % 1000 == 0:
+                    job.report(read, size)
+                yield line
+            job.report(size, size)
+        return import_accounts(lines(), accounts, fmt)
+
+def _statement_job(job, accounts, start, end, directory):
+    #GUI job: write statements, reporting accounts done; cancelling stops after the running chunks
+
+    def progress(done, total):
+        job.report(done, total)
+        return not job.cancelled
+
+    return generate_statements(accounts, start, end, directory, progress=progress)
 
 class BankingAppGUI:
     #Class providing a GUI for the banking application
     
-    def __init__(self, master):
+    def __init__(self, master, accounts=None):
         """
         Initialize the banking application GUI
         
+        Handlers only ask for input and draw; the ledger work itself runs on
+        a GuiWorker, so the window keeps responding while it happens.
+        
         Args:
             master: The root window
+            accounts (dict): Accounts to manage, e.g. a Ledger's store (default: new AccountStore)
         """
+        _load_tk()
         self.master = master
         master.title("Banking Application")
         
-        self.accounts = {}
+        self.accounts = AccountStore() if accounts is None else accounts
         self.current_account = None
+        self.pager = HistoryPager()
+        self.worker = GuiWorker(master)
+        self.job = None  # the running import or statement export, if any
         
         # Create widgets
         self.label = tk.Label(master, text="Welcome to Banking App")
@@ -158,9 +3890,35 @@ class BankingAppGUI:
         self.balance_label = tk.Label(master, text="No account selected")
         self.balance_label.pack()
         
-        self.transactions_text = tk.Text(master, height=10, width=50, state=tk.DISABLED)
+        self.transactions_text = tk.Text(master, height=HISTORY_PAGE_SIZE + 1, width=50, state=tk.DISABLED)
         self.transactions_text.pack()
         
+        # History paging: only one page of transactions is ever in the widget
+        self.page_frame = tk.Frame(master)
+        self.page_frame.pack()
+        self.prev_page_button = tk.Button(self.page_frame, text="< Prev", command=lambda: self.change_page(-1))
+        self.prev_page_button.pack(side=tk.LEFT)
+        self.page_label = tk.Label(self.page_frame, text="")
+        self.page_label.pack(side=tk.LEFT)
+        self.next_page_button = tk.Button(self.page_frame, text="Next >", command=lambda: self.change_page(1))
+        self.next_page_button.pack(side=tk.LEFT)
+        self.goto_page_button = tk.Button(self.page_frame, text="Go to page", command=self.goto_page)
+        self.goto_page_button.pack(side=tk.LEFT)
+        
+        # Long jobs run in the background with their progress and a Cancel button
+        self.import_button = tk.Button(master, text="Import Accounts", command=self.import_accounts)
+        self.import_button.pack()
+        
+        self.export_button = tk.Button(master, text="Export Statements", command=self.export_statements)
+        self.export_button.pack()
+        
+        self.job_frame = tk.Frame(master)
+        self.job_frame.pack()
+        self.job_label = tk.Label(self.job_frame, text="")
+        self.job_label.pack(side=tk.LEFT)
+        self.cancel_button = tk.Button(self.job_frame, text="Cancel", command=self.cancel_job, state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.LEFT)
+        
         self.quit_button = tk.Button(master, text="Quit", command=master.quit)
         self.quit_button.pack()
     
@@ -173,8 +3931,12 @@ class BankingAppGUI:
             else:
                 initial_balance = simpledialog.askfloat("Create Account", "Enter initial balance:", minvalue=0)
                 if initial_balance is not None:
-                    self.accounts[name] = BankAccount(name, initial_balance)
-                    messagebox.showinfo("Success", f"Account created for {name}")
+                    def create():
+                        # Checked again here: a create queued earlier may have taken the name
+                        if name in self.accounts:
+                            raise DuplicateAccountError("Account with this name already exists")
+                        self.accounts[name] = BankAccount(name, initial_balance)
+                    self._run(create, success=f"Account created for {name}")
     
     def select_account(self):
         #Select an existing account
@@ -183,28 +3945,65 @@ class BankingAppGUI:
             return
         
         name = simpledialog.askstring("Select Account", "Enter account holder name:")
-        if name and name in self.accounts:
-            self.current_account = self.accounts[name]
+        if name:
+            # Looked up on the worker: imports there may be changing the store and its name index
+            def find():
+                account = self.accounts.get(name)
+                return account, [] if account is not None else suggest_accounts(self.accounts, name)
+            self.worker.call(find, on_done=lambda found: self._selected(*found), on_error=self._show_error)
+    
+    def _selected(self, account, suggestions):
+        #Show the account select_account found, or offer similar names
+        if account is not None:
+            self.current_account = account
+            self.pager.reset()
             self.update_display()
             self.enable_account_buttons()
-        elif name:
+        elif suggestions:
+            messagebox.showerror("Error", f"Account not found. Did you mean: {', '.join(suggestions)}?")
+        else:
             messagebox.showerror("Error", "Account not found")
     
     def update_display(self):
-        #Update the display with current account info
+        #Update the display with current account info (only the visible page is rendered)
         if self.current_account:
-            self.balance_label.config(text=f"Balance for {self.current_account.name}: ${self.current_account.balance:.2f}")
+            account = self.current_account
+            self.balance_label.config(text=render_summary(account))
             
+            # Read under the account lock: spill_histories may be compacting this log
+            with BankAccount._locks.hold(account):
+                total = len(account.transactions)
+                mode, start, stop = self.pager.plan(account, total)
+                lines = render_history(account, start, stop)
             self.transactions_text.config(state=tk.NORMAL)
-            self.transactions_text.delete(1.0, tk.END)
-            transactions = self.current_account.get_transactions()
-            if transactions:
-                self.transactions_text.insert(tk.END, "Transaction History:\n")
-                for txn in transactions:
-                    self.transactions_text.insert(tk.END, f"- {txn}\n")
+            if mode == "append":
+                self.transactions_text.insert(tk.END, lines)
             else:
-                self.transactions_text.insert(tk.END, "No transactions yet")
+                self.transactions_text.delete(1.0, tk.END)
+                if total:
+                    self.transactions_text.insert(tk.END, "Transaction History:\n" + lines)
+                else:
+                    self.transactions_text.insert(tk.END, "No transactions yet")
             self.transactions_text.config(state=tk.DISABLED)
+            page = self.pager.current_page(total)
+            self.page_label.config(text=f"Page {page + 1} of {self.pager.page_count(total)}")
+    
+    def change_page(self, step):
+        #Show the previous or next page of history
+        if self.current_account:
+            total = len(self.current_account.transactions)
+            self.pager.go(self.pager.current_page(total) + step, total)
+            self.update_display()
+    
+    def goto_page(self):
+        #Jump straight to any page of history
+        if self.current_account:
+            total = len(self.current_account.transactions)
+            page = simpledialog.askinteger("Go to page", f"Page (1-{self.pager.page_count(total)}):",
+                                           minvalue=1, maxvalue=self.pager.page_count(total))
+            if page:
+                self.pager.go(page - 1, total)
+                self.update_display()
     
     def enable_account_buttons(self):
         #Enable buttons that require an account to be selected
@@ -213,27 +4012,31 @@ class BankingAppGUI:
                       self.delete_button]:
             button.config(state=tk.NORMAL)
     
+    def _run(self, func, *args, success=None):
+        #Send an account operation to the worker; refresh and report once it is done
+        def done(_):
+            self.update_display()
+            if success:
+                messagebox.showinfo("Success", success)
+        self.worker.call(func, *args, on_done=done, on_error=self._show_error)
+    
+    def _show_error(self, error):
+        #Banking errors go to a dialog; anything else is raised for Tk to report
+        if not isinstance(error, BankingError):
+            raise error
+        messagebox.showerror("Error", str(error))
+    
     def deposit(self):
         #Deposit money into the selected account
         amount = simpledialog.askfloat("Deposit", "Enter amount to deposit:", minvalue=0.01)
         if amount:
-            try:
-                self.current_account.deposit(amount)
-                self.update_display()
-                messagebox.showinfo("Success", f"Deposited ${amount:.2f}")
-            except BankingError as e:
-                messagebox.showerror("Error", str(e))
+            self._run(self.current_account.deposit, amount, success=f"Deposited ${amount:.2f}")
     
     def withdraw(self):
         #Withdraw money from the selected account
         amount = simpledialog.askfloat("Withdraw", "Enter amount to withdraw:", minvalue=0.01)
         if amount:
-            try:
-                self.current_account.withdraw(amount)
-                self.update_display()
-                messagebox.showinfo("Success", f"Withdrew ${amount:.2f}")
-            except BankingError as e:
-                messagebox.showerror("Error", str(e))
+            self._run(self.current_account.withdraw, amount, success=f"Withdrew ${amount:.2f}")
     
     def transfer(self):
         #Transfer money to another account
@@ -250,12 +4053,14 @@ class BankingAppGUI:
             if target_name in self.accounts:
                 amount = simpledialog.askfloat("Transfer", "Enter amount to transfer:", minvalue=0.01)
                 if amount:
-                    try:
-                        self.current_account.transfer(amount, self.accounts[target_name])
-                        self.update_display()
-                        messagebox.showinfo("Success", f"Transferred ${amount:.2f} to {target_name}")
-                    except BankingError as e:
-                        messagebox.showerror("Error", str(e))
+                    source = self.current_account
+                    def send():
+                        # Looked up again here: a delete queued earlier may have removed the recipient
+                        target = self.accounts.get(target_name)
+                        if target is None:
+                            raise AccountNotFoundError("Recipient account not found")
+                        source.transfer(amount, target)
+                    self._run(send, success=f"Transferred ${amount:.2f} to {target_name}")
             else:
                 messagebox.showerror("Error", "Recipient account not found")
     
@@ -265,19 +4070,21 @@ class BankingAppGUI:
         if phone_number:
             amount = simpledialog.askfloat("Mobile Top-up", "Enter amount to top up:", minvalue=0.01)
             if amount:
-                try:
-                    self.current_account.mobile_topup(amount, phone_number)
-                    self.update_display()
-                    messagebox.showinfo("Success", f"Topped up ${amount:.2f} to {phone_number}")
-                except BankingError as e:
-                    messagebox.showerror("Error", str(e))
+                self._run(self.current_account.mobile_topup, amount, phone_number,
+                          success=f"Topped up ${amount:.2f} to {phone_number}")
     
     def delete_account(self):
         #Delete the selected account
         confirm = messagebox.askyesno("Confirm", f"Delete account for {self.current_account.name}?")
         if confirm:
-            del self.accounts[self.current_account.name]
+            name = self.current_account.name
+            def delete():
+                del self.accounts[name]
+            self.worker.call(delete, on_done=lambda _: messagebox.showinfo("Success", "Account deleted"),
+                             on_error=self._show_error)
             self.current_account = None
+            self.pager.reset()
+            self.page_label.config(text="")
             self.balance_label.config(text="No account selected")
             self.transactions_text.config(state=tk.NORMAL)
             self.transactions_text.delete(1.0, tk.END)
@@ -287,8 +4094,70 @@ class BankingAppGUI:
                          self.transfer_button, self.topup_button, 
                          self.delete_button]:
                 button.config(state=tk.DISABLED)
-            
-            messagebox.showinfo("Success", "Account deleted")
+    
+    def import_accounts(self):
+        #Import accounts and their histories from a CSV or JSON Lines export in the background
+        path = filedialog.askopenfilename(title="Import Accounts",
+                                          filetypes=[("Exports", "*.csv *.jsonl"), ("All files", "*")])
+        if path:
+            def done(report):
+                self.update_display()
+                messagebox.showinfo("Import", f"Imported {report.accounts} accounts and "
+                                    f"{report.transactions} transactions ({report.failed} bad rows)")
+            self._start_job("Importing", _import_job, path, self.accounts, writes=True, on_done=done)
+    
+    def export_statements(self):
+        #Write statements for every account into a folder in the background
+        days = simpledialog.askinteger("Export Statements", "Statement period (days):", minvalue=1, initialvalue=30)
+        if not days:
+            return
+        directory = filedialog.askdirectory(title="Statements folder")
+        if directory:
+            end = time.time()
+            def done(result):
+                messagebox.showinfo("Export", f"Wrote {result['written']} statements "
+                                    f"({result['skipped']} already done)")
+            # The account list is copied on the worker, in order with pending operations
+            self.worker.call(dict, self.accounts, on_error=self._show_error, on_done=lambda accounts: self._start_job(
+                "Exporting statements", _statement_job, accounts, end - days * _DAY, end, directory, on_done=done))
+    
+    def _start_job(self, title, func, *args, writes=False, on_done=None):
+        #Start a long job, showing its progress next to the Cancel button
+        if self.job is not None and not self.job.done:
+            messagebox.showerror("Error", "Another job is still running")
+            return
+        
+        def progress(done, total):
+            self.job_label.config(text=f"{title}: {100 * done // total}%" if total else f"{title}: {done}")
+        
+        def finish(outcome):
+            self.cancel_button.config(state=tk.DISABLED)
+            self.job_label.config(text=f"{title}: {outcome}")
+        
+        def succeeded(result):
+            finish("cancelled" if job.cancelled else "done")
+            on_done(result)
+        
+        def failed(error):
+            finish("failed")
+            self._show_error(error)
+        
+        self.job_label.config(text=f"{title}...")
+        self.cancel_button.config(state=tk.NORMAL)
+        self.job = job = self.worker.start(func, *args, writes=writes, on_done=succeeded,
+                                           on_error=failed, on_progress=progress)
+    
+    def cancel_job(self):
+        #Stop the running import or export at its next checkpoint
+        if self.job is not None and not self.job.done:
+            self.job.cancel()
+            self.job_label.config(text="Cancelling...")
+
+def _print_suggestions(accounts, prefix):
+    #Offer holder names that start with what the user typed
+    suggestions = suggest_accounts(accounts, prefix)
+    if suggestions:
+        print(f"Did you mean: {', '.join(suggestions)}?")
 
 def processUserInput(choice, accounts, current_account):
     """
@@ -319,6 +4188,7 @@ def processUserInput(choice, accounts, current_account):
                 print(f"Selected account: {name}")
             else:
                 print("Error: Account not found")
+                _print_suggestions(accounts, name)
         
         elif choice == '3':
             if current_account:
@@ -350,6 +4220,7 @@ def processUserInput(choice, accounts, current_account):
                         print(f"Transferred {amount} to {target_name}")
                     else:
                         print("Error: Recipient account not found")
+                        _print_suggestions(accounts, target_name)
             else:
                 print("Error: No account selected")
         
@@ -376,8 +4247,7 @@ def processUserInput(choice, accounts, current_account):
             if current_account:
                 print(f"Balance for {current_account.name}: {current_account.balance}")
                 print("Transactions:")
-                for txn in current_account.get_transactions():
-                    print(f"- {txn}")
+                print(render_history(current_account), end="")
             else:
                 print("Error: No account selected")
         
@@ -395,43 +4265,392 @@ def processUserInput(choice, accounts, current_account):
     
     return accounts, current_account
 
-def console_main():
-    #Main function for console version of banking app
-    accounts = {}
+# Latency buckets are powers of two so a sample's bucket is just
+# ns.bit_length(): bucket k holds samples below 2**k ns. These are the
+# bounds exported (256 ns up to about 16.8 ms, then +Inf).
+_BUCKET_BITS = range(8, 25)
+LATENCY_BUCKETS_NS = tuple(2 ** bits for bits in _BUCKET_BITS)
+
+# BankAccount methods wrapped by enable_metrics
+_METERED_METHODS = ("deposit", "withdraw", "transfer", "mobile_topup")
+
+class LatencyHistogram:
+    #Fixed-bucket latency histogram; observe() takes nanoseconds
+    __slots__ = ("counts", "total_ns")
+
+    def __init__(self):
+        self.counts = [0] * 64  # indexed by ns.bit_length()
+        self.total_ns = 0
+
+    def observe(self, ns):
+        self.counts[ns.bit_length()] += 1
+        self.total_ns += ns
+
+    def cumulative(self):
+        #(bound in ns or None for +Inf, samples at or below it) per exported bucket
+        counts = self.counts
+        below = sum(counts[:_BUCKET_BITS[0]])
+        result = []
+        for bits, bound in zip(_BUCKET_BITS, LATENCY_BUCKETS_NS):
+            below += counts[bits]
+            result.append((bound, below))
+        result.append((None, sum(counts)))
+        return result
+
+    def reset(self):
+        self.counts[:] = [0] * len(self.counts)
+        self.total_ns = 0
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+class Metrics:
+    #Operation counters, error counters and latency histograms
+
+    def __init__(self):
+        self.histograms = {}  # operation -> LatencyHistogram
+        self.errors = {}      # (operation, error class name) -> count
+
+    def histogram(self, op):
+        histogram = self.histograms.get(op)
+        if histogram is None:
+            histogram = self.histograms[op] = LatencyHistogram()
+        return histogram
+
+    def reset(self):
+        for histogram in self.histograms.values():
+            histogram.reset()
+        self.errors.clear()
+
+    def timed(self, op, func):
+        #Wrap func so each call is counted, timed and its BankingErrors tallied
+        # The hot path is inlined: this wrapper runs on every operation
+        histogram = self.histogram(op)
+        counts = histogram.counts
+        errors = self.errors
+        clock = time.perf_counter_ns
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            except BankingError as e:
+                key = (op, type(e).__name__)
+                errors[key] = errors.get(key, 0) + 1
+                raise
+            finally:
+                ns = clock() - start
+                counts[ns.bit_length()] += 1
+                histogram.total_ns += ns
+        wrapper.__wrapped__ = func
+        return wrapper
+
+    def snapshot(self):
+        """
+        Current values as plain data, ready for json.dumps
+        
+        Returns:
+            dict: {"operations": {op: {"count", "sum_seconds", "buckets" (cumulative)}},
+                "errors": {op: {error class name: count}}}
+        """
+        operations = {}
+        for op, histogram in self.histograms.items():
+            operations[op] = {
+                "count": histogram.count,
+                "sum_seconds": histogram.total_ns / 1e9,
+                "buckets": {"+Inf" if bound is None else repr(bound / 1e9): n
+                            for bound, n in histogram.cumulative()},
+            }
+        errors = {}
+        for (op, error), count in self.errors.items():
+            errors.setdefault(op, {})[error] = count
+        return {"operations": operations, "errors": errors}
+
+    def to_json(self):
+        return json.dumps(self.snapshot())
+
+    def to_prometheus(self):
+        #Render in the Prometheus text exposition format (cumulative buckets)
+        lines = ["# HELP bank_operations_total Banking operations performed.",
+                 "# TYPE bank_operations_total counter"]
+        for op, histogram in self.histograms.items():
+            lines.append(f'bank_operations_total{{op="{op}"}} {histogram.count}')
+        lines += ["# HELP bank_errors_total Banking errors raised, by operation and error class.",
+                  "# TYPE bank_errors_total counter"]
+        for (op, error), count in self.errors.items():
+            lines.append(f'bank_errors_total{{op="{op}",error="{error}"}} {count}')
+        lines += ["# HELP bank_operation_duration_seconds Latency of banking operations.",
+                  "# TYPE bank_operation_duration_seconds histogram"]
+        for op, histogram in self.histograms.items():
+            for bound, n in histogram.cumulative():
+                le = "+Inf" if bound is None else repr(bound / 1e9)
+                lines.append(f'bank_operation_duration_seconds_bucket{{op="{op}",le="{le}"}} {n}')
+            lines.append(f'bank_operation_duration_seconds_sum{{op="{op}"}} {histogram.total_ns / 1e9!r}')
+            lines.append(f'bank_operation_duration_seconds_count{{op="{op}"}} {n}')
+        return "\n".join(lines) + "\n"
+
+# Active Metrics, or None while metrics are off
+metrics = None
+
+def enable_metrics(registry=None):
+    """
+    Start counting and timing BankAccount operations and console commands
+    
+    Replaces the metered BankAccount methods and the module's
+    processUserInput with timed wrappers. Counts from several threads may
+    drift slightly; they are not locked.
+    
+    Args:
+        registry (Metrics): Where to record (default: a new Metrics)
+        
+    Returns:
+        Metrics: The active registry
+    """
+    global metrics, processUserInput
+    disable_metrics()
+    metrics = Metrics() if registry is None else registry
+    for name in _METERED_METHODS:
+        setattr(BankAccount, name, metrics.timed(name, getattr(BankAccount, name)))
+    processUserInput = metrics.timed("processUserInput", processUserInput)
+    return metrics
+
+def disable_metrics():
+    #Restore the unwrapped methods; the last registry keeps its values
+    global metrics, processUserInput
+    if metrics is None:
+        return
+    for name in _METERED_METHODS:
+        setattr(BankAccount, name, getattr(BankAccount, name).__wrapped__)
+    processUserInput = processUserInput.__wrapped__
+    metrics = None
+
+# Script commands -> (session method, number of arguments after the holder name)
+# Every command names its holder first, e.g. "deposit Sonam 200" or
+# "transfer Sonam Sangay 50"; "create" takes an optional opening balance.
+_SCRIPT_COMMANDS = {
+    "create": ("create", (0, 1)),
+    "deposit": ("deposit", (1,)),
+    "withdraw": ("withdraw", (1,)),
+    "transfer": ("transfer", (2,)),
+    "topup": ("topup", (2,)),
+    "delete": ("delete", (0,)),
+    "balance": ("balance", (0,)),
+    "history": ("history", (0,)),
+}
+
+def _run_command(session, words):
+    #Run one split script line through the session; returns the result
+    command = _SCRIPT_COMMANDS.get(words[0])
+    if command is None:
+        raise InvalidRecordError(f"Unknown command: {words[0]}")
+    method, arities = command
+    if len(words) < 2 or len(words) - 2 not in arities:
+        raise InvalidRecordError(f"Wrong number of arguments for {words[0]}")
+    name = words[1]
+    if method == "create":
+        balance = _parse_amount(words[2], "Balance") if len(words) > 2 else 0
+        return session.create(name, balance).balance
+    session.select(name)
+    if method == "deposit":
+        return session.deposit(_parse_amount(words[2]))
+    if method == "withdraw":
+        return session.withdraw(_parse_amount(words[2]))
+    if method == "transfer":
+        return session.transfer(words[2], _parse_amount(words[3]))
+    if method == "topup":
+        return session.topup(words[2], _parse_amount(words[3]))
+    if method == "delete":
+        return session.delete()
+    if method == "balance":
+        return session.current_account.balance
+    return session.history()
+
+def iter_script_results(lines, accounts):
+    """
+    Run script commands lazily, one result per command
+    
+    Blank lines and lines starting with "#" are skipped. A failing command
+    never stops the run: its BankingError is yielded in place of a result.
+    
+    Args:
+        lines: Iterable of command lines (e.g. an open file or sys.stdin)
+        accounts (dict): Dictionary of bank accounts
+        
+    Yields:
+        tuple: (line number, ok, result or exception)
+    """
+    session = BankingSession(accounts)
+    for line_number, line in enumerate(lines, 1):
+        words = line.split()
+        if not words or words[0].startswith("#"):
+            continue
+        try:
+            yield line_number, True, _run_command(session, words)
+        except BankingError as e:
+            yield line_number, False, e
+
+def run_script(lines, accounts, out, fmt="tsv", on_command=None):
+    """
+    Run script commands and write one result line per command
+    
+    In "tsv" format each result is "<line>\\tok\\t<result>" or
+    "<line>\\terror\\t<ErrorName>\\t<message>"; in "jsonl" format it is a JSON
+    object with the same fields.
+    
+    Args:
+        lines: Iterable of command lines
+        accounts (dict): Dictionary of bank accounts
+        out: Writable text file for the results
+        fmt (str): "tsv" or "jsonl"
+        on_command: Optional callable run after every command (e.g. to checkpoint)
+        
+    Returns:
+        tuple: (commands run, commands failed)
+    """
+    if fmt not in ("tsv", "jsonl"):
+        raise ValueError(f"Unknown result format: {fmt}")
+    write = out.write
+    total = failed = 0
+    for line_number, ok, result in iter_script_results(lines, accounts):
+        total += 1
+        if fmt == "tsv":
+            if ok:
+                if result is None or isinstance(result, dict):
+                    result = "" if result is None else json.dumps(result)
+                write(f"{line_number}\tok\t{result}\n")
+            else:
+                failed += 1
+                write(f"{line_number}\terror\t{type(result).__name__}\t{result}\n")
+        elif ok:
+            write(json.dumps({"line": line_number, "ok": True, "result": result}) + "\n")
+        else:
+            failed += 1
+            write(json.dumps({"line": line_number, "ok": False,
+                              "error": type(result).__name__, "message": str(result)}) + "\n")
+        if on_command is not None:
+            on_command()
+    return total, failed
+
+def script_main(path="-", data_dir=None, fmt="tsv"):
+    """
+    Headless console: run a command script and print machine-readable results
+    
+    Args:
+        path (str): Script file, or "-" for stdin
+        data_dir (str): Ledger directory to persist accounts in (default: memory only)
+        fmt (str): "tsv" or "jsonl"
+        
+    Returns:
+        int: Exit status (0 if every command succeeded, 1 otherwise)
+    """
+    ledger = Ledger(data_dir) if data_dir else None
+    accounts = ledger.accounts if ledger else AccountStore()
+    source = sys.stdin if path == "-" else open(path)
+    try:
+        _, failed = run_script(source, accounts, sys.stdout, fmt,
+                               ledger.maybe_checkpoint if ledger else None)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if ledger:
+            ledger.close()
+    return 1 if failed else 0
+
+def console_main(data_dir=None):
+    """
+    Main function for console version of banking app
+    
+    Args:
+        data_dir (str): Ledger directory to persist accounts in (default: memory only)
+    """
+    ledger = Ledger(data_dir) if data_dir else None
+    accounts = ledger.accounts if ledger else AccountStore()
     current_account = None
     
-    while True:
-        print("\nBanking Application Menu:")
-        print("1. Create Account")
-        print("2. Select Account")
-        print("3. Deposit")
-        print("4. Withdraw")
-        print("5. Transfer")
-        print("6. Mobile Top-up")
-        print("7. Delete Account")
-        print("8. View Balance & Transactions")
-        print("9. Exit")
-        
-        choice = input("Enter your choice: ")
-        accounts, current_account = processUserInput(choice, accounts, current_account)
-
-def gui_main():
-    #Main function for GUI version of banking app
-    root = tk.Tk()
-    app = BankingAppGUI(root)
-    root.mainloop()
+    try:
+        while True:
+            print("\nBanking Application Menu:")
+            print("1. Create Account")
+            print("2. Select Account")
+            print("3. Deposit")
+            print("4. Withdraw")
+            print("5. Transfer")
+            print("6. Mobile Top-up")
+            print("7. Delete Account")
+            print("8. View Balance & Transactions")
+            print("9. Exit")
+            
+            choice = input("Enter your choice: ")
+            accounts, current_account = processUserInput(choice, accounts, current_account)
+            if ledger:
+                ledger.maybe_checkpoint()
+    finally:
+        if ledger:
+            ledger.close()
 
-if __name__ == "__main__":
-    print("Banking Application")
-    print("1. Console version")
-    print("2. GUI version")
-    mode = input("Select version (1 or 2): ")
+def gui_main(data_dir=None):
+    """
+    Main function for GUI version of banking app
+    
+    Args:
+        data_dir (str): Ledger directory to persist accounts in (default: memory only)
+    """
+    ledger = Ledger(data_dir) if data_dir else None
+    root = _load_tk().Tk()
+    app = BankingAppGUI(root, ledger.accounts if ledger else None)
+    try:
+        root.mainloop()
+    finally:
+        app.worker.close()
+        if ledger:
+            ledger.close()
+
+def main(argv=None):
+    """
+    Command-line entry point
+    
+    Starts the front end chosen by flag, or asks which one to start. Only
+    the GUI loads Tk.
+    
+    Args:
+        argv (list): Arguments (default: sys.argv[1:])
+        
+    Returns:
+        int: Exit status
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description="Banking application")
+    parser.add_argument("data_dir", nargs="?", help="Ledger directory to keep accounts across restarts")
+    modes = parser.add_mutually_exclusive_group()
+    modes.add_argument("--console", dest="mode", action="store_const", const="1", help="Interactive console")
+    modes.add_argument("--gui", dest="mode", action="store_const", const="2", help="Tk GUI")
+    modes.add_argument("--server", dest="mode", action="store_const", const="3", help="Network server")
+    modes.add_argument("--script", nargs="?", const="-", metavar="FILE",
+                       help="Run commands from FILE (- or nothing for stdin) without prompts")
+    args = parser.parse_args(argv)
+
+    if args.script:
+        return script_main(args.script, args.data_dir)
+    mode = args.mode
+    if mode is None:
+        print("Banking Application")
+        print("1. Console version")
+        print("2. GUI version")
+        print("3. Network server")
+        mode = input("Select version (1, 2 or 3): ")
     
     if mode == '1':
-        console_main()
+        console_main(args.data_dir)
     elif mode == '2':
-        gui_main()
+        gui_main(args.data_dir)
+    elif mode == '3':
+        server_main(data_dir=args.data_dir)
     else:
         print("Invalid selection")
+        return 1
+    return 0
 
-        
\ No newline at end of file
+if __name__ == "__main__":
+    sys.exit(main())
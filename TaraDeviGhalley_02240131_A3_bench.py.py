@@ -0,0 +1,402 @@
+import argparse
+import builtins
+import io
+import json
+import platform
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from array import array
+from contextlib import redirect_stdout
+from unittest.mock import patch
+
+import TaraDeviGhalley_02240131_A3 as bank
+from TaraDeviGhalley_02240131_A3 import (
+    BankAccount,
+    BankingAppGUI,
+    DEPOSIT,
+    processUserInput,
+)
+
+# Scales each benchmark runs at: account counts and transactions per account
+SCALES = {
+    "quick": {"accounts": [1_000, 10_000], "history": [10, 1_000, 10_000]},
+    "full": {"accounts": [1_000, 10_000, 100_000, 1_000_000],
+             "history": [10, 1_000, 100_000, 1_000_000]},
+}
+
+# Operations timed per benchmark run (spread over the account population)
+SAMPLE_OPS = 20_000
+
+# Most a fresh interpreter may spend importing the banking core, in nanoseconds
+IMPORT_BUDGET_NS = 60_000_000
+
+class _FakeWidget:
+    #Stand-in for a Tk widget that records what would be drawn
+
+    def __init__(self, *args, **kwargs):
+        self.chars = 0
+
+    def pack(self, *args, **kwargs):
+        pass
+
+    def config(self, **kwargs):
+        pass
+
+    def title(self, text):
+        pass
+
+    def quit(self):
+        pass
+
+    def insert(self, index, text):
+        self.chars += len(text)
+
+    def delete(self, first, last=None):
+        self.chars = 0
+
+    def after(self, ms, callback=None):
+        return None
+
+    def after_cancel(self, timer_id):
+        pass
+
+class _FakeLoop(_FakeWidget):
+    #Stand-in Tk root whose after() timers run from a minimal event loop
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self.timers = []  # [due (perf_counter seconds), callback]
+
+    def after(self, ms, callback=None):
+        timer = [time.perf_counter() + ms / 1000, callback]
+        self.timers.append(timer)
+        return timer
+
+    def after_cancel(self, timer_id):
+        if timer_id in self.timers:
+            self.timers.remove(timer_id)
+
+    def run_until(self, finished):
+        #Fire timers in due order, sleeping between them, until finished() is true
+        while not finished() and self.timers:
+            timer = min(self.timers, key=lambda t: t[0])
+            self.timers.remove(timer)
+            time.sleep(max(0.0, timer[0] - time.perf_counter()))
+            timer[1]()
+
+class _FakeTk:
+    #Stand-in for the tkinter module, used when no display is available
+    Label = Button = Text = Frame = Tk = _FakeWidget
+    DISABLED = "disabled"
+    NORMAL = "normal"
+    END = "end"
+    LEFT = "left"
+
+def _make_accounts(count, balance=10**9):
+    return [BankAccount(f"Holder{i}", balance) for i in range(count)]
+
+def _with_history(length):
+    #Account whose log already holds `length` deposits (built in bulk)
+    account = BankAccount("Sonam", 0)
+    account.transactions.extend_packed(bytes([DEPOSIT]) * length, (array("d", [10.0]) * length).tobytes())
+    account.balance = 10.0 * length
+    return account
+
+def _time_ops(func, ops):
+    #Run func(i) for i in range(ops); returns nanoseconds per call
+    start = time.perf_counter_ns()
+    for i in range(ops):
+        func(i)
+    return (time.perf_counter_ns() - start) / ops
+
+def bench_account_op(op, accounts):
+    """
+    Time one BankAccount operation spread across an account population
+
+    Args:
+        op (str): "deposit", "withdraw", "transfer" or "mobile_topup"
+        accounts (int): Population size
+
+    Returns:
+        float: Nanoseconds per operation
+    """
+    book = _make_accounts(accounts)
+    rng = random.Random(accounts)
+    picks = [rng.randrange(accounts) for _ in range(SAMPLE_OPS)]
+    targets = [(p + 1) % accounts for p in picks]
+    if op == "deposit":
+        return _time_ops(lambda i: book[picks[i]].deposit(5), SAMPLE_OPS)
+    if op == "withdraw":
+        return _time_ops(lambda i: book[picks[i]].withdraw(5), SAMPLE_OPS)
+    if op == "transfer":
+        return _time_ops(lambda i: book[picks[i]].transfer(5, book[targets[i]]), SAMPLE_OPS)
+    return _time_ops(lambda i: book[picks[i]].mobile_topup(5, "17171122"), SAMPLE_OPS)
+
+def bench_metrics_overhead(accounts):
+    """
+    Time deposits with metrics switched on, minus the same run with them off
+
+    Args:
+        accounts (int): Population size
+
+    Returns:
+        float: Extra nanoseconds per deposit spent recording metrics
+    """
+    plain = bench_account_op("deposit", accounts)
+    bank.enable_metrics()
+    try:
+        metered = bench_account_op("deposit", accounts)
+    finally:
+        bank.disable_metrics()
+    return max(0.0, metered - plain)
+
+def bench_limit_check(history):
+    """
+    Time a limit check on an account with a long history
+
+    Args:
+        history (int): Transactions already in the account
+
+    Returns:
+        float: Nanoseconds per check against the default policies
+    """
+    account = _with_history(history)
+    engine = bank.LimitEngine(bank.DEFAULT_LIMITS)
+    now = time.time()
+    for i in range(5):
+        engine.record(account, bank.WITHDRAWAL, 10, now - i)
+    return _time_ops(lambda i: engine.check(account, bank.WITHDRAWAL, 10, now + i), SAMPLE_OPS)
+
+def bench_get_transactions(history):
+    """
+    Time reading a long history through get_transactions
+
+    Args:
+        history (int): Transactions in the account
+
+    Returns:
+        float: Nanoseconds per transaction to render the full history
+    """
+    account = _with_history(history)
+    start = time.perf_counter_ns()
+    rendered = sum(1 for _ in account.get_transactions())
+    return (time.perf_counter_ns() - start) / max(1, rendered)
+
+def bench_process_user_input(accounts):
+    """
+    Time processUserInput dispatch with scripted input
+
+    Args:
+        accounts (int): Accounts in the dictionary being served
+
+    Returns:
+        float: Nanoseconds per dispatched command
+    """
+    book = {account.name: account for account in _make_accounts(accounts)}
+    current = book["Holder0"]
+    script = iter(["100"] * SAMPLE_OPS)
+    with patch.object(builtins, "input", lambda prompt="": next(script)), redirect_stdout(io.StringIO()):
+        return _time_ops(lambda i: processUserInput("3", book, current), SAMPLE_OPS)
+
+def bench_update_display(history):
+    """
+    Time a deposit followed by update_display on an account with a long history
+
+    Uses a real Tk root when a display is available, otherwise a stand-in.
+
+    Args:
+        history (int): Transactions already in the account
+
+    Returns:
+        float: Nanoseconds per deposit + refresh
+    """
+    root = None
+    tk_module = _FakeTk
+    try:
+        root = bank._load_tk().Tk()
+        root.withdraw()
+        tk_module = bank.tk
+    except Exception:
+        root = _FakeWidget()
+    with patch.object(bank, "tk", tk_module):
+        gui = BankingAppGUI(root)
+        try:
+            gui.current_account = _with_history(history)
+            gui.update_display()
+            ops = 200
+            result = _time_ops(lambda i: (gui.current_account.deposit(1), gui.update_display()), ops)
+        finally:
+            gui.worker.close()  # otherwise each scale leaves a writer thread behind
+    if tk_module is not _FakeTk:
+        root.destroy()
+    return result
+
+def bench_cold_import():
+    """
+    Time importing the banking module in a fresh interpreter
+
+    Only the import statement is timed, inside the child process, so the
+    cost of starting Python itself is not included.
+
+    Returns:
+        float: Nanoseconds to import the module
+    """
+    directory = os.path.dirname(os.path.abspath(bank.__file__))
+    code = ("import time; start = time.perf_counter_ns(); import {0}; "
+            "print(time.perf_counter_ns() - start)").format(bank.__name__)
+    output = subprocess.run([sys.executable, "-c", code], cwd=directory, check=True,
+                            capture_output=True, text=True).stdout
+    return float(output)
+
+def bench_refresh_display(history):
+    """
+    Time update_display refreshes of an account that has not changed
+
+    Args:
+        history (int): Transactions already in the account
+
+    Returns:
+        float: Nanoseconds per refresh
+    """
+    with patch.object(bank, "tk", _FakeTk):
+        gui = BankingAppGUI(_FakeWidget())
+        gui.current_account = _with_history(history)
+        gui.update_display()
+        gui.pager.go(0, history)
+        return _time_ops(lambda i: gui.update_display(), 2_000)
+
+def bench_spilled_page(history):
+    """
+    Time reading history pages that were spilled to archive segments
+
+    Pages are taken from random points, so most reads decompress a segment.
+
+    Args:
+        history (int): Transactions in the account
+
+    Returns:
+        float: Nanoseconds per page of HISTORY_PAGE_SIZE transactions
+    """
+    account = _with_history(history)
+    with tempfile.TemporaryDirectory() as directory, bank.HistoryArchive(directory) as archive:
+        account.transactions.spill(archive, keep=0)
+        rng = random.Random(history)
+        starts = [rng.randrange(history) for _ in range(200)]
+        size = bank.HISTORY_PAGE_SIZE
+        return _time_ops(lambda i: account.transactions.render(starts[i], starts[i] + size), len(starts))
+
+def bench_event_loop_lag(history):
+    """
+    Worst GUI event-loop latency while the worker posts a long run of deposits
+
+    Args:
+        history (int): Deposits posted in the background
+
+    Returns:
+        float: Nanoseconds the latest GUI timer tick fired after it was due
+    """
+    root = _FakeLoop()
+    with patch.object(bank, "tk", _FakeTk):
+        gui = BankingAppGUI(root)
+        account = BankAccount("Sonam", 0)
+
+        def post(job):
+            for _ in range(history):
+                account.deposit(1)
+
+        job = gui.worker.start(post, writes=True)
+        root.run_until(lambda: job.done and gui.worker.loop_latency.count)
+        gui.worker.close()
+    return float(gui.worker.worst_lag_ns)
+
+def run_suite(scale="quick", repeat=3):
+    """
+    Run every benchmark at every size of a scale preset
+
+    Args:
+        scale (str): Key of SCALES
+        repeat (int): Runs per benchmark; the fastest is kept
+
+    Returns:
+        dict: Benchmark name -> {"ns_per_op": float}
+    """
+    sizes = SCALES[scale]
+    cases = []
+    for accounts in sizes["accounts"]:
+        for op in ("deposit", "withdraw", "transfer", "mobile_topup"):
+            cases.append((f"{op}[accounts={accounts}]", bench_account_op, (op, accounts)))
+        cases.append((f"processUserInput[accounts={accounts}]", bench_process_user_input, (accounts,)))
+        cases.append((f"metrics_overhead[accounts={accounts}]", bench_metrics_overhead, (accounts,)))
+    for history in sizes["history"]:
+        cases.append((f"get_transactions[history={history}]", bench_get_transactions, (history,)))
+        cases.append((f"update_display[history={history}]", bench_update_display, (history,)))
+        cases.append((f"refresh_display[history={history}]", bench_refresh_display, (history,)))
+        cases.append((f"limit_check[history={history}]", bench_limit_check, (history,)))
+        cases.append((f"spilled_page[history={history}]", bench_spilled_page, (history,)))
+        cases.append((f"event_loop_lag[history={history}]", bench_event_loop_lag, (history,)))
+    cases.append(("cold_import", bench_cold_import, ()))
+    results = {}
+    for name, func, args in cases:
+        results[name] = {"ns_per_op": min(func(*args) for _ in range(repeat))}
+    return results
+
+def compare(results, baseline, threshold=0.25):
+    """
+    Find benchmarks that got slower than a baseline
+
+    Args:
+        results (dict): Output of run_suite
+        baseline (dict): Earlier output of run_suite
+        threshold (float): Allowed slowdown as a fraction (0.25 = 25%)
+
+    Returns:
+        list: (name, baseline ns, current ns, ratio) for each regression
+    """
+    regressions = []
+    for name, current in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        ratio = current["ns_per_op"] / before["ns_per_op"]
+        if ratio > 1 + threshold:
+            regressions.append((name, before["ns_per_op"], current["ns_per_op"], ratio))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Banking performance benchmarks")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="quick")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="Write results to this JSON baseline file")
+    parser.add_argument("--compare", help="Baseline JSON file to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="Allowed slowdown before a benchmark counts as a regression")
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.scale, args.repeat)
+    for name, result in results.items():
+        print(f"{name:45s} {result['ns_per_op']:12.0f} ns/op")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(),
+                       "scale": args.scale, "results": results}, f, indent=2)
+    status = 0
+    if results["cold_import"]["ns_per_op"] > IMPORT_BUDGET_NS:
+        print(f"OVER BUDGET cold_import: {results['cold_import']['ns_per_op'] / 1e6:.1f} ms "
+              f"(budget {IMPORT_BUDGET_NS / 1e6:.0f} ms)")
+        status = 1
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        for name, before, after, ratio in regressions:
+            print(f"REGRESSION {name}: {before:.0f} -> {after:.0f} ns/op ({ratio:.2f}x)")
+        if regressions:
+            status = 1
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,76 @@
+import asyncio
+import builtins
+import io
+import json
+import os
+import pickle
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
 from TaraDeviGhalley_02240131_A3 import (
     BankAccount,
     InsufficientFundsError,
     InvalidAmountError,
-    processUserInput
+    processUserInput,
+    post_batch,
+    Ledger,
+    LockStripes,
+    enable_concurrency,
+    disable_concurrency,
+    stress_test_transfers,
+    BankingServer,
+    BankingSession,
+    DuplicateAccountError,
+    InvalidTransferError,
+    NoAccountSelectedError,
+    run_load,
+    HistoryPager,
+    AccountStore,
+    AccountNotFoundError,
+    suggest_accounts,
+    ShardedLedger,
+    benchmark_sharded,
+    Transaction,
+    TransactionLog,
+    DEPOSIT,
+    TRANSFER_OUT,
+    TRANSFER_IN,
+    TOPUP,
+    WITHDRAWAL,
+    export_accounts,
+    import_accounts,
+    InvalidRecordError,
+    run_script,
+    LocalGateway,
+    TopupDispatcher,
+    TopupDeliveryError,
+    benchmark_topups,
+    enable_metrics,
+    disable_metrics,
+    balances_at,
+    generate_statements,
+    RenderCache,
+    render_history,
+    LimitEngine,
+    LimitPolicy,
+    TransactionLimitError,
+    enable_limits,
+    disable_limits,
+    HistoryArchive,
+    spill_histories,
+    SEGMENT_ENTRIES,
+    BankingAppGUI,
+    GuiWorker,
 )
 
 from unittest.mock import patch
 
+import TaraDeviGhalley_02240131_A3_bench as bench
+
 class TestBankAccount(unittest.TestCase):
     def setUp(self):
         self.account1 = BankAccount("Sonam", 1000)
@@ -68,6 +131,1173 @@ class TestBankAccount(unittest.TestCase):
         self.assertIn("Transferred: 50 to Sangay", transactions)
         self.assertIn("Mobile top-up: 25 to 17171122", transactions)
 
+class TestTransactionLog(unittest.TestCase):
+    def setUp(self):
+        self.account1 = BankAccount("Sonam", 1000)
+        self.account2 = BankAccount("Sangay", 500)
+
+    def test_structured_records(self):
+        self.account1.transfer(50, self.account2)
+        self.account1.mobile_topup(25.5, "17171122")
+        out, topup = self.account1.transactions[0], self.account1.transactions[1]
+        self.assertEqual((out.kind, out.amount, out.counterparty), (TRANSFER_OUT, 50, "Sangay"))
+        self.assertEqual((topup.kind, topup.amount, topup.counterparty), (TOPUP, 25.5, "17171122"))
+        received = self.account2.transactions[-1]
+        self.assertEqual((received.kind, received.counterparty), (TRANSFER_IN, "Sonam"))
+        self.assertIsInstance(out.timestamp, float)
+
+    def test_rendering_keeps_int_and_float_amounts(self):
+        self.account1.deposit(200)
+        self.account1.deposit(200.0)
+        self.assertEqual(list(self.account1.get_transactions()), ["Deposited: 200", "Deposited: 200.0"])
+
+    def test_view_indexing(self):
+        for amount in (1, 2, 3):
+            self.account1.deposit(amount)
+        view = self.account1.get_transactions()
+        self.assertEqual(view[-1], "Deposited: 3")
+        self.assertEqual(view[:2], ["Deposited: 1", "Deposited: 2"])
+        self.assertEqual(view, ["Deposited: 1", "Deposited: 2", "Deposited: 3"])
+
+    def test_counterparties_are_interned(self):
+        log = TransactionLog()
+        for _ in range(100):
+            log.append(TOPUP, 10, "17171122")
+        self.assertEqual(len(log), 100)
+        self.assertEqual(log._party_names, ["17171122"])
+        self.assertEqual(log[5], Transaction(TOPUP, 10, "17171122", log[5].timestamp))
+        self.assertEqual(log.render(98), ["Mobile top-up: 10 to 17171122"] * 2)
+
+class TestPostBatch(unittest.TestCase):
+    def setUp(self):
+        self.accounts = [BankAccount(f"Holder{i}", 100) for i in range(6)]
+
+    def replay_one_by_one(self, rows):
+        # Apply the same rows through the BankAccount methods for comparison
+        accounts = [BankAccount(a.name, 100) for a in self.accounts]
+        failed = set()
+        for i, (src, op, amount, cp) in enumerate(rows):
+            account = accounts[src]
+            try:
+                if op == "deposit":
+                    account.deposit(amount)
+                elif op == "withdraw":
+                    account.withdraw(amount)
+                elif op == "transfer":
+                    account.transfer(amount, accounts[cp])
+                else:
+                    account.mobile_topup(amount, cp)
+            except (InvalidAmountError, InsufficientFundsError):
+                failed.add(i)
+        return accounts, failed
+
+    def run_batch(self, rows, **kwargs):
+        return post_batch(
+            [self.accounts[r[0]] for r in rows],
+            [r[1] for r in rows],
+            [r[2] for r in rows],
+            [self.accounts[r[3]] if r[1] == "transfer" else r[3] for r in rows],
+            **kwargs)
+
+    def random_rows(self, seed):
+        import random
+        rng = random.Random(seed)
+        rows = []
+        for _ in range(300):
+            op = rng.choice(["deposit", "withdraw", "transfer", "topup"])
+            amount = rng.choice([-5, 0, 10, 25, 60, 150])
+            cp = rng.randrange(6) if op == "transfer" else ("17171122" if op == "topup" else None)
+            rows.append((rng.randrange(6), op, amount, cp))
+        return rows
+
+    def check_matches_sequential(self, seed):
+        rows = self.random_rows(seed)
+        expected, failed = self.replay_one_by_one(rows)
+        result = self.run_batch(rows)
+        self.assertEqual(set(result.failures), failed)
+        for got, want in zip(self.accounts, expected):
+            self.assertAlmostEqual(got.balance, want.balance)
+            self.assertEqual(list(got.get_transactions()), list(want.get_transactions()))
+
+    def test_matches_sequential_semantics(self):
+        for seed in range(5):
+            self.setUp()
+            self.check_matches_sequential(seed)
+
+    def test_matches_sequential_semantics_without_numpy(self):
+        with patch("TaraDeviGhalley_02240131_A3.np", None):
+            for seed in range(5):
+                self.setUp()
+                self.check_matches_sequential(seed)
+
+    def test_large_amounts_elsewhere_do_not_hide_an_overdraft(self):
+        rich, poor = BankAccount("Rich", 0), BankAccount("Poor", 100.04)
+        result = post_batch([rich, poor], ["deposit", "withdraw"], [1e15, 100.05])
+        self.assertIsInstance(result.failures[1], InsufficientFundsError)
+        self.assertEqual((rich.balance, poor.balance), (1e15, 100.04))
+
+    def test_int_balances_stay_int(self):
+        rows = [(0, "deposit", 10, None), (0, "transfer", 20, 1), (2, "deposit", 2.5, None)]
+        self.run_batch(rows)
+        self.assertEqual([type(a.balance) for a in self.accounts[:3]], [int, int, float])
+        self.assertEqual(self.accounts[1].balance, 120)
+
+    def test_failure_types(self):
+        rows = [(0, "deposit", 0, None), (0, "withdraw", 500, None), (1, "topup", 5, "17171122")]
+        result = self.run_batch(rows)
+        self.assertIsInstance(result.failures[0], InvalidAmountError)
+        self.assertIsInstance(result.failures[1], InsufficientFundsError)
+        self.assertEqual(result.applied, 1)
+        self.assertEqual(self.accounts[1].balance, 95)
+
+    def test_atomic_batch_applies_nothing_on_failure(self):
+        rows = [(0, "deposit", 50, None), (1, "transfer", 500, 2)]
+        result = self.run_batch(rows, atomic=True)
+        self.assertFalse(result.committed)
+        self.assertEqual([a.balance for a in self.accounts[:3]], [100, 100, 100])
+        self.assertEqual(len(self.accounts[0].get_transactions()), 0)
+
+class TestLedger(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def populate(self, ledger):
+        accounts = ledger.accounts
+        accounts["Sonam"] = BankAccount("Sonam", 1000)
+        accounts["Sangay"] = BankAccount("Sangay", 500)
+        accounts["Sonam"].deposit(200)
+        accounts["Sonam"].transfer(300, accounts["Sangay"])
+        accounts["Sangay"].mobile_topup(25.5, "17171122")
+
+    def assert_recovered(self, accounts):
+        self.assertEqual(accounts["Sonam"].balance, 900)
+        self.assertIsInstance(accounts["Sonam"].balance, int)
+        self.assertEqual(accounts["Sangay"].balance, 774.5)
+        self.assertEqual(list(accounts["Sangay"].get_transactions()),
+                         ["Received: 300 from Sonam", "Mobile top-up: 25.5 to 17171122"])
+
+    def test_recover_from_log(self):
+        with Ledger(self.path) as ledger:
+            self.populate(ledger)
+        with Ledger(self.path) as ledger:
+            self.assert_recovered(ledger.accounts)
+
+    def test_recover_from_snapshot_and_tail(self):
+        with Ledger(self.path) as ledger:
+            self.populate(ledger)
+            ledger.checkpoint()
+            ledger.accounts["Tashi"] = BankAccount("Tashi", 10)
+            del ledger.accounts["Tashi"]
+            ledger.accounts["Sonam"].withdraw(100)
+            timestamp = ledger.accounts["Sonam"].transactions[-1].timestamp
+        self.assertEqual(len([f for f in os.listdir(self.path) if f.startswith("snapshot")]), 1)
+        with Ledger(self.path) as ledger:
+            self.assertNotIn("Tashi", ledger.accounts)
+            ledger.accounts["Sonam"].deposit(100)
+            self.assert_recovered(ledger.accounts)
+            self.assertEqual(ledger.accounts["Sonam"].transactions[-2].timestamp, timestamp)
+
+    def test_torn_tail_is_discarded(self):
+        with Ledger(self.path) as ledger:
+            self.populate(ledger)
+        segment = sorted(f for f in os.listdir(self.path) if f.startswith("wal"))[-1]
+        with open(os.path.join(self.path, segment), "ab") as f:
+            f.write(b"\x30\x00\x00\x00garbage")
+        with Ledger(self.path) as ledger:
+            self.assert_recovered(ledger.accounts)
+            ledger.accounts["Sonam"].deposit(1)
+        with Ledger(self.path) as ledger:
+            self.assertEqual(ledger.accounts["Sonam"].balance, 901)
+
+    def test_batches_and_concurrent_writers_are_logged(self):
+        with Ledger(self.path) as ledger:
+            names = [f"Holder{i}" for i in range(8)]
+            for name in names:
+                ledger.accounts[name] = BankAccount(name, 0)
+            post_batch([ledger.accounts[n] for n in names], ["deposit"] * 8, [5] * 8)
+            def worker(name):
+                for _ in range(50):
+                    ledger.accounts[name].deposit(1)
+            threads = [threading.Thread(target=worker, args=(n,)) for n in names]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        with Ledger(self.path) as ledger:
+            self.assertEqual([ledger.accounts[n].balance for n in names], [55] * 8)
+
+class TestConcurrency(unittest.TestCase):
+    def tearDown(self):
+        disable_concurrency()
+
+    def test_stripes_are_taken_in_fixed_order(self):
+        stripes = LockStripes(8)
+        accounts = [BankAccount(f"Holder{i}", 0) for i in range(32)]
+        a, b = next((x, y) for x in accounts for y in accounts if stripes.stripe(x) < stripes.stripe(y))
+        self.assertEqual(stripes.hold(a, b)._locks, stripes.hold(b, a)._locks)
+        self.assertIs(stripes.hold(a, a), stripes.hold(a))
+
+    def test_opposite_transfers_conserve_money(self):
+        enable_concurrency(4)
+        a, b = BankAccount("Sonam", 10000), BankAccount("Sangay", 10000)
+        def shuttle(source, target):
+            for _ in range(2000):
+                try:
+                    source.transfer(3, target)
+                except InsufficientFundsError:
+                    pass
+        threads = [threading.Thread(target=shuttle, args=pair) for pair in [(a, b), (b, a)] * 2]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(a.balance + b.balance, 20000)
+        self.assertEqual(len(a.get_transactions()), len(b.get_transactions()))
+
+    def test_stress_benchmark_reports_conserved_totals(self):
+        results = stress_test_transfers(thread_counts=(1, 4), accounts=50, transfers_per_thread=500)
+        self.assertEqual([r["threads"] for r in results], [1, 4])
+        for r in results:
+            self.assertEqual(r["total_before"], r["total_after"])
+
+class TestBankingSession(unittest.TestCase):
+    def setUp(self):
+        self.session = BankingSession({})
+        self.session.create("Sonam", 1000)
+        self.session.create("Sangay", 500)
+
+    def test_operations(self):
+        self.session.select("Sonam")
+        self.assertEqual(self.session.deposit(200), 1200)
+        self.assertEqual(self.session.transfer("Sangay", 300), 900)
+        self.assertEqual(self.session.topup("17171122", 100), 800)
+        self.assertEqual(self.session.history(1)["transactions"], [
+            "Transferred: 300 to Sangay", "Mobile top-up: 100 to 17171122"])
+        self.session.delete()
+        self.assertNotIn("Sonam", self.session.accounts)
+
+    def test_validation_errors(self):
+        with self.assertRaises(DuplicateAccountError):
+            self.session.create("Sonam", 10)
+        with self.assertRaises(NoAccountSelectedError):
+            self.session.deposit(10)
+        self.session.select("Sonam")
+        with self.assertRaises(InvalidTransferError):
+            self.session.transfer("Sonam", 10)
+
+class TestBankingServer(unittest.TestCase):
+    def test_pipelined_requests(self):
+        async def scenario():
+            server = BankingServer(max_concurrency=4)
+            host, port = await server.start()
+            reader, writer = await asyncio.open_connection(host, port)
+            requests = [
+                {"id": 1, "op": "create", "name": "Sonam", "balance": 100},
+                {"id": 2, "op": "select", "name": "Sonam"},
+                {"id": 3, "op": "deposit", "amount": 50},
+                {"id": 4, "op": "withdraw", "amount": 500},
+                {"id": 5, "op": "history"},
+                {"id": 6, "op": "bogus"},
+            ]
+            writer.write("".join(json.dumps(r) + "\n" for r in requests).encode())
+            replies = [json.loads(await reader.readline()) for _ in requests]
+            writer.close()
+            load = await run_load((host, port), connections=5, requests_per_connection=20, pipeline=4)
+            await server.close()
+            return replies, load
+        replies, load = asyncio.run(scenario())
+        self.assertEqual([r["id"] for r in replies], [1, 2, 3, 4, 5, 6])
+        self.assertEqual(replies[2]["result"], 150)
+        self.assertEqual(replies[3]["error"], "InsufficientFundsError")
+        self.assertEqual(replies[4]["result"]["transactions"], ["Deposited: 50"])
+        self.assertEqual(replies[5]["error"], "BadRequest")
+        self.assertEqual((load["requests"], load["errors"]), (100, 0))
+
+    def test_malformed_requests_are_rejected(self):
+        async def scenario():
+            server = BankingServer()
+            host, port = await server.start()
+            reader, writer = await asyncio.open_connection(host, port)
+            requests = [
+                '{"id": 1, "op": "create", "balance": 5}',
+                '{"id": 2, "op": "create", "name": "Sonam", "balance": 100, "extra": 1}',
+                '{"id": 3, "op": "create", "name": "Sonam", "balance": 100}',
+                '{"id": 4, "op": "select", "name": "Sonam"}',
+                '{"id": 5, "op": "transfer", "amount": 5}',
+                '{"id": 6, "op": "deposit", "amount": NaN}',
+                '{"id": 7, "op": "deposit", "amount": "5"}',
+                '{"id": 8, "op": "deposit", "amount": 20}',
+                '{"id": 9, "op": "history", "stop": 1}',
+                '[1, 2]',
+            ]
+            writer.write("".join(r + "\n" for r in requests).encode())
+            replies = [json.loads(await reader.readline()) for _ in requests]
+            await server.close()
+            writer.close()
+            return server, replies
+        with self.assertNoLogs("asyncio", level="ERROR"):
+            server, replies = asyncio.run(scenario())
+        errors = [r.get("error") for r in replies]
+        self.assertEqual(errors, ["BadRequest", "BadRequest", None, None, "BadRequest",
+                                  "InvalidAmountError", "BadRequest", None, None, "BadRequest"])
+        self.assertEqual(list(server.accounts), ["Sonam"])
+        self.assertEqual(replies[8]["result"]["transactions"], ["Deposited: 20"])
+
+class TestHistoryPager(unittest.TestCase):
+    def setUp(self):
+        self.account = BankAccount("Sonam", 1000)
+        self.pager = HistoryPager(page_size=3)
+
+    def test_appends_only_new_entries_on_newest_page(self):
+        self.assertEqual(self.pager.plan(self.account, 0), ("replace", 0, 0))
+        self.assertEqual(self.pager.plan(self.account, 1), ("replace", 0, 1))
+        self.assertEqual(self.pager.plan(self.account, 3), ("append", 1, 3))
+        self.assertEqual(self.pager.plan(self.account, 4), ("replace", 3, 4))
+        self.assertEqual(self.pager.plan(BankAccount("Sangay"), 4), ("replace", 3, 4))
+
+    def test_jump_to_any_page(self):
+        total = 3 * 1000 + 2
+        self.assertEqual(self.pager.page_count(total), 1001)
+        self.pager.go(500, total)
+        self.assertEqual(self.pager.plan(self.account, total), ("replace", 1500, 1503))
+        # New transactions do not disturb an older page
+        self.assertEqual(self.pager.plan(self.account, total + 1), ("append", 1503, 1503))
+        self.pager.go(5000, total)
+        self.assertIsNone(self.pager.page)
+        self.assertEqual(self.pager.plan(self.account, total), ("replace", 3000, 3002))
+
+class TestTransactionQueries(unittest.TestCase):
+    def setUp(self):
+        self.account = BankAccount("Sonam", 0)
+        log = self.account.transactions
+        day = 86400
+        for i in range(30):
+            log.append(TRANSFER_IN if i % 3 == 0 else DEPOSIT, 10 * i, "Sangay" if i % 3 == 0 else None, i * day)
+        log.append(TOPUP, 5, "17171122", 30 * day)
+        log.append(TOPUP, 7, "77112233", 31 * day)
+        log.index()
+        log.append(TOPUP, 8, "17171122", 32 * day)  # maintained incrementally after the build
+        log.append(WITHDRAWAL, 1, None, 33 * day)
+
+    def test_filters(self):
+        page = self.account.query_transactions(phone="17171122")
+        self.assertEqual([t.amount for t in page], [5, 8])
+        page = self.account.query_transactions(kind=DEPOSIT, min_amount=100, max_amount=150)
+        self.assertEqual([t.amount for t in page], [100, 110, 130, 140])
+        page = self.account.query_transactions(counterparty="Sangay", start_time=3 * 86400, end_time=9 * 86400)
+        self.assertEqual([t.amount for t in page], [30, 60])
+        self.assertEqual(len(self.account.query_transactions(counterparty="nobody")), 0)
+
+    def test_cursor_pagination(self):
+        seen = []
+        cursor = None
+        while True:
+            page = self.account.query_transactions(kind=DEPOSIT, limit=7, cursor=cursor)
+            seen.extend(t.amount for t in page)
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+        self.assertEqual(seen, [10 * i for i in range(30) if i % 3])
+
+    def test_aggregates(self):
+        log = self.account.transactions
+        self.assertEqual(log.totals_by_counterparty(TOPUP), {"17171122": 13, "77112233": 7})
+        weekly = log.totals_by_period(DEPOSIT, days=7)
+        self.assertEqual(weekly[0], 10 + 20 + 40 + 50)
+        self.assertEqual(sum(weekly.values()), sum(10 * i for i in range(30) if i % 3))
+
+class TestBenchmarkSuite(unittest.TestCase):
+    def test_suite_runs_and_compares(self):
+        scales = {"tiny": {"accounts": [50], "history": [20]}}
+        with patch.dict(bench.SCALES, scales), patch.object(bench, "SAMPLE_OPS", 200):
+            results = bench.run_suite("tiny", repeat=1)
+        self.assertIn("transfer[accounts=50]", results)
+        self.assertIn("update_display[history=20]", results)
+        slower = {name: {"ns_per_op": r["ns_per_op"] * 2} for name, r in results.items()}
+        self.assertEqual(bench.compare(results, slower), [])
+        regressions = bench.compare(slower, results, threshold=0.5)
+        self.assertEqual(len(regressions), len(results))
+        self.assertGreater(results["cold_import"]["ns_per_op"], 0)
+
+    def test_core_imports_without_tk(self):
+        code = ("import sys; sys.modules['tkinter'] = None; "
+                "import TaraDeviGhalley_02240131_A3 as bank; "
+                "account = bank.BankAccount('Sonam', 10); account.deposit(5); "
+                "print(account.balance, sorted(m for m in ('tkinter', 'numpy', 'asyncio', 'multiprocessing') "
+                "if sys.modules.get(m)))")
+        directory = os.path.dirname(os.path.abspath(bench.bank.__file__))
+        output = subprocess.run([sys.executable, "-c", code], cwd=directory, check=True,
+                                capture_output=True, text=True).stdout
+        self.assertEqual(output.split(), ["15", "[]"])
+
+class TestAccountStoreIndexes(unittest.TestCase):
+    def setUp(self):
+        self.store = AccountStore()
+        for name in ["Sonam", "sonam wangmo", "Sangay", "Pema"]:
+            self.store[name] = BankAccount(name, 100)
+
+    def test_ids_are_unique_and_indexed(self):
+        ids = [account.account_id for account in self.store.values()]
+        self.assertEqual(len(set(ids)), 4)
+        self.assertIs(self.store.get_by_id(ids[2]), self.store["Sangay"])
+        del self.store["Sangay"]
+        with self.assertRaises(AccountNotFoundError):
+            self.store.get_by_id(ids[2])
+
+    def test_prefix_search(self):
+        self.assertEqual(suggest_accounts(self.store, "so"), ["Sonam", "sonam wangmo"])
+        self.store["Sonam Choden"] = BankAccount("Sonam Choden")
+        del self.store["sonam wangmo"]
+        self.assertEqual([a.name for a in self.store.search_prefix("SONAM")], ["Sonam", "Sonam Choden"])
+        self.assertEqual(self.store.search_prefix("x"), [])
+        self.assertEqual(suggest_accounts({"Sonam": None, "Pema": None}, "p"), ["Pema"])
+
+    def test_phone_index(self):
+        self.store["Sonam"].mobile_topup(10, "17171122")
+        self.assertEqual(self.store.find_by_phone("17171122"), [self.store["Sonam"]])
+        self.store["Pema"].mobile_topup(10, "17171122")
+        self.assertEqual(len(self.store.find_by_phone("17171122")), 2)
+        self.assertEqual(self.store.find_by_phone("77000000"), [])
+
+    def test_ids_survive_ledger_restart(self):
+        with tempfile.TemporaryDirectory() as path:
+            with Ledger(path) as ledger:
+                ledger.accounts["Sonam"] = BankAccount("Sonam", 10)
+                first_id = ledger.accounts["Sonam"].account_id
+                ledger.accounts["Sangay"] = BankAccount("Sangay", 10)
+                ledger.checkpoint()
+                ledger.accounts["Pema"] = BankAccount("Pema", 10)
+                last_id = ledger.accounts["Pema"].account_id
+            with Ledger(path) as ledger:
+                self.assertEqual(ledger.accounts.get_by_id(first_id).name, "Sonam")
+                self.assertEqual(ledger.accounts.get_by_id(last_id).name, "Pema")
+                self.assertGreater(BankAccount("New").account_id, last_id)
+
+class TestShardedLedger(unittest.TestCase):
+    def setUp(self):
+        self.ledger = ShardedLedger(shards=3)
+        created = self.ledger.execute([("create", name, 100) for name in ["Sonam", "Sangay", "Pema", "Tashi"]])
+        self.ids = [result for _, result in created]
+
+    def tearDown(self):
+        self.ledger.close()
+
+    def test_cross_shard_transfers(self):
+        sonam, sangay, pema, tashi = self.ids
+        self.assertNotEqual(self.ledger.shard_of(sonam), self.ledger.shard_of(sangay))
+        results = self.ledger.execute([
+            ("transfer", sonam, sangay, 60),
+            ("transfer", sonam, pema, 60),     # insufficient after the first
+            ("transfer", tashi, 999, 10),      # unknown target: refunded
+            ("topup", pema, 5, "17171122"),
+            ("balance", sangay),
+        ])
+        self.assertEqual(results[0], (True, 40))
+        self.assertFalse(results[1][0])
+        self.assertIn("InsufficientFundsError", results[1][1])
+        self.assertFalse(results[2][0])
+        self.assertEqual(results[3], (True, 95))
+        self.assertEqual(self.ledger.execute([("balance", tashi)]), [(True, 100)])
+        self.assertEqual(self.ledger.execute([("history", sangay)]), [(True, ["Received: 60 from Sonam"])])
+        self.assertEqual(self.ledger.total(), 395)
+
+    def test_malformed_op_fails_alone(self):
+        sonam = self.ids[0]
+        results = self.ledger.execute([("deposit", sonam, "5"), ("deposit", sonam, 5)])
+        self.assertFalse(results[0][0])
+        self.assertIn("TypeError", results[0][1])
+        self.assertEqual(results[1], (True, 105))
+        self.assertEqual(self.ledger.execute([("balance", sonam)]), [(True, 105)])
+        self.assertEqual(self.ledger.execute([("withdrew", sonam, 5)]),
+                         [(False, "ValueError: unknown shard op 'withdrew'")])
+
+    def test_delete_waits_for_transfer_in_progress(self):
+        sonam, sangay = self.ids[:2]
+        results = self.ledger.execute([("transfer", sonam, sangay, 50), ("delete", sonam)])
+        self.assertEqual(results[0], (True, 50))
+        self.assertFalse(results[1][0])
+        self.assertIn("in progress", results[1][1])
+        self.assertEqual(self.ledger.total(), 400)
+        self.assertEqual(self.ledger.execute([("delete", sonam)])[0][0], True)
+
+    def test_benchmark_conserves_money(self):
+        results = benchmark_sharded(shard_counts=(1, 2), accounts=20, ops=400, batch_size=100)
+        self.assertEqual([r["shards"] for r in results], [1, 2])
+
+class TestImportExport(unittest.TestCase):
+    def setUp(self):
+        self.accounts = {"Sonam": BankAccount("Sonam", 1000), "Sangay": BankAccount("Sangay", 500)}
+        self.accounts["Sonam"].deposit(200)
+        self.accounts["Sonam"].transfer(150.5, self.accounts["Sangay"])
+        self.accounts["Sangay"].mobile_topup(50, "17171122")
+
+    def round_trip(self, fmt):
+        out = io.StringIO()
+        self.assertEqual(export_accounts(self.accounts, out, fmt), 6)
+        restored = AccountStore()
+        report = import_accounts(io.StringIO(out.getvalue()), restored, fmt, batch_size=2)
+        self.assertEqual((report.accounts, report.transactions, report.failed), (2, 4, 0))
+        for name, account in self.accounts.items():
+            self.assertEqual(restored[name].balance, account.balance)
+            self.assertEqual(list(restored[name].get_transactions()), list(account.get_transactions()))
+
+    def test_csv_round_trip(self):
+        self.round_trip("csv")
+
+    def test_import_updates_built_phone_index(self):
+        out = io.StringIO()
+        export_accounts(self.accounts, out)
+        restored = AccountStore()
+        self.assertEqual(restored.find_by_phone("17171122"), [])
+        import_accounts(io.StringIO(out.getvalue()), restored)
+        self.assertEqual(restored.find_by_phone("17171122"), [restored["Sangay"]])
+
+    def test_jsonl_round_trip(self):
+        self.round_trip("jsonl")
+
+    def test_bad_rows_are_reported(self):
+        lines = [
+            '{"record": "account", "name": "Pema", "balance": 100}',
+            '{"record": "account", "name": "Pema", "balance": 100}',
+            '{"record": "account", "name": "Tashi", "balance": -5}',
+            '{"record": "transaction", "name": "Pema", "kind": "deposit", "amount": "abc", "timestamp": 1}',
+            '{"record": "transaction", "name": "Dorji", "kind": "deposit", "amount": 5, "timestamp": 1}',
+            '{"record": "transaction", "name": "Pema", "kind": "bonus", "amount": 5, "timestamp": 1}',
+            'not json',
+            '{"record": "transaction", "name": "Pema", "kind": "deposit", "amount": 5, "timestamp": 1}',
+        ]
+        accounts = {}
+        report = import_accounts(lines, accounts, "jsonl")
+        self.assertEqual((report.accounts, report.transactions, report.failed), (1, 1, 6))
+        self.assertEqual([type(e) for _, e in report.errors], [
+            DuplicateAccountError, InvalidAmountError, InvalidAmountError,
+            AccountNotFoundError, InvalidRecordError, InvalidRecordError])
+        self.assertEqual([n for n, _ in report.errors], [2, 3, 4, 5, 6, 7])
+        self.assertEqual(list(accounts["Pema"].get_transactions()), ["Deposited: 5"])
+
+class TestScriptMode(unittest.TestCase):
+    SCRIPT = """# opening accounts
+create Sonam 1000
+create Sangay
+deposit Sonam 200
+withdraw Sangay 50
+transfer Sonam Sangay 300
+
+frobnicate Sonam
+topup Sonam 17171122 abc
+balance Sangay
+delete Sangay
+balance Sangay
+"""
+
+    def test_results_per_command(self):
+        accounts = {}
+        out = io.StringIO()
+        self.assertEqual(run_script(io.StringIO(self.SCRIPT), accounts, out), (10, 4))
+        self.assertEqual(out.getvalue().splitlines(), [
+            "2\tok\t1000",
+            "3\tok\t0",
+            "4\tok\t1200",
+            "5\terror\tInsufficientFundsError\tInsufficient funds for withdrawal",
+            "6\tok\t900",
+            "8\terror\tInvalidRecordError\tUnknown command: frobnicate",
+            "9\terror\tInvalidAmountError\tAmount is not a number: 'abc'",
+            "10\tok\t300",
+            "11\tok\t",
+            "12\terror\tAccountNotFoundError\tAccount not found",
+        ])
+        self.assertEqual(list(accounts), ["Sonam"])
+
+    def test_jsonl_results(self):
+        out = io.StringIO()
+        run_script(["create Sonam 10", "history Sonam", "withdraw Sonam"], {}, out, "jsonl")
+        results = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(results[1], {"line": 2, "ok": True, "result": {"balance": 10, "transactions": []}})
+        self.assertEqual(results[2]["error"], "InvalidRecordError")
+
+class TestTopupDispatcher(unittest.TestCase):
+    def run_topups(self, gateway, topups, **options):
+        account = BankAccount("Sonam", 1000)
+
+        async def scenario():
+            dispatcher = await TopupDispatcher(gateway, backoff=0.001, **options).start()
+            futures = [dispatcher.submit(account, amount, phone) for phone, amount in topups]
+            await dispatcher.close()
+            return dispatcher, [f.result() for f in futures]
+
+        dispatcher, outcomes = asyncio.run(scenario())
+        return account, dispatcher, outcomes
+
+    def test_batches_per_carrier(self):
+        gateway = LocalGateway(latency=0)
+        topups = [("17171122", 10), ("77112233", 20), ("17171122", 5)] * 4
+        account, dispatcher, outcomes = self.run_topups(gateway, topups, batch_size=4, pool_size=2)
+        self.assertTrue(all(outcomes))
+        self.assertEqual(gateway.delivered, {"17171122": 60, "77112233": 80})
+        self.assertEqual(gateway.batches, 3)  # 8 B-Mobile in two batches, 4 TashiCell in one
+        self.assertLessEqual(gateway.connections, 2)
+        self.assertEqual(account.balance, 860)
+
+    def test_permanent_failure_is_refunded(self):
+        gateway = LocalGateway(latency=0, reject={"77000000"})
+        account, dispatcher, outcomes = self.run_topups(gateway, [("17171122", 10), ("77000000", 25)])
+        self.assertEqual(outcomes, [True, False])
+        self.assertEqual(account.balance, 990)
+        self.assertEqual(list(account.get_transactions())[-1], "Refunded: 25 for top-up to 77000000")
+
+    def test_transient_failures_are_retried(self):
+        gateway = LocalGateway(latency=0, failure_rate=0.5, seed=3)
+        account, dispatcher, outcomes = self.run_topups(gateway, [("17171122", 1)] * 50, batch_size=5, retries=10)
+        self.assertTrue(all(outcomes))
+        self.assertGreater(gateway.batches, 10)
+
+        gateway = LocalGateway(latency=0, failure_rate=1.0)
+        account, dispatcher, outcomes = self.run_topups(gateway, [("17171122", 10)], retries=2)
+        self.assertEqual((outcomes, account.balance, gateway.batches), ([False], 1000, 3))
+
+    def test_failed_connection_frees_its_slot(self):
+        gateway = LocalGateway(latency=0, failure_rate=1.0)
+        account, dispatcher, outcomes = self.run_topups(gateway, [("17171122", 10), ("77112233", 20)],
+                                                        batch_size=1, pool_size=1, retries=1)
+        self.assertEqual((outcomes, account.balance), ([False, False], 1000))
+
+    def test_unknown_carrier_is_rejected_before_debit(self):
+        account = BankAccount("Sonam", 1000)
+
+        async def scenario():
+            dispatcher = await TopupDispatcher(LocalGateway(latency=0)).start()
+            with self.assertRaises(TopupDeliveryError):
+                dispatcher.submit(account, 10, "12345678")
+            await dispatcher.close()
+
+        asyncio.run(scenario())
+        self.assertEqual(account.balance, 1000)
+
+    def test_benchmark_delivers_everything(self):
+        results = benchmark_topups(batch_sizes=(1, 50), count=200, latency=0)
+        self.assertEqual([r["delivered"] for r in results], [200, 200])
+        self.assertEqual(results[1]["gateway_calls"], 4)
+
+class TestMetrics(unittest.TestCase):
+    def tearDown(self):
+        disable_metrics()
+
+    def test_counts_errors_and_latency(self):
+        import TaraDeviGhalley_02240131_A3 as bank
+        metrics = enable_metrics()
+        account = BankAccount("Sonam", 100)
+        account.deposit(50)
+        account.deposit(25)
+        with self.assertRaises(InsufficientFundsError):
+            account.withdraw(1000)
+        with patch.object(builtins, "input", lambda prompt="": "-5"), patch("sys.stdout"):
+            bank.processUserInput("3", {"Sonam": account}, account)
+        snapshot = json.loads(metrics.to_json())
+        self.assertEqual(snapshot["operations"]["deposit"]["count"], 3)
+        self.assertEqual(snapshot["operations"]["withdraw"]["buckets"]["+Inf"], 1)
+        self.assertEqual(snapshot["operations"]["processUserInput"]["count"], 1)
+        self.assertEqual(snapshot["errors"], {"withdraw": {"InsufficientFundsError": 1},
+                                              "deposit": {"InvalidAmountError": 1}})
+        text = metrics.to_prometheus()
+        self.assertIn('bank_operations_total{op="deposit"} 3', text)
+        self.assertIn('bank_errors_total{op="withdraw",error="InsufficientFundsError"} 1', text)
+        self.assertIn('bank_operation_duration_seconds_count{op="deposit"} 3', text)
+        self.assertIn('bank_operation_duration_seconds_bucket{op="deposit",le="+Inf"} 3', text)
+
+    def test_disable_restores_methods(self):
+        import TaraDeviGhalley_02240131_A3 as bank
+        original_deposit, original_input = BankAccount.deposit, bank.processUserInput
+        metrics = enable_metrics()
+        self.assertIsNot(BankAccount.deposit, original_deposit)
+        disable_metrics()
+        self.assertIs(BankAccount.deposit, original_deposit)
+        self.assertIs(bank.processUserInput, original_input)
+        BankAccount("Sonam", 0).deposit(5)
+        self.assertEqual(metrics.histograms["deposit"].count, 0)
+
+class TestPointInTimeBalances(unittest.TestCase):
+    def build(self, count, start=1000.0):
+        account = BankAccount("Sonam", 500)
+        for i in range(count):
+            if i % 3:
+                account.transactions.append(DEPOSIT, 10, None, start + i)
+                account.balance += 10
+            else:
+                account.transactions.append(WITHDRAWAL, 4, None, start + i)
+                account.balance -= 4
+        return account
+
+    def expected(self, count, timestamp, start=1000.0):
+        return 500 + sum((10 if i % 3 else -4) for i in range(count) if start + i <= timestamp)
+
+    def test_matches_full_replay(self):
+        account = self.build(300)
+        for timestamp in (0, 1000, 1000.5, 1063, 1064, 1150.2, 1299, 5000):
+            self.assertEqual(account.balance_at(timestamp), self.expected(300, timestamp))
+
+    def test_checkpoints_follow_new_transactions(self):
+        account = self.build(100)
+        account.balance_at(1050)
+        account.transactions.extend([(DEPOSIT, 10, None, 1100.0 + i) for i in range(100)])
+        account.balance += 1000
+        account.deposit(1)
+        checkpoints = account.transactions.checkpoints()
+        self.assertTrue(checkpoints.ordered)
+        self.assertEqual(len(checkpoints.prefix), 1 + 201 // 64)
+        self.assertEqual(account.balance_at(1150), self.expected(100, 1150) + 510)
+        self.assertEqual(account.balance_at(time.time() + 1), account.balance)
+
+    def test_out_of_order_history(self):
+        account = self.build(10)
+        account.transactions.append(DEPOSIT, 100, None, 500.0)
+        account.balance += 100
+        self.assertFalse(account.transactions.checkpoints().ordered)
+        self.assertEqual(account.balance_at(600), 600)
+        self.assertEqual(account.balance_at(1000), 596)
+
+    def test_bulk_balances(self):
+        sonam, sangay = self.build(100), BankAccount("Sangay", 50)
+        self.assertEqual(balances_at({"Sonam": sonam, "Sangay": sangay}, 1010),
+                         {"Sonam": self.expected(100, 1010), "Sangay": 50})
+
+class TestStatements(unittest.TestCase):
+    def setUp(self):
+        self.accounts = AccountStore()
+        for name in ["Sonam", "Sangay", "Pema"]:
+            account = BankAccount(name, 100)
+            account.transactions.append(DEPOSIT, 50, None, 1000.0)
+            account.transactions.append(WITHDRAWAL, 30, None, 2000.0)
+            account.transactions.append(TRANSFER_IN, 5, "Tashi", 3000.0)
+            account.balance += 25
+            self.accounts[name] = account
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = tmp.name
+
+    def read(self, name):
+        with open(os.path.join(self.directory, name)) as f:
+            return f.read()
+
+    def test_account_pickles_without_store(self):
+        copy = pickle.loads(pickle.dumps(self.accounts["Sonam"]))
+        self.assertIsNone(copy._store)
+        self.assertEqual(list(copy.get_transactions()), list(self.accounts["Sonam"].get_transactions()))
+
+    def test_per_account_files_and_resume(self):
+        result = generate_statements(self.accounts, 1500, 3000, self.directory, processes=2, chunk_size=2)
+        self.assertEqual(result, {"written": 3, "skipped": 0})
+        sangay = self.accounts["Sangay"].account_id
+        text = self.read(f"statement-{sangay}-1500-3000.txt")
+        self.assertIn("Statement for Sangay", text)
+        self.assertIn("Opening balance: 150.00", text)
+        self.assertIn("Withdrew: 30", text)
+        self.assertIn("Received: 5 from Tashi", text)
+        self.assertNotIn("Deposited", text)
+        self.assertIn("Total credits: 5.00\nTotal debits: 30.00\nClosing balance: 125.00", text)
+
+        os.remove(os.path.join(self.directory, f"statement-{sangay}-1500-3000.txt"))
+        result = generate_statements(self.accounts, 1500, 3000, self.directory, processes=2, chunk_size=2)
+        self.assertEqual(result, {"written": 1, "skipped": 2})
+
+    def test_combined_file(self):
+        result = generate_statements(self.accounts, 0, 5000, self.directory, combined=True, processes=2, chunk_size=2)
+        self.assertEqual(result["written"], 3)
+        text = self.read("statements-0-5000.txt")
+        self.assertEqual([line for line in text.splitlines() if line.startswith("Statement for")],
+                         ["Statement for Sonam (account %d)" % self.accounts["Sonam"].account_id,
+                          "Statement for Sangay (account %d)" % self.accounts["Sangay"].account_id,
+                          "Statement for Pema (account %d)" % self.accounts["Pema"].account_id])
+        self.assertEqual(os.listdir(self.directory), ["statements-0-5000.txt"])
+        self.assertEqual(generate_statements(self.accounts, 0, 5000, self.directory, combined=True),
+                         {"written": 0, "skipped": 3})
+
+    def test_progress_can_stop_and_resume(self):
+        seen = []
+
+        def progress(done, total):
+            seen.append((done, total))
+            return len(seen) < 2  # stop before the second chunk
+
+        result = generate_statements(self.accounts, 0, 5000, self.directory, combined=True, processes=1,
+                                     chunk_size=2, progress=progress)
+        self.assertEqual(result, {"written": 2, "skipped": 0})
+        self.assertEqual(seen, [(0, 3), (0, 3), (2, 3)])
+        self.assertFalse(os.path.exists(os.path.join(self.directory, "statements-0-5000.txt")))
+        result = generate_statements(self.accounts, 0, 5000, self.directory, combined=True, processes=1, chunk_size=2)
+        self.assertEqual(result, {"written": 1, "skipped": 2})
+        self.assertEqual(self.read("statements-0-5000.txt").count("Statement for"), 3)
+
+    def test_workers_do_not_inherit_held_locks(self):
+        enable_concurrency(1)
+        self.addCleanup(disable_concurrency)
+        locked = threading.Event()
+
+        def writer():  # holds the only stripe while the pool forks
+            with BankAccount._locks.hold(self.accounts["Sonam"]):
+                locked.set()
+                time.sleep(0.3)
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        locked.wait(5)
+        result = generate_statements(self.accounts, 0, 5000, self.directory, processes=1)
+        thread.join()
+        self.assertEqual(result, {"written": 3, "skipped": 0})
+
+    def test_periods_share_a_directory(self):
+        generate_statements(self.accounts, 0, 1500, self.directory, processes=1)
+        self.assertEqual(generate_statements(self.accounts, 1500, 3000, self.directory, processes=1),
+                         {"written": 3, "skipped": 0})
+        sonam = self.accounts["Sonam"].account_id
+        self.assertIn("Deposited: 50", self.read(f"statement-{sonam}-0-1500.txt"))
+        self.assertIn("Withdrew: 30", self.read(f"statement-{sonam}-1500-3000.txt"))
+
+class TestRenderCache(unittest.TestCase):
+    def test_versions_change_with_every_mutation(self):
+        sonam, sangay = BankAccount("Sonam", 1000), BankAccount("Sangay", 500)
+        seen = {sonam.version, sangay.version}
+        for change in (lambda: sonam.deposit(5), lambda: sonam.withdraw(5),
+                       lambda: sonam.mobile_topup(5, "17171122")):
+            change()
+            self.assertNotIn(sonam.version, seen)
+            seen.add(sonam.version)
+        sonam.transfer(10, sangay)
+        self.assertNotIn(sangay.version, seen)
+        seen |= {sonam.version, sangay.version}
+        post_batch([sonam], ["deposit"], [1])
+        self.assertNotIn(sonam.version, seen)
+
+    def test_rendering_is_cached_until_the_account_changes(self):
+        cache = RenderCache()
+        account = BankAccount("Sonam", 1000)
+        account.deposit(200)
+        calls = []
+        render = lambda: calls.append(1) or "".join(account.get_transactions())
+        self.assertEqual(cache.get(account, ("all",), render), "Deposited: 200")
+        self.assertEqual(cache.get(account, ("all",), render), "Deposited: 200")
+        self.assertEqual((len(calls), cache.hits, cache.misses), (1, 1, 1))
+        account.withdraw(50)
+        self.assertEqual(cache.get(account, ("all",), render), "Deposited: 200Withdrew: 50")
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(render_history(account), "- Deposited: 200\n- Withdrew: 50\n")
+
+    def test_bounded_lru(self):
+        cache = RenderCache(max_entries=2, max_chars=10)
+        a, b, c = BankAccount("A"), BankAccount("B"), BankAccount("C")
+        cache.get(a, (), lambda: "aaa")
+        cache.get(b, (), lambda: "bbb")
+        cache.get(a, (), lambda: "unused")
+        cache.get(c, (), lambda: "ccc")  # evicts b, the least recently used
+        self.assertEqual(cache.get(a, (), lambda: "new"), "aaa")
+        self.assertEqual(cache.get(b, (), lambda: "BBB"), "BBB")
+        self.assertEqual(len(cache), 2)
+        cache.get(c, ("long",), lambda: "x" * 11)  # too large to keep
+        self.assertLessEqual(cache.chars, 10)
+        self.assertEqual(len(cache), 2)
+
+class TestTransactionLimits(unittest.TestCase):
+    def tearDown(self):
+        disable_limits()
+
+    def test_count_and_amount_limits(self):
+        enable_limits([LimitPolicy(TOPUP, 3600, max_count=3), LimitPolicy(WITHDRAWAL, 86400, max_amount=500)])
+        account = BankAccount("Sonam", 10000)
+        for _ in range(3):
+            account.mobile_topup(10, "17171122")
+        with self.assertRaises(TransactionLimitError):
+            account.mobile_topup(10, "17171122")
+        account.withdraw(300)
+        with self.assertRaises(TransactionLimitError):
+            account.withdraw(201)
+        account.withdraw(200)
+        self.assertEqual(account.balance, 10000 - 30 - 500)
+        account.deposit(1000)  # no policy on deposits
+        other = BankAccount("Sangay", 100)
+        other.mobile_topup(10, "77112233")  # limits are per account
+        self.assertEqual(len(account.transactions), 6)
+
+    def test_window_slides(self):
+        engine = LimitEngine([LimitPolicy(TOPUP, 60, max_count=2, buckets=6)])
+        account = BankAccount("Sonam")
+        engine.record(account, TOPUP, 1, 1000.0)
+        engine.record(account, TOPUP, 1, 1035.0)
+        with self.assertRaises(TransactionLimitError):
+            engine.check(account, TOPUP, 1, 1059.0)
+        engine.check(account, TOPUP, 1, 1060.0)  # the first top-up's bucket has expired
+        with self.assertRaises(TransactionLimitError):
+            engine.check(account, TOPUP, 1, 1060.0, pending_count=1)
+        engine.check(account, TOPUP, 1, 5000.0)
+
+    def test_batches_respect_limits(self):
+        enable_limits([LimitPolicy(WITHDRAWAL, 86400, max_count=2)])
+        account = BankAccount("Sonam", 1000)
+        account.withdraw(1)
+        result = post_batch([account] * 3, ["withdraw", "withdraw", "deposit"], [5, 5, 5])
+        self.assertEqual(list(result.failures), [1])
+        self.assertIsInstance(result.failures[1], TransactionLimitError)
+        self.assertEqual(account.balance, 999)
+        with self.assertRaises(TransactionLimitError):
+            account.withdraw(1)
+
+class TestStoreSnapshots(unittest.TestCase):
+    def setUp(self):
+        self.store = AccountStore()
+        for name in ["Sonam", "Sangay", "Pema"]:
+            self.store[name] = BankAccount(name, 100)
+
+    def test_snapshot_is_frozen(self):
+        with self.store.snapshot() as snapshot:
+            self.store["Sonam"].transfer(40, self.store["Sangay"])
+            self.store["Tashi"] = BankAccount("Tashi", 7)
+            del self.store["Pema"]
+            post_batch([self.store["Sangay"]], ["withdraw"], [10])
+            self.assertEqual(dict(snapshot.items()), {"Sonam": 100, "Sangay": 100, "Pema": 100})
+            with self.store.snapshot() as later:
+                self.assertEqual(dict(later.items()), {"Sonam": 60, "Sangay": 130, "Tashi": 7})
+        self.assertEqual(self.store.snapshot().total(), 197)
+
+    def test_old_versions_are_dropped(self):
+        sonam = self.store["Sonam"]
+        snapshot = self.store.snapshot()
+        for _ in range(5):
+            sonam.deposit(1)
+        self.assertEqual(len(self.store._versions._chains[sonam.account_id]), 2)
+        second = self.store.snapshot()
+        sonam.deposit(1)
+        self.assertEqual(len(self.store._versions._chains[sonam.account_id]), 3)
+        self.assertEqual((snapshot.get(sonam.account_id), second.get(sonam.account_id)), (100, 105))
+        snapshot.close()
+        second.close()
+        sonam.deposit(1)
+        self.assertEqual(len(self.store._versions._chains[sonam.account_id]), 1)
+
+    def test_readers_never_see_a_torn_transfer(self):
+        enable_concurrency(8)
+        self.addCleanup(disable_concurrency)
+        names = list(self.store)
+        stop = threading.Event()
+
+        def writer(seed):
+            rng = random.Random(seed)
+            while not stop.is_set():
+                source, target = rng.sample(names, 2)
+                try:
+                    self.store[source].transfer(rng.randint(1, 20), self.store[target])
+                except InsufficientFundsError:
+                    pass
+
+        threads = [threading.Thread(target=writer, args=(seed,)) for seed in range(3)]
+        for thread in threads:
+            thread.start()
+        try:
+            for _ in range(300):
+                with self.store.snapshot() as snapshot:
+                    self.assertEqual(snapshot.total(), 300)
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+class TestTieredHistory(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.archive = HistoryArchive(tmp.name)
+        self.addCleanup(self.archive.close)
+        self.account = BankAccount("Sonam", 10**6)
+        for i in range(2 * SEGMENT_ENTRIES + 50):
+            if i % 3:
+                self.account.deposit(i + 1)
+            else:
+                self.account.mobile_topup(1, f"1717{i % 7:04d}")
+        self.expected = list(self.account.get_transactions())
+
+    def test_spill_keeps_history_readable(self):
+        log = self.account.transactions
+        middle = log._times[SEGMENT_ENTRIES]
+        balance = self.account.balance_at(middle)
+        self.assertEqual(log.spill(self.archive, keep=50), 2 * SEGMENT_ENTRIES)
+        self.assertEqual(len(log._kinds), 50)
+        self.assertEqual(list(self.account.get_transactions()), self.expected)
+        self.assertEqual(log.render(5, 8), self.expected[5:8])
+        self.assertEqual(self.account.balance_at(middle), balance)
+        self.assertEqual(len(log.query(phone="17170003", limit=None).records), len(
+            [line for line in self.expected if line.endswith("17170003")]))
+
+    def test_appends_and_snapshots_after_spill(self):
+        spill_histories({"Sonam": self.account}, self.archive, keep=10)
+        self.account.withdraw(5)
+        self.assertEqual(self.account.get_transactions()[-1], "Withdrew: 5")
+        restored = pickle.loads(pickle.dumps(self.account.transactions))
+        self.assertEqual(restored.render(), self.expected + ["Withdrew: 5"])
+
+    def test_bulk_appends_after_spill_keep_indexes_current(self):
+        log = self.account.transactions
+        log.spill(self.archive, keep=50)
+        self.assertEqual(len(log.query(kind=DEPOSIT, limit=None).records),
+                         len([line for line in self.expected if line.startswith("Deposited")]))
+        self.account.balance_at(time.time())
+        balance = self.account.balance
+        result = post_batch([self.account, self.account], ["deposit", "deposit"], [5, 7])
+        self.assertTrue(result.ok)
+        log.extend([(DEPOSIT, 3, None, time.time())])
+        self.account.balance += 3
+        self.assertEqual(self.account.balance, balance + 15)
+        self.assertEqual(log.render(-3), ["Deposited: 5", "Deposited: 7", "Deposited: 3"])
+        self.assertEqual(log.query(kind=DEPOSIT, min_amount=3, max_amount=3, limit=None).records[-1].amount, 3)
+        self.assertEqual(self.account.balance_at(time.time()), self.account.balance)
+
+    def test_short_histories_stay_in_memory(self):
+        sangay = BankAccount("Sangay", 100)
+        sangay.deposit(1)
+        self.assertEqual(spill_histories({"Sangay": sangay}, self.archive), 0)
+        self.assertIsNone(sangay.transactions._spilled)
+
+    def test_close_removes_segment_files(self):
+        self.account.transactions.spill(self.archive, keep=0)
+        self.assertTrue(os.listdir(self.archive.directory))
+        self.archive.close()
+        self.assertEqual(os.listdir(self.archive.directory), [])
+
+class TestGuiWorker(unittest.TestCase):
+    def setUp(self):
+        self.root = bench._FakeLoop()
+        self.worker = GuiWorker(self.root)
+        self.addCleanup(self.worker.close)
+
+    def test_calls_run_in_order_off_the_tk_thread(self):
+        account = BankAccount("Sonam", 0)
+        callbacks = []
+        for amount in (10, 20, 30):
+            self.worker.call(account.deposit, amount, on_done=lambda _: callbacks.append(threading.get_ident()))
+        worker_thread = self.worker.call(threading.get_ident, on_done=callbacks.append)
+        self.worker.flush()
+        self.assertTrue(worker_thread.done)
+        self.assertEqual(list(account.get_transactions()), ["Deposited: 10", "Deposited: 20", "Deposited: 30"])
+        self.assertEqual(callbacks[:3], [threading.get_ident()] * 3)
+        self.assertNotEqual(callbacks[3], threading.get_ident())
+
+    def test_errors_go_to_on_error(self):
+        errors = []
+        self.worker.call(BankAccount("Sonam", 10).withdraw, 50, on_error=errors.append)
+        self.worker.flush()
+        self.assertIsInstance(errors[0], InsufficientFundsError)
+
+    def test_job_progress_and_cancel(self):
+        started = threading.Event()
+
+        def count(job):
+            done = 0
+            started.set()
+            while not job.cancelled:
+                done += 1
+                job.report(done)
+                time.sleep(0.001)
+            return done
+
+        progress, results = [], []
+        job = self.worker.start(count, on_progress=lambda done, total: progress.append(done), on_done=results.append)
+        started.wait(5)
+        self.root.run_until(lambda: len(progress) >= 2)
+        job.cancel()
+        self.root.run_until(lambda: results)
+        self.assertTrue(job.done)
+        self.assertLessEqual(len(progress), results[0])
+        self.assertGreater(self.worker.loop_latency.count, 0)
+
+    def test_gui_actions_run_on_the_worker(self):
+        with patch.object(bench.bank, "tk", bench._FakeTk), patch.object(bench.bank, "messagebox") as box, \
+                patch.object(bench.bank, "simpledialog") as dialog:
+            gui = BankingAppGUI(self.root)
+            self.addCleanup(gui.worker.close)
+            gui.current_account = BankAccount("Sonam", 100)
+            dialog.askfloat.return_value = 50
+            for _ in range(3):
+                gui.withdraw()
+            self.assertEqual(box.showinfo.call_count, 0)
+            gui.worker.flush()
+        self.assertEqual(gui.current_account.balance, 0)
+        self.assertEqual(box.showinfo.call_count, 2)
+        box.showerror.assert_called_once_with("Error", "Insufficient funds for withdrawal")
+
+    def test_gui_create_rechecks_the_name_on_the_worker(self):
+        with patch.object(bench.bank, "tk", bench._FakeTk), patch.object(bench.bank, "messagebox") as box, \
+                patch.object(bench.bank, "simpledialog") as dialog:
+            gui = BankingAppGUI(self.root)
+            self.addCleanup(gui.worker.close)
+            busy = threading.Event()
+            gui.worker.call(busy.wait, 5)  # e.g. an import still running
+            dialog.askstring.return_value = "Pema"
+            dialog.askfloat.side_effect = [500, 0]
+            gui.create_account()
+            gui.create_account()
+            busy.set()
+            gui.worker.flush()
+        self.assertEqual(gui.accounts["Pema"].balance, 500)
+        box.showinfo.assert_called_once_with("Success", "Account created for Pema")
+        box.showerror.assert_called_once_with("Error", "Account with this name already exists")
+
+    def test_gui_transfer_rechecks_the_recipient_on_the_worker(self):
+        store = AccountStore()
+        for name in "ABC":
+            store[name] = BankAccount(name, 100)
+        with patch.object(bench.bank, "tk", bench._FakeTk), patch.object(bench.bank, "messagebox") as box, \
+                patch.object(bench.bank, "simpledialog") as dialog:
+            gui = BankingAppGUI(self.root, store)
+            self.addCleanup(gui.worker.close)
+            busy = threading.Event()
+            gui.worker.call(busy.wait, 5)
+            gui.current_account = store["B"]
+            box.askyesno.return_value = True
+            gui.delete_account()
+            gui.current_account = store["A"]
+            dialog.askstring.return_value = "B"
+            dialog.askfloat.return_value = 60
+            gui.transfer()
+            busy.set()
+            gui.worker.flush()
+        self.assertEqual({name: account.balance for name, account in store.items()}, {"A": 100, "C": 100})
+        box.showerror.assert_called_once_with("Error", "Recipient account not found")
+
+    def test_gui_select_runs_on_the_worker(self):
+        store = AccountStore()
+        store["Sonam"] = BankAccount("Sonam", 100)
+        with patch.object(bench.bank, "tk", bench._FakeTk), patch.object(bench.bank, "messagebox") as box, \
+                patch.object(bench.bank, "simpledialog") as dialog:
+            gui = BankingAppGUI(self.root, store)
+            self.addCleanup(gui.worker.close)
+            dialog.askstring.return_value = "so"
+            gui.select_account()
+            gui.worker.flush()
+            box.showerror.assert_called_once_with("Error", "Account not found. Did you mean: Sonam?")
+            dialog.askstring.return_value = "Sonam"
+            gui.select_account()
+            gui.worker.flush()
+        self.assertIs(gui.current_account, store["Sonam"])
+
+    def test_gui_import_job(self):
+        source = {"Sonam": BankAccount("Sonam", 100)}
+        source["Sonam"].deposit(5)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, "accounts.csv")
+        with open(path, "w", newline="") as f:
+            export_accounts(source, f)
+        with patch.object(bench.bank, "tk", bench._FakeTk), patch.object(bench.bank, "messagebox") as box, \
+                patch.object(bench.bank, "filedialog") as files:
+            gui = BankingAppGUI(self.root)
+            self.addCleanup(gui.worker.close)
+            files.askopenfilename.return_value = path
+            gui.import_accounts()
+            gui.worker.flush()
+        self.assertEqual(list(gui.accounts["Sonam"].get_transactions()), ["Deposited: 5"])
+        box.showinfo.assert_called_once_with("Import", "Imported 1 accounts and 1 transactions (0 bad rows)")
+        self.assertTrue(gui.job.done)
+
 class TestProcessUserInput(unittest.TestCase):
     def setUp(self):
         self.accounts = {
@@ -85,6 +1315,12 @@ class TestProcessUserInput(unittest.TestCase):
             _, current_account = processUserInput('2', self.accounts, None)
         self.assertIsNone(current_account)
 
+    def test_invalid_account_suggests_names(self):
+        with patch('builtins.input', return_value='so'), patch('builtins.print') as printed:
+            _, current_account = processUserInput('2', self.accounts, None)
+        self.assertIsNone(current_account)
+        printed.assert_called_with("Did you mean: Sonam?")
+
     def test_deposit_no_account(self):
         _, current_account = processUserInput('3', self.accounts, None)
         self.assertIsNone(current_account)